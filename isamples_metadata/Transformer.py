@@ -45,6 +45,9 @@ class Transformer(ABC):
 
     DEFAULT_H3_RESOLUTION = 15
 
+    # Increment when a change alters the transformed output, so that cached core content is regenerated
+    TRANSFORMER_VERSION = 1
+
     @staticmethod
     def _transform_key_to_label(
         key: str,
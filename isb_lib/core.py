@@ -6,6 +6,7 @@ import datetime
 import hashlib
 import json
 import traceback
+import functools
 import typing
 import faulthandler
 from signal import SIGINT
@@ -32,20 +33,20 @@ from isamples_metadata.solr_field_constants import SOLR_PRODUCED_BY_SAMPLING_SIT
 from isamples_metadata.vocabularies import vocabulary_mapper
 from isb_lib.models.thing import Thing
 from isamples_metadata.Transformer import Transformer, geo_to_h3
-import dateparser
-from dateparser.date import DateDataParser
 import re
 import requests
-import shapely.wkt
-import shapely.geometry
 
+from isb_lib.utilities import h3_utilities, stage_timer
 from isb_lib.vocabulary import vocab_adapter
-from isb_web import sqlmodel_database
+from isb_web import sqlmodel_database, config
 from isb_web.sqlmodel_database import SQLModelDAO
 from typing import Optional
 
 from isb_web.vocabulary import SAMPLEDFEATURE_URI, MATERIAL_URI, MATERIALSAMPLEOBJECTTYPE_URI
 
+if typing.TYPE_CHECKING:
+    import shapely.geometry.base
+
 RECOGNIZED_DATE_FORMATS = [
     "%Y",  # e.g. 1985
     "%Y-%m-%d",  # e.g. 1947-08-06
@@ -58,7 +59,14 @@ DATEPARSER_SETTINGS = {
     "TIMEZONE": "UTC",
     "RETURN_AS_TIMEZONE_AWARE": True,
 }
-ddp = DateDataParser(languages=["en"], settings=DATEPARSER_SETTINGS)
+
+
+@functools.lru_cache(maxsize=None)
+def _date_data_parser():
+    # dateparser takes a noticeable fraction of a second to import, so only load it when a date needs parsing
+    from dateparser.date import DateDataParser
+    return DateDataParser(languages=["en"], settings=DATEPARSER_SETTINGS)
+
 
 SOLR_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
 ELEVATION_PATTERN = re.compile(r"\s*(-?\d+\.?\d*)\s*m?", re.IGNORECASE)
@@ -68,6 +76,7 @@ MEDIA_JSON = "application/json"
 MEDIA_NQUADS = "application/n-quads"
 MEDIA_GEO_JSON = "application/geo+json"
 MEDIA_JSONL = "application/jsonl"
+MEDIA_NDJSON = "application/x-ndjson"
 
 
 def getLogger():
@@ -109,6 +118,12 @@ def things_main(ctx, db_url, solr_url, verbosity="INFO"):
     ctx.obj["solr_url"] = solr_url
 
 
+def vocabularies_initialized() -> bool:
+    return all(
+        uri in vocab_adapter.VOCAB_CACHE for uri in [SAMPLEDFEATURE_URI, MATERIAL_URI, MATERIALSAMPLEOBJECTTYPE_URI]
+    )
+
+
 def initialize_vocabularies(session: Session):
     repository = term_store.get_repository(session)
     vocab_adapter.uijson_vocabulary_dict(SAMPLEDFEATURE_URI, repository)
@@ -258,14 +273,16 @@ def coreRecordAsSolrDoc(transformer: Transformer) -> typing.Dict:
     Returns: The coreMetadata in solr document format, suitable for posting to the solr JSON api
     (https://solr.apache.org/guide/8_1/json-request-api.html)
     """
-    coreMetadata = transformer.transform()
+    with stage_timer.timed("transform", 1):
+        coreMetadata = transformer.transform()
 
-    last_updated = transformer.last_updated_time()
-    if last_updated is not None:
-        date_time = parsed_date(last_updated)
-        if date_time is not None:
-            coreMetadata["sourceUpdatedTime"] = datetimeToSolrStr(date_time)
-    return _coreRecordAsSolrDoc(coreMetadata)
+        last_updated = transformer.last_updated_time()
+        if last_updated is not None:
+            date_time = parsed_date(last_updated)
+            if date_time is not None:
+                coreMetadata["sourceUpdatedTime"] = datetimeToSolrStr(date_time)
+    with stage_timer.timed("solr_doc", 1):
+        return _coreRecordAsSolrDoc(coreMetadata)
 
 
 def _gather_curation_responsibility(responsibility_dicts: list[str]) -> str:
@@ -286,7 +303,7 @@ def handle_curation_fields(coreMetadata: typing.Dict, doc: typing.Dict):
         doc[SOLR_CURATION_RESPONSIBILITY] = _gather_curation_responsibility(curation[METADATA_RESPONSIBILITY])
 
 
-def shapely_to_solr(shape: shapely.geometry.shape):
+def shapely_to_solr(shape: "shapely.geometry.base.BaseGeometry"):
     centroid = shape.centroid
     bb = shape.bounds
     res = {
@@ -298,6 +315,7 @@ def shapely_to_solr(shape: shapely.geometry.shape):
 
 
 def lat_lon_to_solr(coreMetadata: typing.Dict, latitude: typing.SupportsFloat, longitude: typing.SupportsFloat):
+    import shapely.geometry
     coreMetadata.update(shapely_to_solr(shapely.geometry.Point(longitude, latitude)))
     coreMetadata["producedBy_samplingSite_location_latitude"] = latitude
     coreMetadata["producedBy_samplingSite_location_longitude"] = longitude
@@ -382,7 +400,7 @@ def handle_related_resources(coreMetadata: typing.Dict, doc: typing.Dict):
 
 def parsed_date(raw_date_str):
     # TODO: https://github.com/isamplesorg/isamples_inabox/issues/24
-    date_data = ddp.get_date_data(raw_date_str, date_formats=RECOGNIZED_DATE_FORMATS)
+    date_data = _date_data_parser().get_date_data(raw_date_str, date_formats=RECOGNIZED_DATE_FORMATS)
     if date_data is not None:
         return date_data.date_obj
     else:
@@ -461,11 +479,13 @@ def solrAddRecords(rsession, records, url):
 
     L = getLogger()
     headers = {"Content-Type": "application/json"}
-    data = json.dumps(records).encode("utf-8")
+    with stage_timer.timed("serialize", len(records)):
+        data = json.dumps(records).encode("utf-8")
     params = {"overwrite": "true"}
     _url = f"{url}update"
     L.debug("Going to post data %s to url %s", str(data), str(_url))
-    res = rsession.post(_url, headers=headers, data=data, params=params)
+    with stage_timer.timed("solr_post", len(records)):
+        res = rsession.post(_url, headers=headers, data=data, params=params)
     L.debug("post status: %s", res.status_code)
     L.debug("Solr update: %s", res.text)
     if res.status_code != 200:
@@ -481,7 +501,8 @@ def solrCommit(rsession, url):
     headers = {"Content-Type": "application/json"}
     params = {"commit": "true"}
     _url = f"{url}update"
-    res = rsession.get(_url, headers=headers, params=params)
+    with stage_timer.timed("solr_commit"):
+        res = rsession.get(_url, headers=headers, params=params)
     L.debug("Solr commit: %s", res.text)
 
 
@@ -500,6 +521,7 @@ def solr_max_source_updated_time(
         dict = res.json()
         docs = dict["response"]["docs"]
         if docs is not None and len(docs) > 0:
+            import dateparser
             return dateparser.parse(docs[0]["sourceUpdatedTime"])
     except Exception:
         getLogger().error("Didn't get expected JSON back from %s when fetching max source updated time for %s", _url, authority_id)
@@ -734,60 +756,75 @@ class CoreSolrImporter:
         faulthandler.register(SIGINT)
         allkeys = set()
         rsession = requests.session()
+        # Time spent in core_record_function includes the nested transform and solr_doc stages
+        timer = stage_timer.StageTimer("solr_import", {"authority": self._authority_id})
+        metrics_path = config.Settings().solr_import_metrics_path
+        reporter = stage_timer.StageReporter(
+            timer,
+            config.Settings().solr_import_report_interval_seconds,
+            metrics_path if metrics_path != "UNSET" else None,
+        )
         # h3_to_height = sqlmodel_database.h3_to_height(self._db_session)
         try:
-            core_records = []
-            for thing in self._thing_iterator.yieldRecordsByPage():
-                try:
-                    core_records_from_thing = core_record_function(thing)
-                except MetadataException as e:
-                    getLogger().info(f"Excluding record {thing.id} from index due to known exclusion: \"{e}\".")
-                    continue
-                except Exception as e:
-                    traceback.print_exc()
-                    getLogger().error("Failed trying to run transformer, skipping record %s exception %s",
-                                      thing.resolved_content, e)
-                    continue
-
-                for core_record in core_records_from_thing:
-                    core_record["source"] = self._authority_id
-                    # Note that the h3 is precomputed and stored on the Thing itself because we do a
-                    # "select distinct h3 from thing" query in order to determine which h3 values we need to compute
-                    # Cesium elevation for.  The full order of operations is
-                    # (1) compute h3 on things
-                    # (2) select distinct h3 to determine points that need to be computed
-                    # (3) compute points and insert into Point db cache table using Cesium JS API
-                    # (4) at index time, consult Point cache to get elevation for thing, and since we've previously
-                    #  computed the h3 just grab it off the Thing
-                    # Step 3 in this sequence of events is both slow and API rate-limited by Cesium, so we take great
-                    # pain to ensure that we're only querying the absolute minimum
-                    core_record["producedBy_samplingSite_location_h3_15"] = thing.h3
-                    # core_record["producedBy_samplingSite_location_cesium_height"] = h3_to_height.get(thing.h3)
-                    if ("producedBy_samplingSite_location_cesium_height" in core_record):
-                        core_record.pop("producedBy_samplingSite_location_cesium_height")
-                    core_records.append(core_record)
-                    allkeys.add(core_record["id"])
-                batch_size = len(core_records)
-                if batch_size > self._solr_batch_size:
+            with stage_timer.activate(timer):
+                core_records = []
+                for thing in timer.timed_iter("db_fetch", self._thing_iterator.yieldRecordsByPage()):
+                    reporter.maybe_report()
+                    try:
+                        with timer.time("core_record_function", 1):
+                            core_records_from_thing = core_record_function(thing)
+                    except MetadataException as e:
+                        getLogger().info(f"Excluding record {thing.id} from index due to known exclusion: \"{e}\".")
+                        continue
+                    except Exception as e:
+                        traceback.print_exc()
+                        getLogger().error("Failed trying to run transformer, skipping record %s exception %s",
+                                          thing.resolved_content, e)
+                        continue
+
+                    for core_record in core_records_from_thing:
+                        core_record["source"] = self._authority_id
+                        # Note that the h3 is precomputed and stored on the Thing itself because we do a
+                        # "select distinct h3 from thing" query in order to determine which h3 values we need to
+                        # compute Cesium elevation for.  The full order of operations is
+                        # (1) compute h3 on things
+                        # (2) select distinct h3 to determine points that need to be computed
+                        # (3) compute points and insert into Point db cache table using Cesium JS API
+                        # (4) at index time, consult Point cache to get elevation for thing, and since we've
+                        #  previously computed the h3 just grab it off the Thing
+                        # Step 3 in this sequence of events is both slow and API rate-limited by Cesium, so we take
+                        # great pain to ensure that we're only querying the absolute minimum
+                        core_record["producedBy_samplingSite_location_h3_15"] = thing.h3
+                        # core_record["producedBy_samplingSite_location_cesium_height"] = h3_to_height.get(thing.h3)
+                        if ("producedBy_samplingSite_location_cesium_height" in core_record):
+                            core_record.pop("producedBy_samplingSite_location_cesium_height")
+                        core_records.append(core_record)
+                        allkeys.add(core_record["id"])
+                        timer.records += 1
+                    batch_size = len(core_records)
+                    if batch_size > self._solr_batch_size:
+                        solrAddRecords(
+                            rsession,
+                            core_records,
+                            url=self._solr_url,
+                        )
+                        getLogger().info(
+                            "Just added solr records, length of all keys is %d",
+                            len(allkeys),
+                        )
+                        core_records = []
+                    elif batch_size % 1000 == 0:
+                        logging.info(f"have done {batch_size}, current time is {datetime.datetime.now()}")
+                if len(core_records) > 0:
                     solrAddRecords(
                         rsession,
                         core_records,
                         url=self._solr_url,
                     )
-                    getLogger().info(
-                        "Just added solr records, length of all keys is %d",
-                        len(allkeys),
-                    )
-                    core_records = []
-                elif batch_size % 1000 == 0:
-                    logging.info(f"have done {batch_size}, current time is {datetime.datetime.now()}")
-            if len(core_records) > 0:
-                solrAddRecords(
-                    rsession,
-                    core_records,
-                    url=self._solr_url,
-                )
-            solrCommit(rsession, url=self._solr_url)
+                solrCommit(rsession, url=self._solr_url)
+                if len(allkeys) > 0:
+                    with timer.time("h3_count_refresh"):
+                        self._refresh_h3_counts()
             # verify records
             # for verifying that all records were added to solr
             # found = 0
@@ -800,4 +837,21 @@ class CoreSolrImporter:
             # print(f"Found = {found}")
         finally:
             self._db_session.close()
+            getLogger().info("Finished solr import")
+            reporter.report()
         return allkeys
+
+    def _refresh_h3_counts(self):
+        """Refresh the materialized h3 counts affected by this import so /h3_counts/ doesn't serve stale values"""
+        queries = h3_utilities.h3_count_queries_for_authority(self._authority_id)
+        # Category counts span all sources, so any that were previously materialized need refreshing too
+        for query in sqlmodel_database.materialized_h3_count_queries(self._db_session):
+            if query not in queries and not query.startswith("source:"):
+                queries.append(query)
+        try:
+            h3_utilities.materialize_h3_counts(
+                self._db_session, queries, config.Settings().h3_count_max_materialized_resolution, self._solr_url
+            )
+            getLogger().info("Refreshed materialized h3 counts for %s", queries)
+        except Exception as e:
+            getLogger().error("Failed to refresh materialized h3 counts for %s: %s", queries, e)
@@ -0,0 +1,83 @@
+"""
+Transformation of Things into the iSamples core representation, cached by (identifier, thing tstamp, transformer
+version) in an in-process LRU backed by the ThingCoreContent table.  A cached representation is never stale: updating
+the thing changes its tstamp, and changing a transformer's output requires bumping its TRANSFORMER_VERSION.
+"""
+import typing
+from typing import Optional
+
+from sqlmodel import Session
+
+import isamples_metadata.GEOMETransformer
+from isamples_metadata.OpenContextTransformer import OpenContextTransformer
+from isamples_metadata.SESARTransformer import SESARTransformer
+from isamples_metadata.SmithsonianTransformer import SmithsonianTransformer
+from isamples_metadata.Transformer import Transformer
+from isb_lib.models.thing import Thing
+from isb_lib.utilities.caches import LRUCache
+from isb_web import config, sqlmodel_database
+
+CORE_TRANSFORMER_CLASSES: dict[str, typing.Type[Transformer]] = {
+    "SESAR": SESARTransformer,
+    "GEOME": isamples_metadata.GEOMETransformer.GEOMETransformer,
+    "OPENCONTEXT": OpenContextTransformer,
+    "SMITHSONIAN": SmithsonianTransformer,
+}
+
+_core_content_cache = LRUCache(config.Settings().core_content_lru_cache_size)
+
+
+class CoreContentUnavailable(Exception):
+    pass
+
+
+def transformer_version(authority_id: Optional[str]) -> Optional[int]:
+    """The TRANSFORMER_VERSION used for the authority's core content, or None if it can't be transformed"""
+    transformer_class = CORE_TRANSFORMER_CLASSES.get(authority_id or "")
+    return transformer_class.TRANSFORMER_VERSION if transformer_class is not None else None
+
+
+def _transform(
+    identifier: str,
+    thing: Thing,
+    resolved_content: dict,
+    transformer_class: typing.Type[Transformer],
+    session: Session,
+    taxonomy_name_to_kingdom_map: dict,
+) -> dict:
+    if thing.authority_id == "GEOME":
+        transformer: Optional[Transformer] = isamples_metadata.GEOMETransformer.geome_transformer_for_identifier(
+            identifier, resolved_content, session, taxonomy_name_to_kingdom_map
+        )
+        if transformer is None:
+            raise CoreContentUnavailable(f"Unable to find transformer for identifier {identifier}")
+    else:
+        transformer = transformer_class(resolved_content)
+    return transformer.transform(False)
+
+
+def core_content(identifier: str, thing: Thing, session: Session, taxonomy_name_to_kingdom_map: dict) -> dict:
+    """Returns the iSamples core representation of the thing, transforming it only if there isn't a cached copy.
+
+    Callers must treat the returned dictionary as read-only since it's shared with other requests.
+    """
+    resolved_content = thing.resolved_content
+    if resolved_content is None:
+        raise CoreContentUnavailable(f"No resolved content for identifier {identifier}")
+    if thing.is_transformed():
+        # It's already been transformed
+        return resolved_content
+    transformer_class = CORE_TRANSFORMER_CLASSES.get(thing.authority_id or "")
+    if transformer_class is None:
+        raise CoreContentUnavailable(f"Core format not available for authority_id: {thing.authority_id}")
+    cache_key = (identifier, thing.tstamp, transformer_class.TRANSFORMER_VERSION)
+    content = _core_content_cache.get(cache_key)
+    if content is None:
+        content = sqlmodel_database.get_thing_core_content(session, *cache_key)
+        if content is None:
+            content = _transform(
+                identifier, thing, resolved_content, transformer_class, session, taxonomy_name_to_kingdom_map
+            )
+            sqlmodel_database.save_thing_core_content(session, *cache_key, content)
+        _core_content_cache.put(cache_key, content)
+    return content
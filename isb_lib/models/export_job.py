@@ -80,3 +80,63 @@ class ExportJob(SQLModel, table=True):
         description="Whether or not this export job represents a sitemap generation",
         index=False
     )
+    compression: Optional[str] = Field(
+        default=None,
+        nullable=True,
+        description="Compression applied to the exported file, if any.",
+        index=False
+    )
+    fingerprint: Optional[str] = Field(
+        default=None,
+        nullable=True,
+        description="Hash of the canonicalized query, format, and compression, shared by jobs producing the same export.",
+        index=True
+    )
+    solr_index_version: Optional[str] = Field(
+        default=None,
+        nullable=True,
+        description="Version of the solr index when the export started.",
+        index=False
+    )
+    tcancelled: Optional[datetime] = Field(
+        default=None,
+        nullable=True,
+        description="When cancelling the job was requested.",
+        index=False
+    )
+    worker_id: Optional[str] = Field(
+        default=None,
+        nullable=True,
+        description="The export worker that claimed the job.",
+        index=False
+    )
+    heartbeat: Optional[datetime] = Field(
+        default=None,
+        nullable=True,
+        description="When the worker running the job last reported that it's still working on it.",
+        index=True
+    )
+    attempts: int = Field(
+        default=0,
+        nullable=False,
+        description="Number of times a worker has claimed the job.",
+        index=False
+    )
+    expected_rows: Optional[int] = Field(
+        default=None,
+        nullable=True,
+        description="Number of records matching the query when the export started.",
+        index=False
+    )
+    rows_written: Optional[int] = Field(
+        default=None,
+        nullable=True,
+        description="Number of records exported so far.",
+        index=False
+    )
+    bytes_written: Optional[int] = Field(
+        default=None,
+        nullable=True,
+        description="Size of the exported file(s) so far.",
+        index=False
+    )
@@ -0,0 +1,47 @@
+from datetime import datetime
+from typing import Optional
+
+import sqlalchemy
+from sqlmodel import SQLModel, Field
+
+
+class H3Count(SQLModel, table=True):
+    """Materialized count of Solr records in an h3 cell for a commonly used query, served by /h3_counts/"""
+    __table_args__ = (
+        sqlalchemy.Index("h3_count_query_resolution_idx", "query", "resolution"),
+    )
+
+    primary_key: Optional[int] = Field(
+        # Need to use SQLAlchemy here because we can't have the Python attribute named _id or SQLModel won't see it
+        sa_column=sqlalchemy.Column(
+            "_id",
+            sqlalchemy.Integer,
+            primary_key=True,
+            doc="sequential integer primary key",
+        ),
+    )
+    query: str = Field(
+        default=None,
+        nullable=False,
+        description="The canonical solr query the count was computed for, e.g. *:* or source:SESAR",
+    )
+    resolution: int = Field(
+        default=None,
+        nullable=False,
+        description="The h3 resolution of the cell",
+    )
+    h3: str = Field(
+        default=None,
+        nullable=False,
+        description="The h3 cell",
+    )
+    count: int = Field(
+        default=0,
+        nullable=False,
+        description="The number of records matching the query in the cell",
+    )
+    tstamp: Optional[datetime] = Field(
+        default=None,
+        nullable=True,
+        description="When the count was computed",
+    )
@@ -0,0 +1,47 @@
+from datetime import datetime
+from typing import Optional
+
+import sqlalchemy
+from sqlmodel import SQLModel, Field
+
+from isb_lib.models.conditional_jsonb_type import ConditionalJSONB
+
+
+class ThingCoreContent(SQLModel, table=True):
+    """The iSamples core representation of a Thing, cached so it doesn't need to be transformed on every request"""
+
+    primary_key: Optional[int] = Field(
+        # Need to use SQLAlchemy here because we can't have the Python attribute named _id or SQLModel won't see it
+        sa_column=sqlalchemy.Column(
+            "_id",
+            sqlalchemy.Integer,
+            primary_key=True,
+            doc="sequential integer primary key",
+        ),
+    )
+    id: Optional[str] = Field(
+        default=None,
+        nullable=False,
+        index=True,
+        unique=True,
+        description="The identifier the core representation was requested with",
+    )
+    thing_tstamp: Optional[datetime] = Field(
+        default=None,
+        nullable=False,
+        description="The tstamp of the Thing at the time it was transformed",
+    )
+    transformer_version: int = Field(
+        default=None,
+        nullable=False,
+        description="The TRANSFORMER_VERSION of the transformer that produced the content",
+    )
+    content: Optional[dict] = Field(
+        # Use the raw SQLAlchemy column in order to get the proper JSON behavior
+        sa_column=sqlalchemy.Column(
+            ConditionalJSONB,
+            nullable=True,
+            default=None,
+            doc="The transformed iSamples core JSON",
+        ),
+    )
@@ -16,7 +16,6 @@ import typing
 import urllib.parse
 import lxml.etree
 import requests
-import dateparser
 import functools
 import os.path
 from aiofile import AIOFile, Writer
@@ -191,6 +190,7 @@ async def _build_sesar_sitemap(base_path: str, host: str, iterator: typing.Itera
 
 @functools.cache
 def _toDatetimeTZ(V):
+    import dateparser
     return dateparser.parse(
         V, settings={"TIMEZONE": "+0000", "RETURN_AS_TIMEZONE_AWARE": True}
     )
@@ -0,0 +1,107 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class LRUCache:
+    """
+    Thread-safe bounded mapping that evicts the least recently used entry.  Use this in place of functools.lru_cache
+    when the values can't be computed from hashable arguments alone, e.g. when they need a database session.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[Hashable, Any] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class TTLCache(LRUCache):
+    """
+    LRUCache whose entries also expire ttl_seconds after they were put.  Counts hits and misses so that the hit rate
+    can be reported as a metric.
+    """
+
+    def __init__(self, maxsize: int, ttl_seconds: float):
+        super().__init__(maxsize)
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = super().get(key)
+        if entry is not None:
+            expires, value = entry
+            if time.monotonic() < expires:
+                self.hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    def put(self, key: Hashable, value: Any):
+        super().put(key, (time.monotonic() + self.ttl_seconds, value))
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key, so that only the first caller does the work and the others wait for
+    and share its result (or exception).  Nothing is kept once the call completes; pair it with a cache for that.
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                self.coalesced += 1
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
@@ -1,11 +1,19 @@
-from typing import Any
+import functools
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Optional
 
-from .antimeridian_splitter import split_polygon
 import math
 import typing
 import geojson
 import h3
-from isb_web.isb_solr_query import clip_float, solr_records_forh3_counts
+from sqlmodel import Session
+
+from isb_web import config, sqlmodel_database
+from isb_web.isb_solr_query import clip_float, solr_records_forh3_counts, solr_facet_counts, \
+    bounding_box_filter_query
 
 # Mainly adapted from https://github.com/datadavev/seeh3/blob/main/app/seeh3.py
 
@@ -58,6 +66,13 @@ POLES = {
 }
 
 
+# Name of the sqlite table that holds precomputed cell geometries, see scripts/build_h3_geometry_cache.py
+H3_GEOMETRY_TABLE_NAME = "h3_cell_geometry"
+
+# Cells at resolutions above this aren't worth precomputing -- there are too many of them
+MAX_PRECOMPUTED_RESOLUTION = 6
+
+
 class RecordCount(typing.TypedDict):
     n: int
     rn: float
@@ -106,7 +121,7 @@ def get_h3_solr_query_from_bb(bb: str, resolution: str, q: str) -> H3SolrQueryPa
         bbox[1] = clip_float(bbox[1], -90, 90)
         bbox[2] = clip_float(bbox[2], -180, 180)
         bbox[3] = clip_float(bbox[3], -90, 90)
-        fq = f"producedBy_samplingSite_location_ll:[{bbox[1]},{bbox[0]} TO {bbox[3]},{bbox[2]}]"
+        fq = bounding_box_filter_query(bbox[0], bbox[1], bbox[2], bbox[3])
         if q is None:
             q = fq
         else:
@@ -115,32 +130,116 @@ def get_h3_solr_query_from_bb(bb: str, resolution: str, q: str) -> H3SolrQueryPa
             resolution = estimate_resolution(bbox)
     if q is None:
         q = "*:*"
+    if resolution is None:
+        resolution = estimate_resolution(None)
     return H3SolrQueryParams(q, resolution)
 
 
-def get_record_counts(
-    query: str = "*:*", resolution: int = 1, exclude_poles: bool = True
-) -> dict[Any, dict[str, Any]]:
-    """
-    Facet records matching query on resolution, returning dict with keys being h3.
-    """
+def canonical_h3_count_query(query: Optional[str]) -> str:
+    """Normalizes a query so equivalent requests share the same materialized h3 counts"""
+    if query is None or len(query.strip()) == 0:
+        return "*:*"
+    return " ".join(query.split())
+
+
+def h3_count_queries_for_authority(authority_id: Optional[str] = None) -> list[str]:
+    """The queries whose materialized h3 counts change when records from the authority are indexed"""
+    queries = ["*:*"]
+    if authority_id is not None:
+        queries.append(f"source:{authority_id}")
+    return queries
+
+
+def h3_count_queries_for_categories(solr_url: Optional[str] = None) -> list[str]:
+    """Queries for each of the material and context categories present in the index"""
+    queries = []
+    for field in ["hasMaterialCategory", "hasContextCategory"]:
+        for category in solr_facet_counts(field, solr_url=solr_url).keys():
+            queries.append(f'{field}:"{category}"')
+    return queries
+
+
+def facet_record_counts(query: str, resolution: int, solr_url: Optional[str] = None) -> dict[str, int]:
+    """Facet records matching query on resolution, returning dict of h3 to count"""
     field_name = f"producedBy_samplingSite_location_h3_{resolution}"
-    response = solr_records_forh3_counts(query, field_name)
+    response = solr_records_forh3_counts(query, field_name, solr_url=solr_url)
     counts = {}
-    total = 0
     for entry in response.get("result-set", {}).get("docs", []):
         try:
-            h = entry[field_name]
-            if h not in POLES or not exclude_poles:
-                n = entry["count(*)"]
-                total += n
-                counts[h] = {
-                    "n": n,
-                    "rn": 0,
-                    "ln": 0,
-                }
+            counts[entry[field_name]] = entry["count(*)"]
         except KeyError:
             pass
+    return counts
+
+
+def materialize_h3_counts(
+    session: Session, queries: list[str], max_resolution: int, solr_url: Optional[str] = None
+) -> int:
+    """Computes the h3 counts for each query at resolutions 0 through max_resolution and saves them to the database.
+
+    Returns the number of (query, resolution) pairs that were refreshed.
+    """
+    num_refreshed = 0
+    for query in queries:
+        canonical_query = canonical_h3_count_query(query)
+        for resolution in range(0, max_resolution + 1):
+            counts = facet_record_counts(canonical_query, resolution, solr_url)
+            sqlmodel_database.save_h3_counts(session, canonical_query, resolution, counts)
+            num_refreshed += 1
+    return num_refreshed
+
+
+def _raw_record_counts(query: str, resolution: int, session: Optional[Session]) -> dict[str, int]:
+    if session is not None and resolution <= config.Settings().h3_count_max_materialized_resolution:
+        materialized_counts = sqlmodel_database.h3_counts_for_query(
+            session, canonical_h3_count_query(query), resolution
+        )
+        if len(materialized_counts) > 0:
+            return materialized_counts
+    return facet_record_counts(query, resolution)
+
+
+def record_counts_in_bounding_box(
+    query: str, resolution: int, bounding_box: tuple[float, float, float, float], session: Optional[Session] = None
+) -> dict[str, int]:
+    """Returns the h3 cell counts of records matching query within the min_lon, min_lat, max_lon, max_lat box.
+
+    If a database session is provided and counts are materialized for the query, those are filtered to the cells
+    whose center lies in the box, otherwise solr is faceted on the records located in the box.
+    """
+    if session is not None and resolution <= config.Settings().h3_count_max_materialized_resolution:
+        materialized_counts = sqlmodel_database.h3_counts_for_query(
+            session, canonical_h3_count_query(query), resolution
+        )
+        if len(materialized_counts) > 0:
+            min_lon, min_lat, max_lon, max_lat = bounding_box
+            counts = {}
+            for cell, count in materialized_counts.items():
+                lat, lon = h3.cell_to_latlng(cell)
+                if min_lon <= lon <= max_lon and min_lat <= lat <= max_lat:
+                    counts[cell] = count
+            return counts
+    return facet_record_counts(f"{canonical_h3_count_query(query)} AND {bounding_box_filter_query(*bounding_box)}", resolution)
+
+
+def get_record_counts(
+    query: str = "*:*", resolution: int = 1, exclude_poles: bool = True, session: Optional[Session] = None
+) -> dict[Any, dict[str, Any]]:
+    """
+    Facet records matching query on resolution, returning dict with keys being h3.
+
+    If a database session is provided, counts previously materialized for the query are used instead of Solr.
+    """
+    counts: dict[str, dict[str, float]] = {}
+    total = 0
+    for h, n in _raw_record_counts(query, resolution, session).items():
+        if h not in POLES or not exclude_poles:
+            total += n
+            counts[h] = {
+                "n": n,
+                "rn": 0,
+                "ln": 0,
+            }
     if total == 0:
         log_total: float = 0
     else:
@@ -154,16 +253,77 @@ def get_record_counts(
     return counts
 
 
-def h3_to_features(cell: str, cell_props: dict = {}) -> list[geojson.Feature]:
-    """Given a h3 cell, return one or more geojson Features representing the cell.
-
-    More than one feature may be returned if the polygon is split on the
-    anti-meridian.
+class H3GeometryTable:
+    """
+    Read-only access to a sqlite table of precomputed cell geometries, keyed by cell.
 
-    Features are returned with properties:
-      h3 = the cell
-      km2 = the area of the cell in km^2
+    Each row holds the antimeridian-split GeoJSON geometries of the cell (as a JSON list) and the cell area in km^2.
     """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite connections can't be shared across threads, and FastAPI runs sync handlers on a thread pool
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(f"file:{self._path}?mode=ro", uri=True)
+            self._local.connection = connection
+        return connection
+
+    def cell_geometry(self, cell: str) -> Optional[tuple[list[dict], float]]:
+        row = self._connection().execute(
+            f"select geometries, km2 from {H3_GEOMETRY_TABLE_NAME} where h3 = ?", (cell,)
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    @staticmethod
+    def build(path: str, max_resolution: int = MAX_PRECOMPUTED_RESOLUTION, batch_size: int = 100000) -> int:
+        """Writes geometries for every cell at resolutions 0 through max_resolution to the sqlite file at path.
+
+        Returns the number of cells written.
+        """
+        connection = sqlite3.connect(path)
+        try:
+            connection.execute(
+                f"create table if not exists {H3_GEOMETRY_TABLE_NAME} (h3 text primary key, geometries text, km2 real)"
+            )
+            num_written = 0
+            batch = []
+            for res0_cell in h3.get_res0_cells():
+                for resolution in range(0, max_resolution + 1):
+                    for cell in h3.cell_to_children(res0_cell, resolution):
+                        geometries, km2 = _compute_cell_geometry(cell)
+                        batch.append((cell, json.dumps(geometries), km2))
+                        if len(batch) == batch_size:
+                            num_written += _write_geometry_batch(connection, batch)
+                            batch = []
+            num_written += _write_geometry_batch(connection, batch)
+            return num_written
+        finally:
+            connection.close()
+
+
+def _write_geometry_batch(connection: sqlite3.Connection, batch: list[tuple]) -> int:
+    connection.executemany(f"insert or replace into {H3_GEOMETRY_TABLE_NAME} values (?, ?, ?)", batch)
+    connection.commit()
+    return len(batch)
+
+
+@functools.cache
+def _precomputed_geometry_table() -> Optional[H3GeometryTable]:
+    path = config.Settings().h3_geometry_cache_path
+    if path == "UNSET" or not os.path.exists(path):
+        return None
+    return H3GeometryTable(path)
+
+
+def _compute_cell_geometry(cell: str) -> tuple[list[dict], float]:
+    # The splitter pulls in shapely, which is slow to import and not needed when the geometries are precomputed
+    from .antimeridian_splitter import split_polygon
     polygon = geojson.MultiPolygon(
         [
             h3.cell_to_boundary(cell, geo_json=True),
@@ -172,13 +332,42 @@ def h3_to_features(cell: str, cell_props: dict = {}) -> list[geojson.Feature]:
     split_polygons = split_polygon(
         polygon, output_format="geojsondict"
     )
+    return list(split_polygons), h3.cell_area(cell, unit="km^2")
+
+
+@functools.lru_cache(maxsize=config.Settings().h3_geometry_lru_cache_size)
+def cell_geometry(cell: str) -> tuple[list[dict], float]:
+    """Returns the antimeridian-split GeoJSON geometries and the area in km^2 of the h3 cell.
+
+    Cell geometry never changes, so results are memoized, and read from the precomputed geometry table when one is
+    configured.  Callers must treat the returned geometries as read-only.
+    """
+    table = _precomputed_geometry_table()
+    if table is not None and h3.get_resolution(cell) <= MAX_PRECOMPUTED_RESOLUTION:
+        precomputed = table.cell_geometry(cell)
+        if precomputed is not None:
+            return precomputed
+    return _compute_cell_geometry(cell)
+
+
+def h3_to_features(cell: str, cell_props: dict = {}) -> list[geojson.Feature]:
+    """Given a h3 cell, return one or more geojson Features representing the cell.
+
+    More than one feature may be returned if the polygon is split on the
+    anti-meridian.
+
+    Features are returned with properties:
+      h3 = the cell
+      km2 = the area of the cell in km^2
+    """
+    geometries, km2 = cell_geometry(cell)
     res = []
     props = {
         "h3": cell,
-        "km2": h3.cell_area(cell, unit="km^2"),
+        "km2": km2,
     }
     props.update(cell_props)
-    for p in split_polygons:
+    for p in geometries:
         res.append(
             geojson.Feature(
                 geometry=p,
@@ -1,13 +1,18 @@
+import csv
 import datetime
+import io
+import itertools
 import json
-import math
 import os
 from abc import ABC, abstractmethod
 from collections import OrderedDict
 from enum import Enum
-from typing import Optional
+from typing import Callable, Iterable, Optional, TextIO, Union
 
 import petl
+import pyarrow
+import pyarrow.ipc
+import pyarrow.parquet
 from petl import Table
 
 from isamples_metadata.metadata_constants import METADATA_PLACE_NAME, METADATA_AUTHORIZED_BY, METADATA_COMPLIES_WITH, \
@@ -28,7 +33,29 @@ from isamples_metadata.solr_field_constants import SOLR_PRODUCED_BY_SAMPLING_SIT
     SOLR_PRODUCED_BY_RESULT_TIME, SOLR_PRODUCED_BY_RESPONSIBILITY, SOLR_PRODUCED_BY_FEATURE_OF_INTEREST, \
     SOLR_PRODUCED_BY_DESCRIPTION, SOLR_PRODUCED_BY_LABEL, SOLR_PRODUCED_BY_ISB_CORE_ID, SOLR_INFORMAL_CLASSIFICATION, \
     SOLR_KEYWORDS, SOLR_HAS_SPECIMEN_CATEGORY, SOLR_HAS_MATERIAL_CATEGORY, SOLR_HAS_CONTEXT_CATEGORY, SOLR_DESCRIPTION, \
-    SOLR_LABEL, SOLR_SOURCE, SOLR_TIME_FORMAT, SOLR_ISB_CORE_ID, SOLR_SOURCE_UPDATED_TIME, SOLR_TIME_FORMAT_NO_MILLIS
+    SOLR_LABEL, SOLR_SOURCE, SOLR_TIME_FORMAT, SOLR_ISB_CORE_ID, SOLR_SOURCE_UPDATED_TIME, SOLR_TIME_FORMAT_NO_MILLIS, \
+    SOLR_HAS_SPECIMEN_CATEGORY_CONFIDENCE, SOLR_HAS_MATERIAL_CATEGORY_CONFIDENCE, SOLR_HAS_CONTEXT_CATEGORY_CONFIDENCE, \
+    SOLR_INDEX_UPDATED_TIME
+
+# Number of leading rows sampled to discover the CSV columns, the same as petl.fromdicts does
+CSV_HEADER_SAMPLE_SIZE = 1000
+# Number of rows buffered before they're written out as a parquet row group or arrow record batch
+COLUMNAR_BATCH_SIZE = 100000
+# Low cardinality columns that are dictionary encoded in parquet output
+DICTIONARY_ENCODED_FIELDS = [SOLR_SOURCE, SOLR_HAS_SPECIMEN_CATEGORY, SOLR_HAS_MATERIAL_CATEGORY, SOLR_HAS_CONTEXT_CATEGORY]
+MULTI_VALUED_STRING_FIELDS = [
+    SOLR_HAS_SPECIMEN_CATEGORY, SOLR_HAS_MATERIAL_CATEGORY, SOLR_HAS_CONTEXT_CATEGORY, SOLR_KEYWORDS,
+    SOLR_INFORMAL_CLASSIFICATION, SOLR_PRODUCED_BY_RESPONSIBILITY, SOLR_PRODUCED_BY_SAMPLING_SITE_PLACE_NAME,
+    SOLR_REGISTRANT, SOLR_SAMPLING_PURPOSE, SOLR_RELATED_RESOURCE_ISB_CORE_ID, SOLR_AUTHORIZED_BY, SOLR_COMPLIES_WITH
+]
+MULTI_VALUED_FLOAT_FIELDS = [
+    SOLR_HAS_SPECIMEN_CATEGORY_CONFIDENCE, SOLR_HAS_MATERIAL_CATEGORY_CONFIDENCE, SOLR_HAS_CONTEXT_CATEGORY_CONFIDENCE
+]
+FLOAT_FIELDS = [
+    SOLR_PRODUCED_BY_SAMPLING_SITE_LOCATION_LATITUDE, SOLR_PRODUCED_BY_SAMPLING_SITE_LOCATION_LONGITUDE,
+    SOLR_PRODUCED_BY_SAMPLING_SITE_ELEVATION_IN_METERS
+]
+TIMESTAMP_FIELDS = [SOLR_PRODUCED_BY_RESULT_TIME, SOLR_SOURCE_UPDATED_TIME, SOLR_INDEX_UPDATED_TIME]
 
 
 class ExportTransformException(Exception):
@@ -39,6 +66,8 @@ class TargetExportFormat(Enum):
     """Valid target export formats"""
     CSV = "CSV"
     JSONL = "JSONL"
+    PARQUET = "PARQUET"
+    ARROW = "ARROW"
 
     # overridden to allow for case insensitivity in query parameter formatting
     @classmethod
@@ -50,6 +79,44 @@ class TargetExportFormat(Enum):
         return None
 
 
+class ExportCompression(Enum):
+    """Compression applied to the export output as it's written.  The values are the HTTP content codings."""
+    GZIP = "gzip"
+    ZSTD = "zstd"
+
+    # overridden to allow for case insensitivity in query parameter formatting
+    @classmethod
+    def _missing_(cls, value):
+        value = value.lower()
+        for member in cls:
+            if member.value == value:
+                return member
+        return None
+
+    @property
+    def extension(self) -> str:
+        return "gz" if self == ExportCompression.GZIP else "zst"
+
+    @staticmethod
+    def for_path(path: str) -> Optional["ExportCompression"]:
+        """The compression of the file at the path, based on its extension"""
+        for member in ExportCompression:
+            if path.endswith(f".{member.extension}"):
+                return member
+        return None
+
+
+def compressed_path(path: str, compression: Optional[ExportCompression]) -> str:
+    return path if compression is None else f"{path}.{compression.extension}"
+
+
+def open_output(path: str, compression: Optional[ExportCompression], newline: Optional[str] = None) -> TextIO:
+    """Opens the path for writing text, through a streaming compressor if compression is specified"""
+    if compression is None:
+        return open(path, "w", newline=newline)
+    return io.TextIOWrapper(pyarrow.CompressedOutputStream(path, compression.value), encoding="utf-8", newline=newline)
+
+
 class AbstractExportTransformer(ABC):
     @staticmethod
     @abstractmethod
@@ -68,6 +135,145 @@ class CSVExportTransformer(AbstractExportTransformer):
             petl.io.csv.tocsv(table, dest_path)
         return [dest_path]
 
+    @staticmethod
+    def write_rows(rows: Iterable[dict], dest_path_no_extension: str, renaming_map: dict[str, str],
+                   fields: Optional[list[str]] = None, write_header: bool = True,
+                   compression: Optional[ExportCompression] = None) -> tuple[list[str], int]:
+        """Writes the rows in a single pass, with the columns renamed with the renaming map.  The columns are the fields
+        if specified, otherwise they're discovered from the leading rows.  Returns the path written to and the number of
+        rows written."""
+        dest_path = compressed_path(f"{dest_path_no_extension}.csv", compression)
+        rows_iterator = iter(rows)
+        sample = list(itertools.islice(rows_iterator, CSV_HEADER_SAMPLE_SIZE)) if fields is None else []
+        header: dict[str, None] = dict.fromkeys(fields) if fields is not None else {}
+        for row in sample:
+            header.update(dict.fromkeys(row.keys()))
+        num_rows = 0
+        with open_output(dest_path, compression, newline="") as file:
+            writer = csv.writer(file)
+            if write_header:
+                writer.writerow([renaming_map.get(field, field) for field in header])
+            for row in itertools.chain(sample, rows_iterator):
+                writer.writerow([row.get(field) for field in header])
+                num_rows += 1
+        return [dest_path], num_rows
+
+
+class ColumnarExportTransformer:
+    """Writes parquet or arrow IPC files with a fixed schema derived from the exported solr fields"""
+
+    EXTENSIONS = {TargetExportFormat.PARQUET: "parquet", TargetExportFormat.ARROW: "arrow"}
+
+    @staticmethod
+    def arrow_type(field: str) -> pyarrow.DataType:
+        # Fields that aren't in the solr schema we know about are exported as strings
+        if field in MULTI_VALUED_STRING_FIELDS:
+            return pyarrow.list_(pyarrow.string())
+        elif field in MULTI_VALUED_FLOAT_FIELDS:
+            return pyarrow.list_(pyarrow.float64())
+        elif field in FLOAT_FIELDS:
+            return pyarrow.float64()
+        elif field in TIMESTAMP_FIELDS:
+            return pyarrow.timestamp("ms", tz="UTC")
+        else:
+            return pyarrow.string()
+
+    @staticmethod
+    def schema(fields: list[str], renaming_map: dict[str, str]) -> pyarrow.Schema:
+        return pyarrow.schema(
+            [(renaming_map.get(field, field), ColumnarExportTransformer.arrow_type(field)) for field in fields]
+        )
+
+    @staticmethod
+    def _convert(value, arrow_type: pyarrow.DataType):
+        if value is None:
+            return None
+        if pyarrow.types.is_list(arrow_type):
+            values = value if isinstance(value, list) else [value]
+            return [ColumnarExportTransformer._convert(v, arrow_type.value_type) for v in values]
+        if isinstance(value, list):
+            if pyarrow.types.is_string(arrow_type):
+                # the same separator solr uses to pack multiple values into a single valued field
+                return "|".join(str(v) for v in value)
+            value = value[0] if len(value) > 0 else None
+            if value is None:
+                return None
+        if pyarrow.types.is_timestamp(arrow_type):
+            return datetime.datetime.fromisoformat(value) if isinstance(value, str) else value
+        elif pyarrow.types.is_floating(arrow_type):
+            return float(value)
+        else:
+            return str(value)
+
+    @staticmethod
+    def _open_writer(format: TargetExportFormat, dest_path: str, schema: pyarrow.Schema,
+                     dictionary_columns: Optional[list[str]] = None):
+        if format == TargetExportFormat.PARQUET:
+            return pyarrow.parquet.ParquetWriter(dest_path, schema, compression="zstd", use_dictionary=dictionary_columns or [])
+        else:
+            return pyarrow.ipc.new_file(dest_path, schema, options=pyarrow.ipc.IpcWriteOptions(compression="zstd"))
+
+    @staticmethod
+    def write_rows(rows: Iterable[dict], dest_path_no_extension: str, format: TargetExportFormat, fields: list[str],
+                   renaming_map: dict[str, str]) -> tuple[list[str], int]:
+        """Writes the rows in a single pass, a row group (or record batch) every COLUMNAR_BATCH_SIZE rows.  Returns
+        the path written to and the number of rows written."""
+        dest_path = f"{dest_path_no_extension}.{ColumnarExportTransformer.EXTENSIONS[format]}"
+        schema = ColumnarExportTransformer.schema(fields, renaming_map)
+        arrow_types = [ColumnarExportTransformer.arrow_type(field) for field in fields]
+        dictionary_columns = []
+        for field, arrow_type in zip(fields, arrow_types):
+            if field in DICTIONARY_ENCODED_FIELDS:
+                column_name = renaming_map.get(field, field)
+                # nested columns are addressed by the path to their values
+                dictionary_columns.append(f"{column_name}.list.element" if pyarrow.types.is_list(arrow_type) else column_name)
+        num_rows = 0
+        writer = ColumnarExportTransformer._open_writer(format, dest_path, schema, dictionary_columns)
+        try:
+            columns: list[list] = [[] for _ in fields]
+            for row in rows:
+                for column, field, arrow_type in zip(columns, fields, arrow_types):
+                    column.append(ColumnarExportTransformer._convert(row.get(field), arrow_type))
+                num_rows += 1
+                if num_rows % COLUMNAR_BATCH_SIZE == 0:
+                    writer.write_batch(pyarrow.RecordBatch.from_arrays(columns, schema=schema))
+                    columns = [[] for _ in fields]
+            if num_rows % COLUMNAR_BATCH_SIZE != 0 or num_rows == 0:
+                writer.write_batch(pyarrow.RecordBatch.from_arrays(columns, schema=schema))
+        finally:
+            writer.close()
+        return [dest_path], num_rows
+
+    @staticmethod
+    def concatenate(format: TargetExportFormat, paths: list[str], dest_path: str):
+        """Copies the row groups (or record batches) of the files, which must all have the same schema, into one file"""
+        dictionary_columns = []
+        if format == TargetExportFormat.PARQUET:
+            schema = pyarrow.parquet.read_schema(paths[0])
+            # keep the dictionary encoding of the parts
+            metadata = pyarrow.parquet.read_metadata(paths[0])
+            if metadata.num_row_groups > 0:
+                row_group = metadata.row_group(0)
+                for index in range(row_group.num_columns):
+                    if "RLE_DICTIONARY" in row_group.column(index).encodings:
+                        dictionary_columns.append(row_group.column(index).path_in_schema)
+        else:
+            with pyarrow.ipc.open_file(paths[0]) as reader:
+                schema = reader.schema
+        writer = ColumnarExportTransformer._open_writer(format, dest_path, schema, dictionary_columns)
+        try:
+            for path in paths:
+                if format == TargetExportFormat.PARQUET:
+                    parquet_file = pyarrow.parquet.ParquetFile(path)
+                    for index in range(parquet_file.num_row_groups):
+                        writer.write_table(parquet_file.read_row_group(index))
+                else:
+                    with pyarrow.ipc.open_file(path) as reader:
+                        for index in range(reader.num_record_batches):
+                            writer.write_batch(reader.get_batch(index))
+        finally:
+            writer.close()
+
 
 class JSONExportTransformer(AbstractExportTransformer):
 
@@ -87,34 +293,52 @@ class JSONExportTransformer(AbstractExportTransformer):
     def transform(table: Table, dest_path_no_extension: str, append: bool, is_sitemap: bool = False, lines_per_file: int = -1) -> list[str]:
         if append:
             raise ValueError("JSON Export doesn't support appending")
-        extension = "jsonl"
-        if lines_per_file == -1:
-            full_file_paths = [f"{dest_path_no_extension}.{extension}"]
-        else:
-            # Use table length - 1 here since the header row counts as a row in the table (odd, but true)
-            num_files = math.ceil((table.len() - 1) / lines_per_file)
-            full_file_paths = [os.path.join(dest_path_no_extension, f"sitemap-{current_file_number}.{extension}") for current_file_number in range(0, num_files)]
-        dicts_view = petl.util.base.dicts(table)
-        rows_generator = (row for row in dicts_view)
+        full_file_paths, _ = JSONExportTransformer.write_rows(
+            petl.util.base.dicts(table), dest_path_no_extension, is_sitemap, lines_per_file
+        )
+        return full_file_paths
+
+    @staticmethod
+    def write_rows(rows: Iterable[dict], dest_path_no_extension: str, is_sitemap: bool = False,
+                   lines_per_file: int = -1, compression: Optional[ExportCompression] = None) -> tuple[list[str], int]:
+        """Writes the rows in a single pass, starting a new file every lines_per_file rows if it isn't -1.  Returns the
+        paths written to and the number of rows written."""
+        extension = compressed_path("jsonl", compression)
+        full_file_paths: list[str] = []
         file_path_to_last_mod_time: dict[str, str] = {}
-        for full_file_path in full_file_paths:
-            rows_in_file = 0
-            last_mod_time_in_file = None
-            with open(full_file_path, "w") as file:
-                while lines_per_file == -1 or (rows_in_file) < lines_per_file:
-                    rows_in_file += 1
-                    try:
-                        row = next(rows_generator)
-                    except StopIteration:
-                        break
-                    json.dump(JSONExportTransformer.filter_null_values(row), file)
-                    last_mod_time_in_file = row.get(METADATA_LAST_MODIFIED_TIME)
-                    file.write("\n")
-            if last_mod_time_in_file is not None:
-                file_path_to_last_mod_time[full_file_path] = last_mod_time_in_file
+        num_rows = 0
+        rows_in_file = 0
+        file = None
+        try:
+            for row in rows:
+                if file is None or rows_in_file == lines_per_file:
+                    if file is not None:
+                        file.close()
+                    if lines_per_file == -1:
+                        full_file_path = f"{dest_path_no_extension}.{extension}"
+                    else:
+                        full_file_path = os.path.join(dest_path_no_extension, f"sitemap-{len(full_file_paths)}.{extension}")
+                    full_file_paths.append(full_file_path)
+                    file = open_output(full_file_path, compression)
+                    rows_in_file = 0
+                json.dump(JSONExportTransformer.filter_null_values(row), file)
+                file.write("\n")
+                rows_in_file += 1
+                num_rows += 1
+                last_mod_time = row.get(METADATA_LAST_MODIFIED_TIME)
+                if last_mod_time is not None:
+                    file_path_to_last_mod_time[full_file_paths[-1]] = last_mod_time
+        finally:
+            if file is not None:
+                file.close()
+        if lines_per_file == -1 and len(full_file_paths) == 0:
+            # An empty result is still written out as an empty file
+            full_file_path = f"{dest_path_no_extension}.{extension}"
+            open_output(full_file_path, compression).close()
+            full_file_paths.append(full_file_path)
         if is_sitemap:
             JSONExportTransformer._update_mod_dates_for_sitemap(file_path_to_last_mod_time)
-        return full_file_paths
+        return full_file_paths, num_rows
 
     @staticmethod
     def _update_mod_dates_for_sitemap(file_path_to_last_mod_time):
@@ -227,9 +451,10 @@ class SolrResultTransformer:
     def _registrant_dict(self, rec: dict) -> dict:
         return {METADATA_NAME: rec[SOLR_REGISTRANT][0]}
 
-    def _rename_table_columns_csv(self):
-        """Renames the solr columns to the public names in the public metadata schema, while maintaining CSV tabular format"""
-        renaming_map = {
+    @staticmethod
+    def _csv_renaming_map() -> dict[str, str]:
+        """Maps the solr columns to the public names in the public metadata schema, while maintaining CSV tabular format"""
+        return {
             SOLR_ID: METADATA_SAMPLE_IDENTIFIER,
             SOLR_AUTHORIZED_BY: METADATA_AUTHORIZED_BY,
             SOLR_COMPLIES_WITH: METADATA_COMPLIES_WITH,
@@ -262,13 +487,16 @@ class SolrResultTransformer:
             SOLR_LABEL: METADATA_LABEL,
             SOLR_SOURCE: "source_collection",  # this isn't present in the exported metadata
         }
+
+    def _rename_table_columns_csv(self):
+        """Renames the solr columns to the public names in the public metadata schema, while maintaining CSV tabular format"""
+        renaming_map = self._csv_renaming_map()
         self._table = petl.transform.headers.rename(self._table, renaming_map, strict=False)
         self._table = petl.rename(self._table, renaming_map, strict=False)
 
-    def _rename_table_columns_jsonl(self):
-        """Transforms the solr columns to structured json conforming to the public JSON metadata schema"""
-
-        mappings = OrderedDict()
+    def _jsonl_mappings(self) -> OrderedDict[str, Union[str, Callable]]:
+        """Maps each key in the public JSON metadata schema to either a solr column or a function of the solr record"""
+        mappings: OrderedDict[str, Union[str, Callable]] = OrderedDict()
         mappings[METADATA_SAMPLE_IDENTIFIER] = SOLR_ID
         mappings[METADATA_AT_ID] = SOLR_ISB_CORE_ID
         mappings[METADATA_LABEL] = SOLR_LABEL
@@ -287,7 +515,11 @@ class SolrResultTransformer:
         mappings[METADATA_AUTHORIZED_BY] = SOLR_AUTHORIZED_BY
         mappings[METADATA_COMPLIES_WITH] = SOLR_COMPLIES_WITH
         mappings[METADATA_LAST_MODIFIED_TIME] = SOLR_SOURCE_UPDATED_TIME
-        self._table = petl.fieldmap(self._table, mappings)
+        return mappings
+
+    def _rename_table_columns_jsonl(self):
+        """Transforms the solr columns to structured json conforming to the public JSON metadata schema"""
+        self._table = petl.fieldmap(self._table, self._jsonl_mappings())
 
     def transform(self) -> list[str]:
         """Transforms the table to the destination format.  Return value is the path the output file was written to."""
@@ -297,5 +529,66 @@ class SolrResultTransformer:
         elif self._format == TargetExportFormat.JSONL:
             self._rename_table_columns_jsonl()
             return JSONExportTransformer.transform(self._table, self._result_uuid, self._append, self._is_sitemap, self._lines_per_file)
+        elif self._format in ColumnarExportTransformer.EXTENSIONS:
+            if self._append:
+                raise ValueError(f"{self._format.value} Export doesn't support appending")
+            file_paths, _ = ColumnarExportTransformer.write_rows(
+                petl.util.base.dicts(self._table), self._result_uuid, self._format, list(petl.header(self._table)),
+                self._csv_renaming_map()
+            )
+            return file_paths
+        else:
+            raise ExportTransformException(f"Unsupported export format: {self._format}")
+
+
+class StreamingSolrResultTransformer(SolrResultTransformer):
+    """Transforms solr docs to the destination format in a single pass, so that they can be streamed straight from a
+    solr /export response into the output file(s) without buffering them.  The number of rows written is counted along
+    the way in num_rows.  The fields are the CSV columns, and the schema of the columnar formats, which require them.
+    The columnar formats are compressed internally, so compression only applies to CSV and JSONL."""
+
+    def __init__(self, docs: Iterable[dict], format: TargetExportFormat, result_uuid: str, is_sitemap: bool = False,
+                 lines_per_file: int = -1, fields: Optional[list[str]] = None,
+                 compression: Optional[ExportCompression] = None, csv_header: bool = True):
+        self._docs = docs
+        self._format = format
+        self._result_uuid = result_uuid
+        self._is_sitemap = is_sitemap
+        self._lines_per_file = lines_per_file
+        self._fields = fields
+        self._compression = compression
+        self._csv_header = csv_header
+        self.num_rows = 0
+
+    @staticmethod
+    def _map_record(rec: dict, mappings: OrderedDict[str, Union[str, Callable]]) -> dict:
+        mapped = {}
+        for key, mapping in mappings.items():
+            try:
+                mapped[key] = mapping(rec) if callable(mapping) else rec.get(mapping)
+            except Exception:
+                # Same as petl.fieldmap, a mapping that fails on a record (e.g. a missing registrant) is left empty
+                mapped[key] = None
+        return mapped
+
+    def transform(self) -> list[str]:
+        """Transforms the docs to the destination format.  Return value is the paths the output was written to."""
+        if self._format == TargetExportFormat.CSV:
+            file_paths, self.num_rows = CSVExportTransformer.write_rows(
+                self._docs, self._result_uuid, self._csv_renaming_map(), self._fields, self._csv_header, self._compression
+            )
+        elif self._format in ColumnarExportTransformer.EXTENSIONS:
+            if self._fields is None:
+                raise ExportTransformException(f"{self._format.value} export requires the fields to export")
+            file_paths, self.num_rows = ColumnarExportTransformer.write_rows(
+                self._docs, self._result_uuid, self._format, self._fields, self._csv_renaming_map()
+            )
+        elif self._format == TargetExportFormat.JSONL:
+            mappings = self._jsonl_mappings()
+            records = (self._map_record(doc, mappings) for doc in self._docs)
+            file_paths, self.num_rows = JSONExportTransformer.write_rows(
+                records, self._result_uuid, self._is_sitemap, self._lines_per_file, self._compression
+            )
         else:
             raise ExportTransformException(f"Unsupported export format: {self._format}")
+        return file_paths
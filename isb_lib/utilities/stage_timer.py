@@ -0,0 +1,157 @@
+"""
+Cumulative per-stage timing for batch pipelines like the solr import, to tell which stage a slow run is bound by.
+
+The timer for the running pipeline is activated in a context variable, so that code deep in the pipeline can attribute
+time to a stage with `with stage_timer.timed("stage"):` without the timer being passed down.  Outside of an active
+timer, timed() does nothing.
+"""
+import contextlib
+import contextvars
+import logging
+import os
+import time
+import typing
+from typing import Iterable, Iterator, Optional
+
+_active_timer: contextvars.ContextVar[Optional["StageTimer"]] = contextvars.ContextVar("active_timer", default=None)
+
+T = typing.TypeVar("T")
+
+
+class StageTimer:
+    def __init__(self, name: str, labels: Optional[dict[str, str]] = None):
+        self.name = name
+        self.labels = labels or {}
+        self.start_time = time.monotonic()
+        # stage -> cumulative seconds, in the order the stages were first seen
+        self.stage_seconds: dict[str, float] = {}
+        # stage -> number of records that went through the stage
+        self.stage_records: dict[str, int] = {}
+        self.records = 0
+
+    def add(self, stage: str, seconds: float, records: int = 0):
+        self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+        self.stage_records[stage] = self.stage_records.get(stage, 0) + records
+
+    @contextlib.contextmanager
+    def time(self, stage: str, records: int = 0):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start, records)
+
+    def timed_iter(self, stage: str, iterable: Iterable[T]) -> Iterator[T]:
+        """Yields from the iterable, attributing the time spent producing each item to the stage"""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(stage, time.perf_counter() - start)
+                return
+            self.add(stage, time.perf_counter() - start, 1)
+            yield item
+
+    def elapsed_seconds(self) -> float:
+        return time.monotonic() - self.start_time
+
+    def records_per_second(self) -> float:
+        elapsed = self.elapsed_seconds()
+        return self.records / elapsed if elapsed > 0 else 0.0
+
+    def summary(self) -> str:
+        elapsed = self.elapsed_seconds()
+        stages = []
+        for stage, seconds in self.stage_seconds.items():
+            percent = 100 * seconds / elapsed if elapsed > 0 else 0
+            stage_summary = f"{stage} {seconds:.1f}s ({percent:.0f}%)"
+            records = self.stage_records[stage]
+            if records > 0 and seconds > 0:
+                stage_summary += f" {records / seconds:.0f}/s"
+            stages.append(stage_summary)
+        return (
+            f"{self.name}: {self.records} records in {elapsed:.1f}s, {self.records_per_second():.1f} records/s; "
+            + ", ".join(stages)
+        )
+
+    def _prometheus_labels(self, stage: Optional[str] = None) -> str:
+        labels = dict(self.labels)
+        if stage is not None:
+            labels["stage"] = stage
+        return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+    def prometheus_text(self) -> str:
+        prefix = f"isamples_{self.name}"
+        lines = [
+            f"# HELP {prefix}_stage_seconds_total Cumulative time spent in each stage.",
+            f"# TYPE {prefix}_stage_seconds_total counter",
+        ]
+        for stage, seconds in self.stage_seconds.items():
+            lines.append(f"{prefix}_stage_seconds_total{self._prometheus_labels(stage)} {seconds}")
+        lines.append(f"# HELP {prefix}_stage_records_total Number of records that went through each stage.")
+        lines.append(f"# TYPE {prefix}_stage_records_total counter")
+        for stage, records in self.stage_records.items():
+            lines.append(f"{prefix}_stage_records_total{self._prometheus_labels(stage)} {records}")
+        lines.append(f"# HELP {prefix}_records_total Number of records processed.")
+        lines.append(f"# TYPE {prefix}_records_total counter")
+        lines.append(f"{prefix}_records_total{self._prometheus_labels()} {self.records}")
+        lines.append(f"# HELP {prefix}_records_per_second Average throughput since the start of the run.")
+        lines.append(f"# TYPE {prefix}_records_per_second gauge")
+        lines.append(f"{prefix}_records_per_second{self._prometheus_labels()} {self.records_per_second()}")
+        lines.append(f"# HELP {prefix}_last_report_timestamp_seconds When these values were written.")
+        lines.append(f"# TYPE {prefix}_last_report_timestamp_seconds gauge")
+        lines.append(f"{prefix}_last_report_timestamp_seconds{self._prometheus_labels()} {time.time()}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus_text_file(self, path: str):
+        """Writes the values in the prometheus text format, for the node_exporter textfile collector or to POST to a
+        pushgateway.  The file is replaced atomically so that a collector never reads a partial file."""
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as text_file:
+            text_file.write(self.prometheus_text())
+        os.replace(temp_path, path)
+
+
+class StageReporter:
+    """Logs the timer's summary, and optionally writes the prometheus text file, at most every interval_seconds"""
+
+    def __init__(self, timer: StageTimer, interval_seconds: float, text_file_path: Optional[str] = None):
+        self.timer = timer
+        self.interval_seconds = interval_seconds
+        self.text_file_path = text_file_path
+        self._last_report_time = time.monotonic()
+
+    def report(self):
+        logging.info(self.timer.summary())
+        if self.text_file_path is not None:
+            try:
+                self.timer.write_prometheus_text_file(self.text_file_path)
+            except OSError as e:
+                logging.error("Unable to write stage timings to %s: %s", self.text_file_path, e)
+        self._last_report_time = time.monotonic()
+
+    def maybe_report(self):
+        if time.monotonic() - self._last_report_time >= self.interval_seconds:
+            self.report()
+
+
+@contextlib.contextmanager
+def activate(timer: StageTimer):
+    """Makes the timer the target of timed() for the duration of the block"""
+    token = _active_timer.set(timer)
+    try:
+        yield timer
+    finally:
+        _active_timer.reset(token)
+
+
+@contextlib.contextmanager
+def timed(stage: str, records: int = 0):
+    timer = _active_timer.get()
+    if timer is None:
+        yield
+    else:
+        with timer.time(stage, records):
+            yield
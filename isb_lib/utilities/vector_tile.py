@@ -0,0 +1,205 @@
+"""
+Minimal encoder for Mapbox Vector Tiles, see https://github.com/mapbox/vector-tile-spec/tree/master/2.1
+
+Only the subset needed to render sample points and h3 cell polygons is supported.  Geometry is supplied in lon/lat,
+projected to web mercator tile coordinates, and quantized to the tile extent, which drops vertices that collapse onto
+the same tile pixel.
+"""
+import math
+import struct
+from typing import Any, Optional
+
+MEDIA_MVT = "application/vnd.mapbox-vector-tile"
+DEFAULT_EXTENT = 4096
+# Web mercator can't represent the poles, so latitudes are clamped to this value
+MAX_MERCATOR_LATITUDE = 85.0511287798066
+
+GEOM_POINT = 1
+GEOM_POLYGON = 3
+
+_CMD_MOVE_TO = 1
+_CMD_LINE_TO = 2
+_CMD_CLOSE_PATH = 7
+
+# Protobuf wire types
+_WIRE_VARINT = 0
+_WIRE_64BIT = 1
+_WIRE_LENGTH_DELIMITED = 2
+
+
+def tile_bounds(z: int, x: int, y: int) -> tuple[float, float, float, float]:
+    """Returns the min_lon, min_lat, max_lon, max_lat of the web mercator tile"""
+    n = 2 ** z
+
+    def _lat(tile_y: int) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / n))))
+
+    return x / n * 360.0 - 180.0, _lat(y + 1), (x + 1) / n * 360.0 - 180.0, _lat(y)
+
+
+def is_valid_tile(z: int, x: int, y: int) -> bool:
+    return z >= 0 and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        bits = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(bits | 0x80)
+        else:
+            out.append(bits)
+            return bytes(out)
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def _key(field_number: int, wire_type: int) -> bytes:
+    return _varint((field_number << 3) | wire_type)
+
+
+def _varint_field(field_number: int, value: int) -> bytes:
+    return _key(field_number, _WIRE_VARINT) + _varint(value)
+
+
+def _bytes_field(field_number: int, value: bytes) -> bytes:
+    return _key(field_number, _WIRE_LENGTH_DELIMITED) + _varint(len(value)) + value
+
+
+def _packed_field(field_number: int, values: list[int]) -> bytes:
+    return _bytes_field(field_number, b"".join(_varint(value) for value in values))
+
+
+def _command(command_id: int, count: int) -> int:
+    return (command_id & 0x7) | (count << 3)
+
+
+def _encode_value(value: Any) -> bytes:
+    if isinstance(value, bool):
+        return _varint_field(7, int(value))
+    if isinstance(value, int):
+        if value >= 0:
+            return _varint_field(5, value)
+        return _varint_field(6, _zigzag(value))
+    if isinstance(value, float):
+        return _key(3, _WIRE_64BIT) + struct.pack("<d", value)
+    return _bytes_field(1, str(value).encode("utf-8"))
+
+
+class VectorTileLayer:
+    """A single named layer of features within the z/x/y tile"""
+
+    def __init__(self, name: str, z: int, x: int, y: int, extent: int = DEFAULT_EXTENT):
+        self.name = name
+        self.z = z
+        self.x = x
+        self.y = y
+        self.extent = extent
+        self._features: list[bytes] = []
+        self._keys: dict[str, int] = {}
+        self._values: dict[tuple[type, Any], int] = {}
+
+    def __len__(self):
+        return len(self._features)
+
+    def project(self, lon: float, lat: float) -> tuple[int, int]:
+        """Projects the lon/lat to integer tile coordinates, which may fall outside of the tile extent"""
+        n = 2 ** self.z
+        lat = max(-MAX_MERCATOR_LATITUDE, min(MAX_MERCATOR_LATITUDE, lat))
+        world_x = (lon + 180.0) / 360.0 * n
+        lat_radians = math.radians(lat)
+        world_y = (1.0 - math.asinh(math.tan(lat_radians)) / math.pi) / 2.0 * n
+        return round((world_x - self.x) * self.extent), round((world_y - self.y) * self.extent)
+
+    def _tags(self, properties: dict) -> list[int]:
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            key_index = self._keys.setdefault(key, len(self._keys))
+            # bool is a subclass of int, so include the type to keep True and 1 distinct
+            value_index = self._values.setdefault((type(value), value), len(self._values))
+            tags.extend([key_index, value_index])
+        return tags
+
+    def _add_feature(self, geom_type: int, geometry: list[int], properties: dict, feature_id: Optional[int]):
+        encoded = b""
+        if feature_id is not None:
+            encoded += _varint_field(1, feature_id)
+        tags = self._tags(properties)
+        if len(tags) > 0:
+            encoded += _packed_field(2, tags)
+        encoded += _varint_field(3, geom_type)
+        encoded += _packed_field(4, geometry)
+        self._features.append(encoded)
+
+    def add_point(self, lon: float, lat: float, properties: dict, feature_id: Optional[int] = None):
+        px, py = self.project(lon, lat)
+        self._add_feature(GEOM_POINT, [_command(_CMD_MOVE_TO, 1), _zigzag(px), _zigzag(py)], properties, feature_id)
+
+    def add_polygon(self, rings: list[list], properties: dict, feature_id: Optional[int] = None) -> bool:
+        """Adds a polygon given as GeoJSON-style lon/lat rings, the first being the exterior ring.
+
+        Returns False if the polygon collapsed to nothing at this zoom level and was skipped.
+        """
+        geometry: list[int] = []
+        cursor = (0, 0)
+        for ring_index, ring in enumerate(rings):
+            points = self._quantized_ring(ring)
+            if points is None:
+                if ring_index == 0:
+                    return False
+                continue
+            # Exterior rings must have a positive area in tile coordinates (clockwise on screen), interior negative
+            if (_signed_area(points) > 0) != (ring_index == 0):
+                points.reverse()
+            geometry.append(_command(_CMD_MOVE_TO, 1))
+            geometry.extend([_zigzag(points[0][0] - cursor[0]), _zigzag(points[0][1] - cursor[1])])
+            geometry.append(_command(_CMD_LINE_TO, len(points) - 1))
+            for previous, point in zip(points, points[1:]):
+                geometry.extend([_zigzag(point[0] - previous[0]), _zigzag(point[1] - previous[1])])
+            geometry.append(_command(_CMD_CLOSE_PATH, 1))
+            cursor = points[-1]
+        self._add_feature(GEOM_POLYGON, geometry, properties, feature_id)
+        return True
+
+    def _quantized_ring(self, ring: list) -> Optional[list[tuple[int, int]]]:
+        points: list[tuple[int, int]] = []
+        for coordinate in ring:
+            point = self.project(coordinate[0], coordinate[1])
+            if len(points) == 0 or point != points[-1]:
+                points.append(point)
+        # The closing point is implied by ClosePath
+        if len(points) > 1 and points[0] == points[-1]:
+            points.pop()
+        if len(points) < 3 or _signed_area(points) == 0:
+            return None
+        return points
+
+    def encode(self) -> bytes:
+        encoded = _varint_field(15, 2) + _bytes_field(1, self.name.encode("utf-8"))
+        for feature in self._features:
+            encoded += _bytes_field(2, feature)
+        for key in self._keys.keys():
+            encoded += _bytes_field(3, key.encode("utf-8"))
+        for _, value in self._values.keys():
+            encoded += _bytes_field(4, _encode_value(value))
+        encoded += _varint_field(5, self.extent)
+        return encoded
+
+
+def _signed_area(points: list[tuple[int, int]]) -> int:
+    """Twice the signed area of the ring, using the surveyor's formula"""
+    area = 0
+    for index, point in enumerate(points):
+        next_point = points[(index + 1) % len(points)]
+        area += point[0] * next_point[1] - next_point[0] * point[1]
+    return area
+
+
+def encode_tile(layers: list[VectorTileLayer]) -> bytes:
+    """Encodes the non-empty layers as a vector tile"""
+    return b"".join(_bytes_field(3, layer.encode()) for layer in layers if len(layer) > 0)
@@ -1,10 +1,10 @@
+import asyncio
 import logging
 import typing
 from typing import Any
 
 import fastapi
-import requests
-import starlette.middleware.base
+import httpx
 import json
 import isb_web.config
 from isb_web.isb_enums import _NoValue
@@ -52,13 +52,24 @@ def attach_analytics_state_to_request(
     request.state.metrics = metrics_dict
 
 
-class AnalyticsMiddleware(starlette.middleware.base.BaseHTTPMiddleware):
+# Counts of analytics events by what happened to them, reported by /metrics
+ANALYTICS_COUNTS = {
+    "sent": 0,
+    "failed": 0,
+    "dropped": 0,
+}
+
+
+class AnalyticsMiddleware:
     """
     Middleware for sending analytics messages to plausible.
 
     This middleware wraps requests and checks for a request.state.metrics dict property.
     If present, then metrics["event"] is used as the event and metrics["properties"]
     if present is used as the optional properties to include with the event.
+
+    Events are put on a bounded queue that a single task drains, so sending them never holds up a request or a worker.
+    When plausible can't keep up and the queue is full, events are dropped and counted in ANALYTICS_COUNTS.
     """
 
     def __init__(
@@ -66,42 +77,64 @@ class AnalyticsMiddleware(starlette.middleware.base.BaseHTTPMiddleware):
         app,
         analytics_url: str = ANALYTICS_URL,
         analytics_domain: str = ANALYTICS_DOMAIN,
+        queue_size: int = isb_web.config.Settings().analytics_queue_size,
+        batch_size: int = isb_web.config.Settings().analytics_batch_size,
     ):
-        super().__init__(app)
+        self.app = app
         self.analytics_url = analytics_url
         self.analytics_domain = analytics_domain
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self._queue: typing.Optional[asyncio.Queue] = None
+        self._sender: typing.Optional[asyncio.Task] = None
 
-    async def dispatch(self, request: fastapi.Request, call_next: typing.Callable):
+    async def __call__(self, scope, receive, send):
         """
         Wraps a request to send an analytics message on completion.
 
         A methods reports metrics by appending a metric to request.state.metrics.
-
-        Checks for response.state.analytics, if present then sends off the bundle.
         """
-        request.state.metrics = None
-        response = await call_next(request)
-        if self.analytics_domain is not None and self.analytics_url is not None:
-            if request.state.metrics is not None:
-                _headers = self._analytics_request_headers(request)
-                _data = self._analytics_request_data(
-                    request.state.metrics.get(EVENT, None),
-                    request,
-                    request.state.metrics.get(PROPERTIES, None),
-                )
-                response.background = starlette.background.BackgroundTask(
-                    self.send_metrics, _headers, _data
-                )
-        return response
-
-    def send_metrics(self, headers: dict, data: dict):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        state = scope.setdefault("state", {})
+        state["metrics"] = None
+        await self.app(scope, receive, send)
+        metrics = state.get("metrics")
+        if metrics is not None and self.analytics_domain is not None and self.analytics_url is not None:
+            request = fastapi.Request(scope)
+            headers = self._analytics_request_headers(request)
+            data = self._analytics_request_data(metrics.get(EVENT, None), request, metrics.get(PROPERTIES, None))
+            self._enqueue(headers, data)
+
+    def _enqueue(self, headers: dict, data: dict):
+        loop = asyncio.get_running_loop()
+        if self._sender is None or self._sender.done() or self._sender.get_loop() is not loop:
+            # Started lazily since middleware has no startup hook, and restarted if the event loop changed
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._sender = loop.create_task(self._send_batches(self._queue))
+        try:
+            self._queue.put_nowait((headers, data))  # type: ignore
+        except asyncio.QueueFull:
+            ANALYTICS_COUNTS["dropped"] += 1
+
+    async def _send_batches(self, queue: asyncio.Queue):
+        async with httpx.AsyncClient(timeout=1) as client:
+            while True:
+                batch = [await queue.get()]
+                while len(batch) < self.batch_size and not queue.empty():
+                    batch.append(queue.get_nowait())
+                # plausible's events API takes a single event per request, so send the batch's requests concurrently
+                await asyncio.gather(*[self.send_metrics(client, headers, data) for headers, data in batch])
+
+    async def send_metrics(self, client: httpx.AsyncClient, headers: dict, data: dict):
         post_data_str = json.dumps(data).encode("utf-8")
         try:
-            response = requests.post(
-                self.analytics_url, headers=headers, data=post_data_str, timeout=1
-            )
-            response.close()
+            response = await client.post(self.analytics_url, headers=headers, content=post_data_str)
+            await response.aclose()
+            ANALYTICS_COUNTS["sent"] += 1
         except Exception as e:
+            ANALYTICS_COUNTS["failed"] += 1
             logging.error(
                 "Exception recording analytics event %s, exception: %s",
                 data.get("event"),
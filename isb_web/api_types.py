@@ -13,6 +13,11 @@ class ThingsSitemapParams(BaseModel):
     identifiers: list[str]
 
 
+class ThingsStreamParams(ThingsSitemapParams):
+    # Thing fields to include in each row, defaults to all of them.  Omit resolved_content when it isn't needed.
+    fields: Optional[list[str]] = None
+
+
 class ReliqueryResponse(BaseModel):
     timestamp: str
     url: str
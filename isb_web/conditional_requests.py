@@ -0,0 +1,123 @@
+"""
+Helpers for HTTP conditional requests (https://www.rfc-editor.org/rfc/rfc9110#name-conditional-requests), so that
+clients re-fetching an unchanged record get a 304 instead of the full body, and for range requests
+(https://www.rfc-editor.org/rfc/rfc9110#name-range-requests), so that interrupted downloads can be resumed.
+"""
+import datetime
+import email.utils
+import hashlib
+from typing import Optional
+
+import fastapi
+import fastapi.responses
+
+IF_NONE_MATCH = "if-none-match"
+IF_MODIFIED_SINCE = "if-modified-since"
+IF_RANGE = "if-range"
+RANGE = "range"
+
+
+class RangeNotSatisfiableException(Exception):
+    pass
+
+
+def strong_etag(*parts) -> str:
+    """A strong entity tag derived from the values that determine the representation"""
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+    return f'"{digest}"'
+
+
+def _as_utc(last_modified: datetime.datetime) -> datetime.datetime:
+    if last_modified.tzinfo is None:
+        # Database timestamps are stored in UTC
+        return last_modified.replace(tzinfo=datetime.timezone.utc)
+    return last_modified.astimezone(datetime.timezone.utc)
+
+
+def http_date(last_modified: datetime.datetime) -> str:
+    return email.utils.format_datetime(_as_utc(last_modified), usegmt=True)
+
+
+def has_validators(request: fastapi.Request) -> bool:
+    """Whether the request is conditional, i.e. whether it's worth checking for a 304 before loading the record"""
+    return IF_NONE_MATCH in request.headers or IF_MODIFIED_SINCE in request.headers
+
+
+def is_not_modified(request: fastapi.Request, etag: str, last_modified: Optional[datetime.datetime]) -> bool:
+    """Whether the client's cached copy is current, in which case a 304 should be returned"""
+    if_none_match = request.headers.get(IF_NONE_MATCH)
+    if if_none_match is not None:
+        # If-None-Match uses the weak comparison, and takes precedence over If-Modified-Since
+        if if_none_match.strip() == "*":
+            return True
+        opaque_tag = etag.removeprefix("W/")
+        return any(tag.strip().removeprefix("W/") == opaque_tag for tag in if_none_match.split(","))
+    if_modified_since = request.headers.get(IF_MODIFIED_SINCE)
+    if if_modified_since is not None and last_modified is not None:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=datetime.timezone.utc)
+        # HTTP dates only have second resolution
+        return _as_utc(last_modified).replace(microsecond=0) <= since
+    return False
+
+
+def validator_headers(etag: str, last_modified: Optional[datetime.datetime]) -> dict[str, str]:
+    headers = {"ETag": etag}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+
+def not_modified_response(etag: str, last_modified: Optional[datetime.datetime]) -> fastapi.responses.Response:
+    return fastapi.responses.Response(status_code=304, headers=validator_headers(etag, last_modified))
+
+
+def if_range_matches(request: fastapi.Request, etag: str, last_modified: Optional[datetime.datetime]) -> bool:
+    """Whether the Range header should be honored, i.e. there's no If-Range or it matches the current representation.
+    If-Range uses the strong comparison, so weak entity tags never match."""
+    if_range = request.headers.get(IF_RANGE)
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return not etag.startswith("W/") and if_range == etag
+    if last_modified is None:
+        return False
+    try:
+        since = email.utils.parsedate_to_datetime(if_range)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=datetime.timezone.utc)
+    return _as_utc(last_modified).replace(microsecond=0) == since
+
+
+def byte_range(range_header: str, size: int) -> Optional[tuple[int, int]]:
+    """The first and last byte positions of the range requested by the Range header, or None if the header should be
+    ignored and the whole representation sent.  That's the case when it isn't a valid bytes range, or asks for more
+    than one range.  Raises RangeNotSatisfiableException if the range starts past the end of the representation."""
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    first, separator, last = ranges.strip().partition("-")
+    if separator != "-" or not (first.isdigit() or first == "") or not (last.isdigit() or last == ""):
+        return None
+    if first == "":
+        if last == "":
+            return None
+        # A suffix range, the last N bytes
+        suffix_length = int(last)
+        if suffix_length == 0 or size == 0:
+            raise RangeNotSatisfiableException()
+        return max(0, size - suffix_length), size - 1
+    first_position = int(first)
+    if last != "" and int(last) < first_position:
+        return None
+    if first_position >= size:
+        raise RangeNotSatisfiableException()
+    last_position = size - 1 if last == "" else min(int(last), size - 1)
+    return first_position, last_position
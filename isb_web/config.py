@@ -38,6 +38,9 @@ class Settings(BaseSettings):
 
     # The domain to record analytics events for, needs to be configured as a site in plausible.io
     analytics_domain: str = "UNSET"
+    # Maximum number of analytics events waiting to be sent before new ones are dropped, and how many are sent at once
+    analytics_queue_size: int = 1000
+    analytics_batch_size: int = 50
 
     # The URL to the datacite API
     datacite_url: str = "https://api.test.datacite.org/"
@@ -112,6 +115,68 @@ class Settings(BaseSettings):
     # uses a lot of memory so shouldn't be enabled by default.
     taxon_cache_enabled: bool = False
 
+    # Number of h3 cell geometries to keep in memory when rendering the /h3_counts/ endpoint
+    h3_geometry_lru_cache_size: int = 100000
+    # Optional path to a sqlite file of precomputed h3 cell geometries, built with scripts/build_h3_geometry_cache.py
+    h3_geometry_cache_path: str = "UNSET"
+    # Highest h3 resolution with counts materialized by scripts/materialize_h3_counts.py and after each solr import
+    h3_count_max_materialized_resolution: int = 6
+
+    # Number of transformed core representations of things to keep in memory, in front of the thingcorecontent table
+    core_content_lru_cache_size: int = 10000
+
+    # How long to reuse the solr index version before refetching it.  Caches keyed on the index version may serve
+    # stale results for up to this long after a solr commit.
+    solr_index_version_ttl_seconds: int = 10
+    # How long to reuse the per authority and status thing counts reported by the /thing/ listing, unless an exact
+    # count is requested
+    thing_count_cache_ttl_seconds: int = 300
+    # How often /metrics recomputes the thing and solr counts in the background
+    metrics_refresh_interval_seconds: int = 60
+    # Exports (other than sitemaps) of more than export_rows_per_partition records are split into disjoint slices of the
+    # id hash space that are streamed from solr concurrently, up to export_max_partitions of them
+    export_rows_per_partition: int = 500000
+    export_max_partitions: int = 4
+    # Identical export requests share a job.  A completed export is reused until the solr index changes or the file is
+    # removed, export_artifact_ttl_seconds after it completed.  Unfinished jobs older than export_job_timeout_seconds
+    # aren't attached to.
+    export_artifact_ttl_seconds: int = 86400
+    export_job_timeout_seconds: int = 21600
+    # How often expired export files are looked for and removed
+    export_cleanup_interval_seconds: int = 3600
+    # Export jobs are queued in the database and run by export_worker processes, each running up to
+    # export_worker_concurrency jobs at a time.  Workers poll for jobs and heartbeat the ones they're running every
+    # export_worker_poll_interval_seconds.  A job whose heartbeat is older than export_job_heartbeat_timeout_seconds is
+    # assumed to have lost its worker and is retried, up to export_job_max_attempts claims.
+    export_worker_concurrency: int = 2
+    export_worker_poll_interval_seconds: int = 5
+    export_job_heartbeat_timeout_seconds: int = 60
+    export_job_max_attempts: int = 3
+    # Number of jobs the web app runs itself, for deployments without a separate export_worker.  Leave at 0 in
+    # production so that exports don't compete with API requests.
+    export_in_process_worker_concurrency: int = 0
+    # Longest /export/status?wait= may wait for a job's status to change, and how often waiting requests and
+    # /export/status/events recheck it.  Progress is only updated at worker heartbeats, so rechecking more often than
+    # export_worker_poll_interval_seconds doesn't help.
+    export_status_max_wait_seconds: int = 60
+    export_status_check_interval_seconds: int = 2
+    # How often a solr import logs its per-stage timings, and an optional path to also write them to in the prometheus
+    # text format, e.g. in the node_exporter textfile collector directory
+    solr_import_report_interval_seconds: int = 60
+    solr_import_metrics_path: str = "UNSET"
+    # Number of /thing/select responses to keep in memory, and for how long.  Entries are also keyed on the solr index
+    # version, so the TTL only bounds staleness within the solr_index_version_ttl_seconds window.
+    solr_select_cache_size: int = 1000
+    solr_select_cache_ttl_seconds: int = 60
+    # /thing/select queries requesting more rows than this bypass the cache and are streamed from solr
+    solr_select_cache_max_rows: int = 100
+    # Number of encoded vector tiles to keep in memory for /tiles/
+    tile_cache_size: int = 2048
+    # Zoom level at which /tiles/ switches from h3 cell aggregates to individual sample points
+    tile_points_min_zoom: int = 9
+    # Maximum number of sample points encoded in a single tile
+    tile_max_points: int = 20000
+
     sitemap_dir_prefix: str = "/app/sitemaps/"
     sitemap_url_prefix: str = ""
     sitemap_solr_query: str = "*:*"
@@ -1,25 +1,34 @@
 import asyncio
 import datetime
+import glob
+import hashlib
 import json
 import logging
+import math
+import mimetypes
 import os.path
+import shutil
+import threading
 import traceback
 import urllib
-from typing import Optional
+from typing import Iterable, Iterator, Optional
 import concurrent
 from urllib.error import HTTPError
 from urllib.request import urlopen
 
 import fastapi.responses
 import igsn_lib.time
-import petl
 import ijson
+import pyarrow
 import time
 from fastapi import Depends, FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from sqlmodel import Session
 from starlette.middleware.gzip import GZipMiddleware
-from starlette.responses import JSONResponse, FileResponse
-from starlette.status import HTTP_201_CREATED, HTTP_404_NOT_FOUND, HTTP_200_OK, HTTP_202_ACCEPTED
+from starlette.responses import JSONResponse, FileResponse, Response, StreamingResponse
+from starlette.types import Receive, Scope, Send
+from starlette.status import HTTP_201_CREATED, HTTP_404_NOT_FOUND, HTTP_200_OK, HTTP_202_ACCEPTED, \
+    HTTP_204_NO_CONTENT, HTTP_206_PARTIAL_CONTENT, HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
 
 import isb_web
 from isamples_metadata.solr_field_constants import SOLR_ID, SOLR_LABEL, SOLR_HAS_CONTEXT_CATEGORY, \
@@ -35,19 +44,40 @@ from isamples_metadata.solr_field_constants import SOLR_ID, SOLR_LABEL, SOLR_HAS
 from isb_lib.models.export_job import ExportJob
 from isb_lib.sitemaps import _build_sitemap
 from isb_lib.sitemaps.thing_sitemap import MAX_URLS_IN_SITEMAP, ThingSitemapIndexIterator
-from isb_lib.utilities.solr_result_transformer import SolrResultTransformer, TargetExportFormat
-from isb_web import isb_solr_query, analytics, sqlmodel_database, auth
+from isb_lib.utilities.solr_result_transformer import StreamingSolrResultTransformer, TargetExportFormat, \
+    ColumnarExportTransformer, ExportCompression
+from isb_web import isb_solr_query, analytics, sqlmodel_database, auth, conditional_requests
 from isb_web.analytics import AnalyticsEvent
 from isb_web.sqlmodel_database import SQLModelDAO
 
 EXPORT_PREFIX = "/export"
+
+
+class ExportGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware for everything but the downloads, which are served as stored so that byte ranges refer to the
+    file, and the status events, which the compressor would buffer rather than send as they happen"""
+
+    UNCOMPRESSED_PATHS = ("/download", "/status/events")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["path"].endswith(self.UNCOMPRESSED_PATHS):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
 export_app = FastAPI(prefix=EXPORT_PREFIX)
 auth.add_auth_middleware_to_app(export_app)
-export_app.add_middleware(GZipMiddleware)
+export_app.add_middleware(ExportGZipMiddleware)
 dao: Optional[SQLModelDAO] = None
 DEFAULT_SOLR_FIELDS_FOR_EXPORT = [SOLR_ID, SOLR_AUTHORIZED_BY, SOLR_COMPLIES_WITH, SOLR_PRODUCED_BY_SAMPLING_SITE_LOCATION_LONGITUDE, SOLR_PRODUCED_BY_SAMPLING_SITE_LOCATION_LATITUDE, SOLR_RELATED_RESOURCE_ISB_CORE_ID, SOLR_CURATION_RESPONSIBILITY, SOLR_CURATION_LOCATION, SOLR_CURATION_ACCESS_CONSTRAINTS, SOLR_CURATION_DESCRIPTION, SOLR_CURATION_LABEL, SOLR_SAMPLING_PURPOSE, SOLR_REGISTRANT, SOLR_PRODUCED_BY_SAMPLING_SITE_PLACE_NAME, SOLR_PRODUCED_BY_SAMPLING_SITE_ELEVATION_IN_METERS, SOLR_PRODUCED_BY_SAMPLING_SITE_LABEL, SOLR_PRODUCED_BY_SAMPLING_SITE_DESCRIPTION, SOLR_PRODUCED_BY_RESULT_TIME, SOLR_PRODUCED_BY_RESPONSIBILITY, SOLR_PRODUCED_BY_FEATURE_OF_INTEREST, SOLR_PRODUCED_BY_DESCRIPTION, SOLR_PRODUCED_BY_LABEL, SOLR_PRODUCED_BY_ISB_CORE_ID, SOLR_INFORMAL_CLASSIFICATION, SOLR_KEYWORDS, SOLR_HAS_SPECIMEN_CATEGORY, SOLR_HAS_MATERIAL_CATEGORY, SOLR_HAS_CONTEXT_CATEGORY, SOLR_DESCRIPTION, SOLR_LABEL, SOLR_SOURCE, SOLR_ISB_CORE_ID, SOLR_SOURCE_UPDATED_TIME]
 MINIMAL_SOLR_FIELDS_FOR_EXPORT = [SOLR_ID, SOLR_PRODUCED_BY_SAMPLING_SITE_LOCATION_LATITUDE, SOLR_PRODUCED_BY_SAMPLING_SITE_LOCATION_LONGITUDE, SOLR_SOURCE]
 INITIAL_CURSOR_MARK = "*"
+EXPORT_MEDIA_TYPES = {
+    ".parquet": "application/vnd.apache.parquet",
+    ".arrow": "application/vnd.apache.arrow.file",
+}
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
 
 
 def get_session():
@@ -55,25 +85,255 @@ def get_session():
         yield session
 
 
-executor = concurrent.futures.ThreadPoolExecutor(max_workers=5)
+# Separate from the export worker's job threads so that jobs waiting on their partitions can't starve them of threads
+partition_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=max(1, isb_web.config.Settings().export_max_partitions), thread_name_prefix="export_partition"
+)
+
+
+class ExportCancelledException(Exception):
+    pass
+
+
+class ExportProgress:
+    """How far along a running export is.  Updated by the threads writing the export, and read by the export worker to
+    record on the job when it heartbeats."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.rows_written = 0
+        self.dest_path_no_extension: Optional[str] = None
+        self._started = time.time()
+
+    def add_row(self):
+        with self._lock:
+            self.rows_written += 1
+
+    def bytes_written(self) -> int:
+        """Total size of the files written so far.  Compressed output is buffered, so this lags a little behind."""
+        if self.dest_path_no_extension is None:
+            return 0
+        if os.path.isdir(self.dest_path_no_extension):
+            # Sitemaps are written to a directory shared with the earlier sitemap exports, so only count what this one
+            # has written to it
+            return sum(
+                entry.stat().st_size for entry in os.scandir(self.dest_path_no_extension)
+                if entry.is_file() and entry.stat().st_mtime >= self._started
+            )
+        return sum(_file_size_or_zero(path) for path in _export_output_files(self.dest_path_no_extension))
+
 
+def _export_output_files(dest_path_no_extension: str) -> list[str]:
+    """The files written for the export other than a sitemap, i.e. the final file or its partitions"""
+    return [path for path in glob.glob(f"{glob.escape(dest_path_no_extension)}*") if os.path.isfile(path)]
 
-def search_solr_and_export_results(export_job_id: str):
+
+def _file_size_or_zero(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        # e.g. a partition removed after concatenating it
+        return 0
+
+
+def search_solr_and_export_results(export_job_id: str, cancelled: Optional[threading.Event] = None,
+                                   progress: Optional[ExportProgress] = None, worker_id: Optional[str] = None):
+    """Runs the export job, stopping early if cancelled is set, and counting what's been written in progress.  The job
+    is only completed if worker_id, by default the worker recorded on the job, still owns it by then."""
     try:
-        _search_solr_and_export_results(export_job_id)
+        _search_solr_and_export_results(export_job_id, cancelled, progress or ExportProgress(), worker_id)
     except Exception as e:
         logging.error(f"Exception exporting job {export_job_id}, error: {e}")
         traceback.print_tb(e.__traceback__)
 
 
-def _handle_error(session: Session, export_job: ExportJob, error: str):
-    export_job.tcompleted = datetime.datetime.now()
-    export_job.error = error
-    sqlmodel_database.save_or_update_export_job(session, export_job)
+def _finish(session: Session, export_job: ExportJob, worker_id: Optional[str], values: dict) -> bool:
+    """Completes the job, unless another worker reclaimed it while this one was running it"""
+    if sqlmodel_database.finish_export_job(session, export_job.uuid, worker_id, values):  # type: ignore
+        return True
+    logging.info(f"Export job {export_job.uuid} was claimed by another worker, leaving it to that worker")
+    return False
+
+
+def _handle_error(session: Session, export_job: ExportJob, worker_id: Optional[str], error: str):
+    _finish(session, export_job, worker_id, {"error": error})
+
+
+def _handle_cancelled(session: Session, export_job: ExportJob, worker_id: Optional[str], dest_path_no_extension: str):
+    # The job also stops when its heartbeat fails because another worker reclaimed it.  The files then belong to the new
+    # owner, so they're only removed once the job is known to be ours and cancelled.
+    if not _finish(session, export_job, worker_id, {"error": sqlmodel_database.EXPORT_JOB_CANCELLED}):
+        return
+    logging.info(f"Export job {export_job.uuid} was cancelled")
+    if export_job.is_sitemap:
+        # Sitemaps can't be cancelled, their files are mixed in with the earlier sitemaps'
+        return
+    for partial_path in _export_output_files(dest_path_no_extension):
+        os.remove(partial_path)
+
+
+def _tracked(docs: Iterable[dict], cancelled: Optional[threading.Event],
+             progress: Optional[ExportProgress], stopped: Optional[threading.Event] = None) -> Iterator[dict]:
+    """Yields the docs, counting them in progress, until cancelled or stopped is set, then raises
+    ExportCancelledException"""
+    for doc in docs:
+        if (cancelled is not None and cancelled.is_set()) or (stopped is not None and stopped.is_set()):
+            raise ExportCancelledException()
+        if progress is not None:
+            progress.add_row()
+        yield doc
+
+
+def _solr_num_found_or_none(solr_query_params: dict) -> Optional[int]:
+    try:
+        return isb_solr_query.solr_num_found(solr_query_params)
+    except Exception as e:
+        logging.warning(f"Unable to estimate export size: {e}")
+        return None
+
+
+def _num_partitions(num_found: Optional[int], solr_query_params: dict, export_format: TargetExportFormat) -> int:
+    """Number of partitions to split the export into, based on the number of records it will return"""
+    settings = isb_web.config.Settings()
+    if settings.export_max_partitions <= 1 or num_found is None:
+        return 1
+    if export_format != TargetExportFormat.JSONL and _export_fields(solr_query_params) is None:
+        # The partitions have to agree on the CSV columns or the schema, which we can only do if they're spelled out
+        return 1
+    return max(1, min(settings.export_max_partitions, math.ceil(num_found / settings.export_rows_per_partition)))
+
+
+def _export_fields(solr_query_params: dict) -> Optional[list[str]]:
+    """The fields listed in fl, or None if fl is missing or uses wildcards"""
+    fields = [field.strip() for field in solr_query_params.get("fl", "").split(",") if len(field.strip()) > 0]
+    if len(fields) == 0 or any("*" in field for field in fields):
+        return None
+    return fields
+
+
+def _partition_params(solr_query_params: dict, partition: int, num_partitions: int) -> dict:
+    """Restricts the query to one of num_partitions disjoint slices of the id hash space"""
+    if num_partitions == 1:
+        return solr_query_params
+    params = dict(solr_query_params)
+    hash_filter = f"{{!hash workers={num_partitions} worker={partition}}}"
+    fq = params.get("fq")
+    params["fq"] = [fq, hash_filter] if fq is not None else [hash_filter]
+    params["partitionKeys"] = SOLR_ID
+    return params
+
+
+def _export_partition(solr_query_params: dict, export_format: TargetExportFormat, dest_path_no_extension: str,
+                      is_sitemap: bool = False, lines_per_file: int = -1, fields: Optional[list[str]] = None,
+                      compression: Optional[ExportCompression] = None, csv_header: bool = True,
+                      cancelled: Optional[threading.Event] = None,
+                      progress: Optional[ExportProgress] = None,
+                      stopped: Optional[threading.Event] = None) -> tuple[list[str], int]:
+    """Streams the results of the query from the solr export handler to disk.  Returns the paths written to and the
+    number of records written.  stopped is set to stop the partition because one of its siblings failed."""
+    encoded_params = urllib.parse.urlencode(solr_query_params, doseq=True)
+    export_handler = isb_solr_query.get_solr_url("export")
+    full_url = f"{export_handler}?{encoded_params}"
+    logging.info(f"going to try and open {full_url}")
+    # The docs are transformed and written as they're parsed off the response, in a single pass that also counts them
+    # and splits the sitemap files
+    with urlopen(full_url) as src:
+        docs = _tracked(ijson.items(src, "response.docs.item", use_float=True), cancelled, progress, stopped)
+        solr_result_transformer = StreamingSolrResultTransformer(
+            docs, export_format, dest_path_no_extension, is_sitemap, lines_per_file, fields, compression, csv_header
+        )
+        file_paths = solr_result_transformer.transform()
+    return file_paths, solr_result_transformer.num_rows
+
+
+def _concatenate_partitions(export_format: TargetExportFormat, partition_paths: list[str], dest_path: str):
+    if export_format in ColumnarExportTransformer.EXTENSIONS:
+        ColumnarExportTransformer.concatenate(export_format, partition_paths, dest_path)
+        for partition_path in partition_paths:
+            os.remove(partition_path)
+        return
+    # Only the first partition has a CSV header, so the text formats are a straight concatenation.  That holds for the
+    # compressed ones too, since a sequence of gzip members or zstd frames is itself a valid gzip or zstd file.
+    with open(dest_path, "wb") as dest_file:
+        for partition_path in partition_paths:
+            with open(partition_path, "rb") as partition_file:
+                shutil.copyfileobj(partition_file, dest_file)
+            os.remove(partition_path)
+
+
+def _stop_partitions(futures: list[concurrent.futures.Future], stopped: threading.Event, dest_path_no_extension: str,
+                     cancelled: Optional[threading.Event]):
+    """Stops the rest of the partitions once one has failed, so that they don't keep querying solr and writing files
+    for a failed job, then removes what they wrote and raises the failure"""
+    stopped.set()
+    concurrent.futures.wait(futures)
+    errors = [error for error in (future.exception() for future in futures) if error is not None]
+    if cancelled is not None and cancelled.is_set():
+        # Cleaned up once the job is known to be cancelled rather than reclaimed by another worker
+        raise ExportCancelledException()
+    for partial_path in _export_output_files(dest_path_no_extension):
+        os.remove(partial_path)
+    # The stopped partitions raise ExportCancelledException, so raise what actually failed the job
+    raise next(error for error in errors if not isinstance(error, ExportCancelledException))
 
 
-def _search_solr_and_export_results(export_job_id: str):
-    """Task function that gets a queued export job from the db, executes the solr query, and writes results to disk"""
+def _export_partitioned(solr_query_params: dict, export_format: TargetExportFormat, dest_path_no_extension: str,
+                        num_partitions: int, compression: Optional[ExportCompression] = None,
+                        cancelled: Optional[threading.Event] = None,
+                        progress: Optional[ExportProgress] = None) -> tuple[str, int]:
+    """Streams num_partitions disjoint slices of the query from solr concurrently, then concatenates them.  Each slice
+    is in the requested sort order, but the concatenated result isn't."""
+    fields = _export_fields(solr_query_params) if export_format != TargetExportFormat.JSONL else None
+    stopped = threading.Event()
+    futures = [
+        partition_executor.submit(
+            _export_partition,
+            _partition_params(solr_query_params, partition, num_partitions),
+            export_format,
+            f"{dest_path_no_extension}-part{partition}",
+            fields=fields,
+            compression=compression,
+            csv_header=partition == 0,
+            cancelled=cancelled,
+            progress=progress,
+            stopped=stopped,
+        )
+        for partition in range(num_partitions)
+    ]
+    concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_EXCEPTION)
+    if any(future.done() and future.exception() is not None for future in futures):
+        _stop_partitions(futures, stopped, dest_path_no_extension, cancelled)
+    results = [future.result() for future in futures]
+    partition_paths = [file_paths[0] for file_paths, _ in results]
+    # e.g. .csv.gz, which splitext would cut short
+    extension = partition_paths[0][len(f"{dest_path_no_extension}-part0"):]
+    dest_path = f"{dest_path_no_extension}{extension}"
+    _concatenate_partitions(export_format, partition_paths, dest_path)
+    return dest_path, sum(num_rows for _, num_rows in results)
+
+
+def _solr_index_version_or_none() -> Optional[str]:
+    try:
+        return isb_solr_query.solr_index_version()
+    except Exception as e:
+        logging.warning(f"Unable to get the solr index version, the export won't be reused: {e}")
+        return None
+
+
+def _export_output_path(export_job: ExportJob) -> str:
+    if not export_job.is_sitemap:
+        return f"/tmp/{export_job.uuid}"
+    transformed_response_path = isb_web.config.Settings().get_sitemap_output_path()
+    logging.info(f"Going to write solr results to {transformed_response_path}")
+    if not os.path.exists(transformed_response_path):
+        logging.info(f"Results directory didn't exist, will create at {transformed_response_path}")
+        os.mkdir(transformed_response_path)
+    return transformed_response_path
+
+
+def _search_solr_and_export_results(export_job_id: str, cancelled: Optional[threading.Event] = None,
+                                    progress: Optional[ExportProgress] = None, worker_id: Optional[str] = None):
+    """Task function that gets a claimed export job from the db, executes the solr query, and writes results to disk"""
     logging.info("going to search solr and export results")
 
     # note that we don't seem to be able to work with the session generator on the background thread, so explicitly
@@ -83,39 +343,45 @@ def _search_solr_and_export_results(export_job_id: str):
         export_job = sqlmodel_database.export_job_with_uuid(session, export_job_id)
         if export_job is not None:
             logging.info("have export job")
-            export_job.tstarted = igsn_lib.time.dtnow()
-            sqlmodel_database.save_or_update_export_job(session, export_job)
+            worker_id = worker_id if worker_id is not None else export_job.worker_id
             start_time = time.time()
-            solr_query_params = export_job.solr_query_params
-            encoded_params = urllib.parse.urlencode(solr_query_params)  # type: ignore
-            export_handler = isb_solr_query.get_solr_url("export")
-            full_url = f"{export_handler}?{encoded_params}"
+            solr_query_params: dict = export_job.solr_query_params  # type: ignore
+            export_format = TargetExportFormat[export_job.export_format]  # type: ignore
+            compression = ExportCompression(export_job.compression) if export_job.compression else None
+            # Recorded before querying so that a commit during the export makes the file stale rather than mislabeling
+            # it as current
+            export_job.solr_index_version = _solr_index_version_or_none()
+            transformed_response_path = _export_output_path(export_job)
+            if progress is not None:
+                progress.dest_path_no_extension = transformed_response_path
+            num_found = _solr_num_found_or_none(solr_query_params)
+            export_job.expected_rows = num_found
+            export_job.rows_written = 0
+            export_job.bytes_written = 0
+            sqlmodel_database.save_or_update_export_job(session, export_job)
+            # Sitemaps are numbered sequentially across their files, so they're always exported as a single partition
+            num_partitions = 1 if export_job.is_sitemap else _num_partitions(num_found, solr_query_params, export_format)
             try:
-                logging.info(f"going to try and open {full_url}")
-                src = urlopen(full_url)
+                if num_partitions == 1:
+                    lines_per_file = -1 if not export_job.is_sitemap else MAX_URLS_IN_SITEMAP
+                    fields = _export_fields(solr_query_params) if export_format in ColumnarExportTransformer.EXTENSIONS else None
+                    file_paths, table_length = _export_partition(solr_query_params, export_format, transformed_response_path, export_job.is_sitemap, lines_per_file, fields, compression, cancelled=cancelled, progress=progress)  # type: ignore
+                    file_path = file_paths[0]
+                else:
+                    logging.info(f"Exporting job {export_job.uuid} as {num_partitions} partitions")
+                    file_path, table_length = _export_partitioned(solr_query_params, export_format, transformed_response_path, num_partitions, compression, cancelled, progress)
+                    file_paths = [file_path]
+            except ExportCancelledException:
+                _handle_cancelled(session, export_job, worker_id, transformed_response_path)
+                return
             except HTTPError as e:
-                _handle_error(session, export_job, f"HTTP Error, code: {e.code} reason: {e.reason}")
+                _handle_error(session, export_job, worker_id, f"HTTP Error, code: {e.code} reason: {e.reason}")
                 return
             except Exception as e:
-                _handle_error(session, export_job, f"Export Error {str(e)}")
+                _handle_error(session, export_job, worker_id, f"Export Error {str(e)}")
                 return
-            docs = ijson.items(src, "response.docs.item", use_float=True)
-            generator_docs = (doc for doc in docs)
-            if export_job.is_sitemap:
-                transformed_response_path = isb_web.config.Settings().get_sitemap_output_path()
-                logging.info(f"Going to write solr results to {transformed_response_path}")
-                if not os.path.exists(transformed_response_path):
-                    logging.info(f"Results directory didn't exist, will create at {transformed_response_path}")
-                    os.mkdir(transformed_response_path)
-            else:
-                transformed_response_path = f"/tmp/{export_job.uuid}"
-            table = petl.fromdicts(generator_docs)
-            lines_per_file = -1 if not export_job.is_sitemap else MAX_URLS_IN_SITEMAP
-            solr_result_transformer = SolrResultTransformer(table, TargetExportFormat[export_job.export_format], transformed_response_path, False, export_job.is_sitemap, lines_per_file)  # type: ignore
-            file_path = solr_result_transformer.transform()[0]
-            export_job.file_path = file_path
+            bytes_written = sum(_file_size_or_zero(path) for path in file_paths)
             print("Finished writing query response!")
-            table_length = petl.util.counting.nrows(table)
             finish_time = time.time()
             logging.info(f"Chunk of {table_length} rows starting at index 0 completed fetching and writing in {finish_time - start_time} seconds")
             if export_job.is_sitemap:
@@ -123,19 +389,24 @@ def _search_solr_and_export_results(export_job_id: str):
                 loop = asyncio.new_event_loop()
                 asyncio.set_event_loop(loop)
                 loop.run_until_complete(_build_sitemap(transformed_response_path, isb_web.config.Settings().sitemap_url_prefix, sitemap_index_iterator))
-            export_job.tcompleted = igsn_lib.time.dtnow()
-            sqlmodel_database.save_or_update_export_job(session, export_job)
+            _finish(session, export_job, worker_id, {"file_path": file_path, "rows_written": table_length, "bytes_written": bytes_written})
 
 
 @export_app.get("/create")
 async def create(request: fastapi.Request, export_format: TargetExportFormat = TargetExportFormat.JSONL,
+                 compression: Optional[ExportCompression] = None,
                  session: Session = Depends(get_session)) -> JSONResponse:
-    """Creates a new export job with the specified solr query"""
+    """Creates a new export job with the specified solr query.  CSV and JSONL exports may be compressed with gzip or
+    zstd as they're written; the columnar formats are always compressed internally."""
 
     if request.query_params.get("sort") is not None:
         raise fastapi.HTTPException(
             status_code=415, detail="Sort field not supported for export"
         )
+    if compression is not None and export_format in ColumnarExportTransformer.EXTENSIONS:
+        raise fastapi.HTTPException(
+            status_code=400, detail=f"{export_format.value} exports are already compressed"
+        )
 
     # supported parameters are: q, fq, start, rows, format (right now format should be either CSV or JSON)
 
@@ -143,7 +414,7 @@ async def create(request: fastapi.Request, export_format: TargetExportFormat = T
     solr_api_defparams = _default_export_params("indexUpdatedTime asc")
     params, properties = isb_solr_query.get_solr_params_from_request_as_dict(request, solr_api_defparams, ["q", "fq", "start", "rows", "fl"])
     analytics.attach_analytics_state_to_request(AnalyticsEvent.THINGS_DOWNLOAD, request, properties)
-    return await _create_export_job(export_format, params, request, session)
+    return await _create_export_job(export_format, params, request, session, compression=compression)
 
 
 def _default_export_params(sort: str) -> dict[str, str]:
@@ -156,19 +427,115 @@ def _default_export_params(sort: str) -> dict[str, str]:
     return solr_api_defparams
 
 
+def export_fingerprint(export_format: TargetExportFormat, params: dict, compression: Optional[ExportCompression]) -> str:
+    """Hash of everything that determines the contents of an export, independent of the parameter order and of the
+    order of the filter queries"""
+    fq = params.get("fq")
+    filter_queries = [] if fq is None else [fq] if isinstance(fq, str) else list(fq)
+    canonical_params = {
+        "q": params.get("q"),
+        "fq": sorted(filter_queries),
+        # The field order is the CSV column order, so it isn't sorted
+        "fl": [field.strip() for field in params.get("fl", "").split(",") if len(field.strip()) > 0],
+        "sort": params.get("sort"),
+        "start": params.get("start"),
+        "rows": params.get("rows"),
+        "format": export_format.value,
+        "compression": compression.value if compression is not None else None,
+    }
+    return hashlib.sha256(json.dumps(canonical_params, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _export_job_state(export_job: ExportJob) -> str:
+    if export_job.tcompleted is not None:
+        return "completed"
+    return "started" if export_job.tstarted is not None else "created"
+
+
+async def _reusable_export_job(session: Session, fingerprint: str) -> Optional[ExportJob]:
+    """An export job with the fingerprint that's still running, or that completed against the current solr index and
+    whose file hasn't expired"""
+    settings = isb_web.config.Settings()
+    now = igsn_lib.time.dtnow()
+    export_job = sqlmodel_database.reusable_export_job_with_fingerprint(
+        session,
+        fingerprint,
+        now - datetime.timedelta(seconds=settings.export_job_timeout_seconds),
+        now - datetime.timedelta(seconds=settings.export_artifact_ttl_seconds),
+    )
+    if export_job is None or export_job.tcompleted is None:
+        return export_job
+    if export_job.file_path is None or not os.path.exists(export_job.file_path):
+        return None
+    try:
+        index_version = await run_in_threadpool(isb_solr_query.current_index_version)
+    except Exception as e:
+        logging.warning(f"Unable to get the solr index version, not reusing export job {export_job.uuid}: {e}")
+        return None
+    return export_job if export_job.solr_index_version == index_version else None
+
+
 async def _create_export_job(export_format: TargetExportFormat, params: dict[str, str], request: fastapi.Request,
-                             session: Session, is_sitemap: bool = False):
+                             session: Session, is_sitemap: bool = False,
+                             compression: Optional[ExportCompression] = None):
+    # Sitemaps are always regenerated
+    fingerprint = None if is_sitemap else export_fingerprint(export_format, params, compression)
+    if fingerprint is not None:
+        existing_export_job = await _reusable_export_job(session, fingerprint)
+        if existing_export_job is not None:
+            logging.info(f"Reusing export job {existing_export_job.uuid} for an identical request")
+            status_dict = {"status": _export_job_state(existing_export_job), "uuid": existing_export_job.uuid, "reused": True}
+            return fastapi.responses.JSONResponse(content=status_dict, status_code=HTTP_200_OK)
     export_job = ExportJob()
+    export_job.fingerprint = fingerprint
     export_job.creator_id = auth.orcid_id_from_session_or_scope(request)
     export_job.solr_query_params = params  # type: ignore
     export_job.export_format = export_format.value
     export_job.is_sitemap = is_sitemap
+    export_job.compression = compression.value if compression is not None else None
+    # Queued for an export worker to claim
     sqlmodel_database.save_or_update_export_job(session, export_job)
-    executor.submit(search_solr_and_export_results, export_job.uuid)  # type: ignore
     status_dict = {"status": "created", "uuid": export_job.uuid}
     return fastapi.responses.JSONResponse(content=status_dict, status_code=HTTP_201_CREATED)
 
 
+def remove_expired_export_files(session: Session) -> int:
+    """Removes the files of exports that completed more than export_artifact_ttl_seconds ago.  Returns the number of
+    files removed."""
+    ttl = datetime.timedelta(seconds=isb_web.config.Settings().export_artifact_ttl_seconds)
+    num_removed = 0
+    for export_job in sqlmodel_database.export_jobs_with_files_completed_before(session, igsn_lib.time.dtnow() - ttl):
+        try:
+            os.remove(export_job.file_path)  # type: ignore
+            num_removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.error(f"Unable to remove expired export file {export_job.file_path}: {e}")
+            continue
+        export_job.file_path = None
+        sqlmodel_database.save_or_update_export_job(session, export_job)
+    return num_removed
+
+
+def _remove_expired_export_files_periodically():
+    interval_seconds = isb_web.config.Settings().export_cleanup_interval_seconds
+    while True:
+        try:
+            with dao.get_session() as session:  # type: ignore
+                num_removed = remove_expired_export_files(session)
+            if num_removed > 0:
+                logging.info(f"Removed {num_removed} expired export files")
+        except Exception:
+            logging.exception("Failed to remove expired export files")
+        time.sleep(interval_seconds)
+
+
+def start_export_cleanup():
+    """Starts removing expired export files every export_cleanup_interval_seconds on a daemon thread"""
+    threading.Thread(target=_remove_expired_export_files_periodically, name="export_cleanup", daemon=True).start()
+
+
 @export_app.get("/create_sitemap")
 async def create_sitemap(request: fastapi.Request, session: Session = Depends(get_session)) -> JSONResponse:
     orcid_id = auth.orcid_id_from_session_or_scope(request)
@@ -183,34 +550,236 @@ def _not_found_response() -> JSONResponse:
     return fastapi.responses.JSONResponse(content={"status": "not_found"}, status_code=HTTP_404_NOT_FOUND)
 
 
+def _export_progress(export_job: ExportJob) -> dict:
+    """The job's progress as of its worker's last heartbeat, with the throughput so far and the estimated time left"""
+    progress: dict = {
+        "expected_rows": export_job.expected_rows,
+        "rows_written": export_job.rows_written,
+        "bytes_written": export_job.bytes_written,
+        "rows_per_second": None,
+        "eta_seconds": None,
+    }
+    if export_job.tstarted is None or export_job.heartbeat is None or not export_job.rows_written:
+        return progress
+    elapsed_seconds = (export_job.heartbeat - export_job.tstarted).total_seconds()
+    if elapsed_seconds <= 0:
+        return progress
+    rows_per_second = export_job.rows_written / elapsed_seconds
+    progress["rows_per_second"] = rows_per_second
+    if export_job.tcompleted is None and export_job.expected_rows is not None:
+        progress["eta_seconds"] = max(0.0, (export_job.expected_rows - export_job.rows_written) / rows_per_second)
+    return progress
+
+
+def _status_content(export_job: ExportJob) -> tuple[dict, int]:
+    """The status of the export job and the http status code to report it with"""
+    # A job can finish before its worker notices that it was cancelled, in which case it's reported as it finished
+    cancelled = export_job.error == sqlmodel_database.EXPORT_JOB_CANCELLED
+    if cancelled or (export_job.tcancelled is not None and export_job.tcompleted is None):
+        if export_job.tcompleted is not None:
+            return {"status": "cancelled", "tcancelled": str(export_job.tcancelled)}, HTTP_200_OK
+        return {"status": "cancelling", "tcancelled": str(export_job.tcancelled)}, HTTP_202_ACCEPTED
+    if export_job.tcompleted is not None:
+        if export_job.error is None:
+            content = {
+                "status": "completed",
+                "tcompleted": str(export_job.tcompleted),
+                "query": json.dumps(export_job.solr_query_params),
+                "progress": _export_progress(export_job),
+            }
+        else:
+            content = {"status": "error", "tcompleted": str(export_job.tcompleted), "reason": export_job.error}
+        return content, HTTP_200_OK
+    elif export_job.tstarted is not None:
+        content = {"status": "started", "tstarted": str(export_job.tstarted), "progress": _export_progress(export_job)}
+        return content, HTTP_202_ACCEPTED
+    else:
+        return {"status": "created"}, HTTP_201_CREATED
+
+
+def _is_finished(status_code: int) -> bool:
+    return status_code == HTTP_200_OK
+
+
+def _current_status_content(export_job_id: str) -> Optional[tuple[dict, int]]:
+    # A session per check, so that long-polls and event streams don't hold on to a database connection while they wait
+    with dao.get_session() as session:  # type: ignore
+        export_job = sqlmodel_database.export_job_with_uuid(session, export_job_id)
+        return _status_content(export_job) if export_job is not None else None
+
+
 @export_app.get("/status")
-def status(uuid: str = fastapi.Query(None), session: Session = Depends(get_session)) -> JSONResponse:
-    """Looks up the status of the export job with the specified uuid"""
+async def status(uuid: str = fastapi.Query(None),
+                 wait: int = fastapi.Query(0, ge=0, description="Seconds to wait for the status to change")) -> JSONResponse:
+    """Looks up the status of the export job with the specified uuid.  With wait, the response is held until the
+    status or progress changes, the job finishes, or the wait (capped at export_status_max_wait_seconds) runs out, so
+    that clients can long-poll rather than poll in a tight loop."""
+    status_content = await run_in_threadpool(_current_status_content, uuid)
+    if status_content is None:
+        return _not_found_response()
+    content, status_code = status_content
+    settings = isb_web.config.Settings()
+    deadline = time.monotonic() + min(wait, settings.export_status_max_wait_seconds)
+    while not _is_finished(status_code) and time.monotonic() < deadline:
+        await asyncio.sleep(min(settings.export_status_check_interval_seconds, max(0.0, deadline - time.monotonic())))
+        current_status_content = await run_in_threadpool(_current_status_content, uuid)
+        if current_status_content is None:
+            return _not_found_response()
+        if current_status_content[0] != content:
+            content, status_code = current_status_content
+            break
+    return fastapi.responses.JSONResponse(content=content, status_code=status_code)
+
+
+async def _status_events(export_job_id: str, status_content: Optional[tuple[dict, int]]):
+    """Starting from the status the endpoint already looked up, yields an event each time it changes"""
+    check_interval_seconds = isb_web.config.Settings().export_status_check_interval_seconds
+    last_content = None
+    while status_content is not None:
+        content, status_code = status_content
+        if content != last_content:
+            yield f"data: {json.dumps(content)}\n\n"
+            last_content = content
+        else:
+            # keeps proxies from timing out the idle connection
+            yield ": keepalive\n\n"
+        if _is_finished(status_code):
+            return
+        await asyncio.sleep(check_interval_seconds)
+        status_content = await run_in_threadpool(_current_status_content, export_job_id)
+
+
+@export_app.get("/status/events")
+async def status_events(uuid: str = fastapi.Query(None)):
+    """Streams the status of the export job with the specified uuid as server-sent events, one each time it changes,
+    until the job finishes"""
+    status_content = await run_in_threadpool(_current_status_content, uuid)
+    if status_content is None:
+        return _not_found_response()
+    headers = {"Cache-Control": "no-cache"}
+    return StreamingResponse(_status_events(uuid, status_content), media_type="text/event-stream", headers=headers)
+
+
+def _accepts_encoding(accept_encoding: Optional[str], coding: str) -> bool:
+    """Whether the Accept-Encoding header value allows the content coding, i.e. lists it or * with a nonzero q"""
+    if accept_encoding is None:
+        return False
+    wildcard_accepted = False
+    for item in accept_encoding.split(","):
+        name, _, parameters = item.partition(";")
+        name = name.strip().lower()
+        quality = 1.0
+        for parameter in parameters.split(";"):
+            key, _, value = parameter.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name == coding:
+            return quality > 0
+        if name == "*":
+            wildcard_accepted = quality > 0
+    return wildcard_accepted
+
+
+def _decompressed_chunks(file_path: str, compression: ExportCompression):
+    with pyarrow.CompressedInputStream(file_path, compression.value) as compressed_file:
+        while chunk := compressed_file.read(DOWNLOAD_CHUNK_SIZE):
+            yield chunk
+
+
+def _file_chunks(file_path: str, first_position: int, last_position: int):
+    with open(file_path, "rb") as file:
+        file.seek(first_position)
+        remaining = last_position - first_position + 1
+        while remaining > 0 and (chunk := file.read(min(DOWNLOAD_CHUNK_SIZE, remaining))):
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _ranged_file_response(
+    request: fastapi.Request, file_path: str, media_type: Optional[str], headers: dict[str, str]
+) -> Response:
+    """Serves the file, or the byte range of it the Range header asks for, so that interrupted downloads can be
+    resumed and large ones fetched in parallel.  The entity tag is derived from the file and the content coding, so
+    a range is only served from the same artifact, in the same coding, as the earlier response it continues."""
+    stat_result = os.stat(file_path)
+    last_modified = datetime.datetime.fromtimestamp(stat_result.st_mtime, datetime.timezone.utc)
+    etag = conditional_requests.strong_etag(
+        file_path, stat_result.st_size, stat_result.st_mtime_ns, headers.get("Content-Encoding")
+    )
+    headers = {**headers, **conditional_requests.validator_headers(etag, last_modified), "Accept-Ranges": "bytes"}
+    if conditional_requests.is_not_modified(request, etag, last_modified):
+        return conditional_requests.not_modified_response(etag, last_modified)
+    range_header = request.headers.get(conditional_requests.RANGE)
+    byte_range = None
+    if range_header is not None and conditional_requests.if_range_matches(request, etag, last_modified):
+        try:
+            byte_range = conditional_requests.byte_range(range_header, stat_result.st_size)
+        except conditional_requests.RangeNotSatisfiableException:
+            headers["Content-Range"] = f"bytes */{stat_result.st_size}"
+            return Response(status_code=HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, headers=headers)
+    if byte_range is None:
+        status_code = HTTP_200_OK if stat_result.st_size > 0 else HTTP_204_NO_CONTENT
+        return FileResponse(
+            file_path, status_code=status_code, media_type=media_type, headers=headers, stat_result=stat_result
+        )
+    first_position, last_position = byte_range
+    headers["Content-Range"] = f"bytes {first_position}-{last_position}/{stat_result.st_size}"
+    headers["Content-Length"] = str(last_position - first_position + 1)
+    return StreamingResponse(
+        _file_chunks(file_path, first_position, last_position),
+        status_code=HTTP_206_PARTIAL_CONTENT,
+        media_type=media_type,
+        headers=headers,
+    )
+
+
+def _compressed_file_response(request: fastapi.Request, file_path: str, compression: ExportCompression) -> Response:
+    """Serves the compressed file as is to clients that accept its encoding, and decompresses it on the fly for the
+    rest.  Either way the download is named and typed as the uncompressed file.  Ranges are only served from the
+    compressed file, since the decompressed length isn't known up front."""
+    uncompressed_name = os.path.basename(file_path)[:-len(compression.extension) - 1]
+    media_type = EXPORT_MEDIA_TYPES.get(os.path.splitext(uncompressed_name)[1]) \
+        or mimetypes.guess_type(uncompressed_name)[0] or "application/octet-stream"
+    headers = {"Vary": "Accept-Encoding", "Content-Disposition": f'attachment; filename="{uncompressed_name}"'}
+    if _accepts_encoding(request.headers.get("accept-encoding"), compression.value):
+        headers["Content-Encoding"] = compression.value
+        return _ranged_file_response(request, file_path, media_type, headers)
+    headers["Accept-Ranges"] = "none"
+    return StreamingResponse(_decompressed_chunks(file_path, compression), media_type=media_type, headers=headers)
+
+
+@export_app.post("/cancel")
+def cancel(request: fastapi.Request, uuid: str = fastapi.Query(None), session: Session = Depends(get_session)) -> JSONResponse:
+    """Cancels the export job with the specified uuid.  Only its creator or a superuser may cancel it."""
     export_job = sqlmodel_database.export_job_with_uuid(session, uuid)
     if export_job is None:
         return _not_found_response()
-    else:
-        if export_job.tcompleted is not None:
-            if export_job.error is None:
-                content = {"status": "completed", "tcompleted": str(export_job.tcompleted), "query": json.dumps(export_job.solr_query_params)}
-            else:
-                content = {"status": "error", "tcompleted": str(export_job.tcompleted), "reason": export_job.error}
-            return fastapi.responses.JSONResponse(content=content, status_code=HTTP_200_OK)
-        elif export_job.tstarted is not None:
-            content = {"status": "started", "tstarted": str(export_job.tstarted)}
-            return fastapi.responses.JSONResponse(content=content, status_code=HTTP_202_ACCEPTED)
-        else:
-            return fastapi.responses.JSONResponse(content={"status": "created"}, status_code=HTTP_201_CREATED)
+    orcid_id = auth.orcid_id_from_session_or_scope(request)
+    if orcid_id != export_job.creator_id and orcid_id not in isb_web.config.Settings().orcid_superusers:
+        raise HTTPException(403, "orcid id not authorized to cancel this export job")
+    if export_job.is_sitemap:
+        # Its files are mixed in with the earlier sitemaps' in the sitemap directory, so they can't be cleaned up
+        raise HTTPException(409, "Sitemap export jobs can't be cancelled")
+    if not sqlmodel_database.cancel_export_job(session, uuid):
+        raise HTTPException(409, "Export job has already completed")
+    return fastapi.responses.JSONResponse(content={"status": "cancelling", "uuid": uuid}, status_code=HTTP_202_ACCEPTED)
 
 
 @export_app.get("/download")
-def download(uuid: str = fastapi.Query(None), session: Session = Depends(get_session)):
+def download(request: fastapi.Request, uuid: str = fastapi.Query(None), session: Session = Depends(get_session)):
     export_job = sqlmodel_database.export_job_with_uuid(session, uuid)
     if export_job is None:
         return _not_found_response()
     else:
         if export_job.file_path is not None and os.path.exists(export_job.file_path):
-            status_code = 200 if os.path.getsize(export_job.file_path) > 0 else 204
-            return FileResponse(export_job.file_path, status_code=status_code)
+            compression = ExportCompression.for_path(export_job.file_path)
+            if compression is not None:
+                return _compressed_file_response(request, export_job.file_path, compression)
+            media_type = EXPORT_MEDIA_TYPES.get(os.path.splitext(export_job.file_path)[1])
+            # Exports created with a compression are served compressed
+            return _ranged_file_response(request, export_job.file_path, media_type, {})
         else:
             return _not_found_response()
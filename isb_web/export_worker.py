@@ -0,0 +1,120 @@
+"""
+Runs queued export jobs outside of the web app.
+
+/export/create only inserts an ExportJob row.  Workers claim queued jobs with SELECT ... FOR UPDATE SKIP LOCKED, so
+any number of them can share the queue without claiming the same job.  While a job runs, its worker heartbeats it
+every poll interval, recording its progress.  A job whose heartbeat goes stale, e.g. because its worker was killed, is
+claimed again by another worker.  The heartbeat also delivers cancellation: it fails once the job is cancelled, and
+the job stops at its next record.  A job that stopped because another worker reclaimed it is left to that worker: every
+update completing a job is conditional on the worker still owning it.
+"""
+import concurrent.futures
+import datetime
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Optional
+
+import igsn_lib.time
+from sqlmodel import Session
+
+import isb_web.config
+from isb_web import export, sqlmodel_database
+from isb_web.sqlmodel_database import SQLModelDAO
+
+_L = logging.getLogger("export_worker")
+
+
+class ExportWorker:
+    def __init__(self, dao: SQLModelDAO, concurrency: int, poll_interval_seconds: float,
+                 heartbeat_timeout_seconds: float, max_attempts: int, worker_id: Optional[str] = None):
+        self.dao = dao
+        self.concurrency = max(1, concurrency)
+        self.poll_interval_seconds = poll_interval_seconds
+        self.heartbeat_timeout_seconds = heartbeat_timeout_seconds
+        self.max_attempts = max_attempts
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._stopped = threading.Event()
+        # job uuid -> (the future running it, the event that cancels it, its progress)
+        self._running: dict[str, tuple[concurrent.futures.Future, threading.Event, export.ExportProgress]] = {}
+
+    @staticmethod
+    def from_settings(dao: SQLModelDAO, concurrency: Optional[int] = None) -> "ExportWorker":
+        settings = isb_web.config.Settings()
+        return ExportWorker(
+            dao,
+            concurrency if concurrency is not None else settings.export_worker_concurrency,
+            settings.export_worker_poll_interval_seconds,
+            settings.export_job_heartbeat_timeout_seconds,
+            settings.export_job_max_attempts,
+        )
+
+    def _reap(self):
+        for job_uuid, (future, _, _) in list(self._running.items()):
+            if future.done():
+                del self._running[job_uuid]
+
+    def _heartbeat(self, session: Session):
+        for job_uuid, (_, cancelled, progress) in self._running.items():
+            if cancelled.is_set():
+                continue
+            if not sqlmodel_database.heartbeat_export_job(
+                session, job_uuid, self.worker_id, progress.rows_written, progress.bytes_written()
+            ):
+                _L.info("Stopping export job %s, it was cancelled or claimed by another worker", job_uuid)
+                cancelled.set()
+
+    def _claim(self, session: Session, executor: concurrent.futures.Executor):
+        orphaned_before = igsn_lib.time.dtnow() - datetime.timedelta(seconds=self.heartbeat_timeout_seconds)
+        while len(self._running) < self.concurrency:
+            export_job = sqlmodel_database.claim_next_export_job(
+                session, self.worker_id, orphaned_before, self.max_attempts
+            )
+            if export_job is None:
+                return
+            job_uuid = str(export_job.uuid)
+            _L.info("Claimed export job %s, attempt %d", job_uuid, export_job.attempts)
+            cancelled = threading.Event()
+            progress = export.ExportProgress()
+            future = executor.submit(
+                export.search_solr_and_export_results, job_uuid, cancelled, progress, self.worker_id
+            )
+            self._running[job_uuid] = (future, cancelled, progress)
+
+    def poll(self, session: Session, executor: concurrent.futures.Executor, claim: bool = True):
+        """Forgets finished jobs, heartbeats the running ones, and claims queued jobs up to the concurrency"""
+        self._reap()
+        self._heartbeat(session)
+        if claim:
+            self._claim(session, executor)
+
+    def run(self):
+        """Runs jobs until stop() is called, then keeps heartbeating the running ones until they finish"""
+        _L.info("Export worker %s running up to %d jobs at a time", self.worker_id, self.concurrency)
+        with concurrent.futures.ThreadPoolExecutor(self.concurrency, thread_name_prefix="export_job") as executor:
+            while True:
+                stopping = self._stopped.is_set()
+                try:
+                    with self.dao.get_session() as session:
+                        self.poll(session, executor, claim=not stopping)
+                except Exception:
+                    _L.exception("Failed to poll the export job queue")
+                if stopping and len(self._running) == 0:
+                    break
+                if stopping:
+                    time.sleep(self.poll_interval_seconds)
+                else:
+                    self._stopped.wait(self.poll_interval_seconds)
+        _L.info("Export worker %s stopped", self.worker_id)
+
+    def start_in_background(self) -> threading.Thread:
+        thread = threading.Thread(target=self.run, name="export_worker", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        """Stops claiming jobs.  run() returns once the running ones finish."""
+        self._stopped.set()
@@ -1,21 +1,26 @@
+import json
+import time
 import typing
 from typing import Optional, Tuple, Mapping, Any
 
-import requests
 import geojson
 import fastapi
 import logging
 import urllib.parse
 
+import requests
 from requests import Response
 
-from isb_web import config
+from isb_lib.utilities import caches
+from isb_web import config, request_metrics
 
 BASE_URL = "http://localhost:8985/solr/isb_core_records/"
 _RPT_FIELD = "producedBy_samplingSite_location_rpt"
 LONGITUDE_FIELD = "producedBy_samplingSite_location_longitude"
 LATITUDE_FIELD = "producedBy_samplingSite_location_latitude"
 MEDIA_JSON = "application/json"
+# Shared by the solr requests so that connections are reused and the request durations are recorded
+_solr_session = request_metrics.instrumented_session()
 
 DEFAULT_COLLECTION_NAME = "isb_core_records"
 
@@ -86,8 +91,10 @@ def clip_float(v, min_v, max_v):
     return v
 
 
-def get_solr_url(path_component: str):
-    return urllib.parse.urljoin(config.Settings().solr_url, path_component)
+def get_solr_url(path_component: str, solr_url: Optional[str] = None):
+    if solr_url is None:
+        solr_url = config.Settings().solr_url
+    return urllib.parse.urljoin(solr_url, path_component)
 
 
 def set_default_params(params, defs, dict: bool = False):
@@ -211,7 +218,7 @@ def _get_heatmap(
         params["facet.heatmap.gridLevel"] = grid_level
     # Get the solr heatmap for the provided bounds
     url = get_solr_url("select")
-    response = requests.get(url, headers=headers, params=params)
+    response = _solr_session.get(url, headers=headers, params=params)
 
     # logging.debug("Got: %s", response.url)
     res = response.json()
@@ -400,7 +407,7 @@ def solr_leaflet_heatmap(q, bb, fq=None, grid_level=None):
     }
 
 
-def solr_query(params, query=None, handler: str = "select", wrap_response: bool = True):
+def solr_query(params, query=None, handler: str = "select", wrap_response: bool = True, buffered: bool = False):
     """
     Issue a request against the solr select endpoint.
 
@@ -409,12 +416,30 @@ def solr_query(params, query=None, handler: str = "select", wrap_response: bool
 
     Args:
         params: list of list, see https://solr.apache.org/guide/8_9/common-query-parameters.html
+        buffered: Read the whole solr response, and return it with solr's status code, rather than streaming it
 
     Returns:
         Iterator for the solr response.
     """
     url = get_solr_url(handler)
     headers = {"Accept": MEDIA_JSON}
+    content_type = _select_content_type(params)
+    if query is None:
+        response = _solr_session.get(url, headers=headers, params=params, stream=not buffered)
+    else:
+        response = _solr_session.post(
+            url, headers=headers, params=params, json=query, stream=not buffered
+        )
+    if buffered:
+        return fastapi.responses.Response(
+            content=response.content, status_code=response.status_code, media_type=content_type
+        )
+    return fastapi.responses.StreamingResponse(
+        response.iter_content(chunk_size=2048), media_type=content_type
+    )
+
+
+def _select_content_type(params) -> str:
     content_type = MEDIA_JSON
     wt_map = {
         "csv": "text/plain",
@@ -427,18 +452,82 @@ def solr_query(params, query=None, handler: str = "select", wrap_response: bool
         for k, v in params:
             if k == "wt":
                 content_type = wt_map.get(v.lower(), "json")
+    return content_type
 
-    if query is None:
-        response = requests.get(url, headers=headers, params=params, stream=True)
-    else:
-        response = requests.post(
-            url, headers=headers, params=params, json=query, stream=True
-        )
-    return fastapi.responses.StreamingResponse(
-        response.iter_content(chunk_size=2048), media_type=content_type
+
+class SolrSelectResponse(typing.NamedTuple):
+    content: bytes
+    status_code: int
+    media_type: str
+
+
+_select_cache = caches.TTLCache(
+    config.Settings().solr_select_cache_size, config.Settings().solr_select_cache_ttl_seconds
+)
+_select_single_flight = caches.SingleFlight()
+
+
+def is_cacheable_select(params: list) -> bool:
+    """Whether the select response is small and stable enough to be shared: not a cursor or streaming query"""
+    rows = 10
+    for k, v in params:
+        if k in ("cursorMark", "stream"):
+            return False
+        if k == "rows":
+            try:
+                rows = int(v)
+            except (TypeError, ValueError):
+                return False
+    return rows <= config.Settings().solr_select_cache_max_rows
+
+
+def canonical_select_params(params: list) -> str:
+    """Serializes the select params independent of their order, so that equivalent queries share a cache entry"""
+    pairs = sorted((str(k), json.dumps(v, sort_keys=True)) for k, v in params)
+    return json.dumps(pairs)
+
+
+def _fetch_select(params: list, key: tuple) -> SolrSelectResponse:
+    response = solr_query(params, buffered=True)
+    select_response = SolrSelectResponse(response.body, response.status_code, response.media_type)
+    if response.status_code == 200:
+        _select_cache.put(key, select_response)
+    return select_response
+
+
+def cached_solr_query(params: list) -> fastapi.responses.Response:
+    """
+    Issue a request against the solr select endpoint through solr_query, sharing the response with identical queries.
+
+    Concurrent identical queries are coalesced into a single solr request, and successful responses are reused until
+    the index version changes or solr_select_cache_ttl_seconds elapses.  If the index version can't be fetched, the
+    query is sent uncached.  Only use this for queries where is_cacheable_select is True, since the full response is
+    held in memory.  Blocks, so call from a worker thread.
+    """
+    try:
+        index_version = current_index_version()
+    except (requests.RequestException, KeyError, ValueError) as e:
+        logging.warning("Unable to fetch the solr index version, not caching the select: %s", e)
+        return solr_query(params)
+    key = (canonical_select_params(params), index_version)
+    select_response = _select_cache.get(key)
+    if select_response is None:
+        select_response = _select_single_flight.do(key, lambda: _fetch_select(params, key))
+    return fastapi.responses.Response(
+        content=select_response.content,
+        status_code=select_response.status_code,
+        media_type=select_response.media_type,
     )
 
 
+def select_cache_counts() -> dict[str, int]:
+    return {
+        "hits": _select_cache.hits,
+        "misses": _select_cache.misses,
+        "coalesced": _select_single_flight.coalesced,
+    }
+
+
 def reliquery_solr_query(query: str) -> dict:
     """
     Returns the solr response from making the reliquery query
@@ -455,7 +544,7 @@ def reliquery_solr_query(query: str) -> dict:
         "wt": "json",
         "fl": "id"
     }
-    response = requests.get(url, headers=headers, params=params)
+    response = _solr_session.get(url, headers=headers, params=params)
     return response.json()
 
 
@@ -480,7 +569,7 @@ def solr_get_record(identifier):
     }
     url = get_solr_url("select")
     headers = {"Accept": MEDIA_JSON}
-    response = requests.get(url, headers=headers, params=params)
+    response = _solr_session.get(url, headers=headers, params=params)
     if response.status_code != 200:
         return response.status_code, None
     docs = response.json()
@@ -587,7 +676,7 @@ def solr_searchStream(params: list[list[str]], collection: str = DEFAULT_COLLECT
     # Post the request to solr
     # The response is an open stream that is read in chunks to
     # be passed on to the client as they are received
-    response = requests.post(
+    response = _solr_session.post(
         url, headers=headers, params=qparams, data=request, stream=True
     )
     logging.info("Returning response")
@@ -605,14 +694,14 @@ def solr_luke():
     url = get_solr_url("admin/luke")
     params = {"show": "schema", "wt": "json"}
     headers = {"Accept": MEDIA_JSON}
-    response = requests.get(url, headers=headers, params=params, stream=True)
+    response = _solr_session.get(url, headers=headers, params=params, stream=True)
     return fastapi.responses.StreamingResponse(
         response.iter_content(chunk_size=2048), media_type=MEDIA_JSON
     )
 
 
 def _fetch_solr_records(
-    rsession=requests.session(),
+    rsession=_solr_session,
     authority_id: typing.Optional[str] = None,
     start_index: int = 0,
     batch_size: int = 50000,
@@ -649,7 +738,7 @@ def _fetch_solr_records(
 
 
 def solr_records_for_sitemap(
-    rsession=requests.session(),
+    rsession=_solr_session,
     authority_id: typing.Optional[str] = None,
     start_index: int = 0,
     batch_size: int = 50000,
@@ -691,7 +780,7 @@ def solr_records_for_stac_collection(
         A tuple of the dictionaries of solr documents with id and lat/lon fields, and whether there are more records
     """
     return _fetch_solr_records(
-        requests.session(),
+        _solr_session,
         authority_id,
         start_index,
         batch_size,
@@ -702,22 +791,24 @@ def solr_records_for_stac_collection(
 
 
 def solr_records_forh3_counts(
-    query: str, field_name: str, max_rows: int = -1
+    query: str, field_name: str, max_rows: int = -1, solr_url: Optional[str] = None
 ) -> dict:
-    url = get_solr_url("stream")
+    url = get_solr_url("stream", solr_url)
     headers = {"Accept": MEDIA_JSON}
     dlm = ",\n"
+    # The query is embedded in a quoted streaming expression parameter, so any quotes in it need escaping
+    escaped_query = query.replace('"', '\\"')
     facet = (f'facet({DEFAULT_COLLECTION_NAME}{dlm}'
-             f'q="{query}"{dlm}'
+             f'q="{escaped_query}"{dlm}'
              f'buckets="{field_name}"{dlm}count(*),rows={max_rows})')
-    response = requests.post(
+    response = _solr_session.post(
         url, headers=headers, data={"expr": facet}, stream=True
     )
     logging.info("Returning response")
     return response.json()
 
 
-def solr_last_mod_date_for_ids(ids: list[str], rsession=requests.session()) -> dict[str, str]:
+def solr_last_mod_date_for_ids(ids: list[str], rsession=_solr_session) -> dict[str, str]:
     """Returns a dictionary of id to index last mod date for the passed in ids"""
     url = get_solr_url("select")
     headers = {"Content-Type": MEDIA_JSON}
@@ -737,28 +828,162 @@ def solr_last_mod_date_for_ids(ids: list[str], rsession=requests.session()) -> d
     return id_to_last_mod_date
 
 
-def solr_counts_by_authority(rsession=requests.session()) -> dict[str, int]:
-    url = get_solr_url("select")
+def solr_facet_counts(field: str, rsession=_solr_session, solr_url: Optional[str] = None) -> dict[str, int]:
+    """Returns a dictionary of value to record count for all the values of the specified field"""
+    url = get_solr_url("select", solr_url)
     headers = {"Content-Type": MEDIA_JSON}
     params = {
         "q": "*:*",
+        "rows": 0,
         "facet": "true",
-        "facet.field": "source",
-        "facet.mincount": 1
+        "facet.field": field,
+        "facet.mincount": 1,
+        "facet.limit": -1,
     }
     res = rsession.get(url, headers=headers, params=params)
     json = res.json()
-    facet_source_counts = json["facet_counts"]["facet_fields"]["source"]
+    facet_field_counts = json["facet_counts"]["facet_fields"][field]
     # The counts are a single array, with the string value followed by the count as the next item in the array, e.g.
     # "SESAR",100,"OPENCONTEXT",245…etc, so turn them into a nice dict instead.
     facet_counts_dict = {}
-    for index, value in enumerate(facet_source_counts):
+    for index, value in enumerate(facet_field_counts):
         if index % 2 != 0:
             continue
-        facet_counts_dict[value] = facet_source_counts[index + 1]
+        facet_counts_dict[value] = facet_field_counts[index + 1]
     return facet_counts_dict
 
 
+def solr_num_found(params: dict, rsession=_solr_session) -> int:
+    """Returns the number of records matching the q and fq in the params"""
+    url = get_solr_url("select")
+    headers = {"Accept": MEDIA_JSON}
+    count_params = {key: params[key] for key in ["q", "fq"] if key in params}
+    count_params["rows"] = 0
+    count_params["wt"] = "json"
+    res = rsession.get(url, headers=headers, params=count_params)
+    return res.json()["response"]["numFound"]
+
+
+def solr_counts_by_authority(rsession=_solr_session) -> dict[str, int]:
+    return solr_facet_counts("source", rsession)
+
+
+def solr_index_version(rsession=_solr_session, solr_url: Optional[str] = None) -> str:
+    """Returns the version of the solr index, which changes whenever a commit modifies the index"""
+    url = get_solr_url("admin/luke", solr_url)
+    params = {"show": "index", "numTerms": 0, "wt": "json"}
+    headers = {"Accept": MEDIA_JSON}
+    res = rsession.get(url, headers=headers, params=params)
+    return str(res.json()["index"]["version"])
+
+
+# (index version, time it was fetched)
+_index_version_cache: Optional[Tuple[str, float]] = None
+
+
+def current_index_version() -> str:
+    """The solr index version, refetched at most every solr_index_version_ttl_seconds for use in cache keys"""
+    global _index_version_cache
+    now = time.monotonic()
+    if _index_version_cache is None or now - _index_version_cache[1] > config.Settings().solr_index_version_ttl_seconds:
+        _index_version_cache = (solr_index_version(), now)
+    return _index_version_cache[0]
+
+
+def bounding_box_filter_query(min_lon: float, min_lat: float, max_lon: float, max_lat: float) -> str:
+    return f"producedBy_samplingSite_location_ll:[{min_lat},{min_lon} TO {max_lat},{max_lon}]"
+
+
+def solr_points_in_bounding_box(
+    query: str,
+    bounding_box: Tuple[float, float, float, float],
+    fields: list[str],
+    max_rows: int,
+    rsession=_solr_session,
+) -> list[dict]:
+    """Returns up to max_rows solr documents matching the query that have a location inside the bounding box
+
+    Args:
+        query: The solr query to filter with
+        bounding_box: The min_lon, min_lat, max_lon, max_lat of the area
+        fields: The solr fields to return
+        max_rows: The maximum number of documents to return
+        rsession: The requests.session object to use for sending the solr request
+    """
+    url = get_solr_url("select")
+    headers = {"Content-Type": MEDIA_JSON}
+    params = {
+        "q": query,
+        "fq": bounding_box_filter_query(*bounding_box),
+        "fl": ",".join(fields),
+        "rows": max_rows,
+    }
+    res = rsession.get(url, headers=headers, params=params)
+    return res.json()["response"]["docs"]
+
+
+def solr_cursor_pages(
+    params: list,
+    cursor_mark: str = "*",
+    rows: int = 1000,
+    max_rows: Optional[int] = None,
+    rsession=_solr_session,
+) -> typing.Iterator[Tuple[list[dict], str]]:
+    """Pages through the select results with a solr cursorMark rather than start, which keeps the cost of each page
+    constant however deep it is.  See https://solr.apache.org/guide/8_11/pagination-of-results.html
+
+    Args:
+        params: list of [k, v] select parameters.  Any sort or start is replaced, since cursors require a sort on the
+        unique key and no offset.
+        cursor_mark: The cursor to start from, "*" for the beginning of the results
+        rows: Number of documents to fetch per request
+        max_rows: Stop after this many documents, at which point the last cursor can be used to resume
+        rsession: The requests.session object to use for sending the solr request
+
+    Returns:
+        Iterator of (docs, next cursor mark) tuples.  The results are exhausted when the next cursor mark equals the one
+        the page was requested with.
+    """
+    base_params = [[k, v] for k, v in params if k not in ("sort", "start", "rows", "cursorMark", "wt")]
+    base_params.extend([["sort", "id asc"], ["wt", "json"]])
+    url = get_solr_url("select")
+    headers = {"Accept": MEDIA_JSON}
+    num_rows = 0
+    while True:
+        page_rows = rows if max_rows is None else min(rows, max_rows - num_rows)
+        if page_rows <= 0:
+            return
+        page_params = base_params + [["rows", page_rows], ["cursorMark", cursor_mark]]
+        res = rsession.get(url, headers=headers, params=page_params)
+        res.raise_for_status()
+        response_dict = res.json()
+        docs = response_dict["response"]["docs"]
+        next_cursor_mark = response_dict["nextCursorMark"]
+        num_rows += len(docs)
+        yield docs, next_cursor_mark
+        if next_cursor_mark == cursor_mark:
+            return
+        cursor_mark = next_cursor_mark
+
+
+def solr_cursor_ndjson(
+    params: list,
+    cursor_mark: str = "*",
+    rows: int = 1000,
+    max_rows: Optional[int] = None,
+    rsession=_solr_session,
+) -> typing.Iterator[str]:
+    """Streams the solr_cursor_pages documents as newline delimited JSON.  The final line is
+    {"nextCursorMark": <cursor>, "done": <bool>}, so a client that was cut off or hit max_rows can resume from it."""
+    done = False
+    for docs, next_cursor_mark in solr_cursor_pages(params, cursor_mark, rows, max_rows, rsession):
+        for doc in docs:
+            yield json.dumps(doc) + "\n"
+        done = next_cursor_mark == cursor_mark
+        cursor_mark = next_cursor_mark
+    yield json.dumps({"nextCursorMark": cursor_mark, "done": done}) + "\n"
+
+
 class ISBCoreSolrRecordIterator:
     """
     Iterator class for looping over all the Solr records in the ISB core Solr schema
@@ -766,7 +991,7 @@ class ISBCoreSolrRecordIterator:
 
     def __init__(
         self,
-        rsession=requests.session(),
+        rsession=_solr_session,
         query: Optional[str] = None,
         batch_size: int = 50000,
         offset: int = 0,
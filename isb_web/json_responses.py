@@ -0,0 +1,33 @@
+"""
+Faster JSON rendering for API responses.  FastAPI's default JSONResponse runs everything through jsonable_encoder and
+the stdlib json module, which dominates the response time for large payloads like h3 grids and heatmaps.  Returning a
+FastJSONResponse directly from an endpoint skips jsonable_encoder entirely, and orjson only falls back to it for
+objects it can't serialize natively (e.g. SQLModel instances).
+"""
+import typing
+
+import fastapi.encoders
+import fastapi.responses
+import orjson
+
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def _default(value: typing.Any) -> typing.Any:
+    return fastapi.encoders.jsonable_encoder(value)
+
+
+def dumps(content: typing.Any) -> bytes:
+    return orjson.dumps(content, default=_default, option=_ORJSON_OPTIONS)
+
+
+def ndjson_line(content: typing.Any) -> bytes:
+    """Serializes the content as a single line of newline delimited JSON"""
+    return orjson.dumps(content, default=_default, option=_ORJSON_OPTIONS | orjson.OPT_APPEND_NEWLINE)
+
+
+class FastJSONResponse(fastapi.responses.JSONResponse):
+    """Drop in replacement for JSONResponse that renders with orjson"""
+
+    def render(self, content: typing.Any) -> bytes:
+        return dumps(content)
@@ -1,3 +1,5 @@
+import base64
+import binascii
 import os
 import datetime
 from json import JSONDecodeError
@@ -16,17 +18,19 @@ import fastapi.responses
 import accept_types
 import json
 from fastapi.params import Query, Depends
+from fastapi.concurrency import run_in_threadpool
 from sqlmodel import Session
-import geojson
 
 import isb_web
-import isamples_metadata.GEOMETransformer
-from isb_lib.core import MEDIA_GEO_JSON, MEDIA_JSON, MEDIA_NQUADS, SOLR_TIME_FORMAT, initialize_vocabularies
+from isb_lib import core_content
+from isb_lib.core import MEDIA_GEO_JSON, MEDIA_JSON, MEDIA_NQUADS, MEDIA_NDJSON, SOLR_TIME_FORMAT, \
+    initialize_vocabularies, vocabularies_initialized
 from isb_lib.localcontexts.localcontexts_client import local_contexts_info_for_resolved_content
 from isb_lib.models.thing import Thing
 from isb_lib.utilities import h3_utilities
 from isb_lib.utilities.url_utilities import full_url_from_suffix
-from isb_web import sqlmodel_database, analytics, manage, debug, metrics, vocabulary, export, auth
+from isb_web import sqlmodel_database, analytics, manage, debug, metrics, vocabulary, export, auth, tiles, \
+    export_worker
 from isb_web.analytics import AnalyticsEvent
 from isb_web import schemas
 from isb_web import crud
@@ -34,13 +38,14 @@ from isb_web import config
 from isb_web import isb_enums
 from isb_web import isb_solr_query
 from isb_web import profiles
-from isamples_metadata.SESARTransformer import SESARTransformer
-from isamples_metadata.OpenContextTransformer import OpenContextTransformer
-from isamples_metadata.SmithsonianTransformer import SmithsonianTransformer
+from isb_web import conditional_requests
+from isb_web import startup
+from isb_web import request_metrics
 
 import logging
 
-from isb_web.api_types import ThingsSitemapParams, ReliqueryResponse, ReliqueryParams
+from isb_web.json_responses import FastJSONResponse, ndjson_line
+from isb_web.api_types import ThingsSitemapParams, ThingsStreamParams, ReliqueryResponse, ReliqueryParams
 from isb_web.schemas import ThingPage
 from isb_web.sqlmodel_database import SQLModelDAO, taxonomy_name_to_kingdom_map
 import isb_lib.stac
@@ -85,11 +90,11 @@ tags_metadata = [
 
 THING_URL_PATH = config.Settings().thing_url_path
 STAC_ITEM_URL_PATH = config.Settings().stac_item_url_path
+# Distinguishes the thing page's ETag from the ETags of the thing's JSON representations
+THING_PAGE_REPRESENTATION = "thingpage"
 STAC_COLLECTION_URL_PATH = config.Settings().stac_collection_url_path
 
-TAXONOMY_NAME_TO_KINGDOM_MAP = {}
-
-app = fastapi.FastAPI(openapi_tags=tags_metadata)
+app = fastapi.FastAPI(openapi_tags=tags_metadata, default_response_class=FastJSONResponse)
 dao = SQLModelDAO(None)
 manage_app = manage.manage_api
 debug_app = debug.debug_api
@@ -99,6 +104,7 @@ manage.dao = dao
 metrics.dao = dao
 vocabulary.dao = dao
 export.dao = dao
+tiles.dao = dao
 
 app.add_middleware(
     fastapi.middleware.cors.CORSMiddleware,
@@ -111,6 +117,8 @@ app.add_middleware(
 app.add_middleware(
     analytics.AnalyticsMiddleware
 )
+# Added last so that it's the outermost middleware and times the whole request
+app.add_middleware(request_metrics.MetricsMiddleware)
 app.mount(
     "/static",
     fastapi.staticfiles.StaticFiles(directory=os.path.join(THIS_PATH, "static")),
@@ -136,20 +144,34 @@ app.mount(
 app.mount(manage.MANAGE_PREFIX, manage_app)
 app.mount(debug.DEBUG_PREFIX, debug_app)
 app.include_router(metrics.router)
-app.include_router(vocabulary.router)
+app.include_router(vocabulary.router, default_response_class=FastJSONResponse)
+app.include_router(tiles.router)
 app.mount(export.EXPORT_PREFIX, export.export_app)
 
 
+def _load_vocabularies():
+    if not vocabularies_initialized():
+        with dao.get_session() as session:
+            initialize_vocabularies(session)
+
+
+def _load_taxonomy_name_to_kingdom_map() -> dict:
+    if not config.Settings().taxon_cache_enabled:
+        return {}
+    with dao.get_session() as session:
+        return taxonomy_name_to_kingdom_map(session)
+
+
+VOCABULARIES = startup.register("vocabularies", _load_vocabularies)
+TAXONOMY_NAME_TO_KINGDOM_MAP = startup.register("taxonomy_name_to_kingdom_map", _load_taxonomy_name_to_kingdom_map)
+
+
 @app.on_event("startup")
 def on_startup():
     dao.connect_sqlmodel(isb_web.config.Settings().database_url)
+    request_metrics.instrument_engine(dao.engine)
     session = dao.get_session()
     orcid_ids = sqlmodel_database.all_orcid_ids(session)
-    initialize_vocabularies(session)
-    # Force this into memory so it's cached when we need it later
-    global TAXONOMY_NAME_TO_KINGDOM_MAP
-    if config.Settings().taxon_cache_enabled:
-        TAXONOMY_NAME_TO_KINGDOM_MAP = taxonomy_name_to_kingdom_map(session)
     session.close()
     # Superusers are allowed to mint identifiers as well, so make sure they're in the list.
     orcid_ids.extend(isb_web.config.Settings().orcid_superusers)
@@ -157,6 +179,20 @@ def on_startup():
     # User the connected db session to push in to the auth module's orcid_ids state.
     auth.allowed_orcid_ids = orcid_ids
     term_store.create_database(dao.engine)
+    # Load the vocabularies and taxonomy after accepting traffic rather than before, anything that needs them first
+    # waits for them.
+    startup.warm_up_in_background()
+    metrics.refresher.start()
+    export.start_export_cleanup()
+    in_process_export_concurrency = isb_web.config.Settings().export_in_process_worker_concurrency
+    if in_process_export_concurrency > 0:
+        export_worker.ExportWorker.from_settings(dao, in_process_export_concurrency).start_in_background()
+
+
+@app.get("/ready", tags=["metrics"], summary="Readiness probe, 503 until the startup warm-up completes")
+def ready():
+    readiness = startup.readiness()
+    return FastJSONResponse(content=readiness, status_code=200 if readiness["ready"] else 503)
 
 
 def get_session():
@@ -200,6 +236,9 @@ async def login():
 
 @app.get("/thingpage/{identifier:path}", include_in_schema=False)
 async def get_thing_page(request: fastapi.Request, identifier: str, session: Session = Depends(get_session)):
+    not_modified = _thing_not_modified_response(request, identifier, THING_PAGE_REPRESENTATION, session)
+    if not_modified is not None:
+        return not_modified
     # Retrieve record from the database
     item = sqlmodel_database.get_thing_with_id(session, identifier)
     if item is None:
@@ -234,7 +273,8 @@ async def get_thing_page(request: fastapi.Request, identifier: str, session: Ses
             "localcontexts_info": local_contexts_info_for_resolved_content(content),
             "original_link": original_link,
             "original_authority": item.authority_id
-        }
+        },
+        headers=_thing_validator_headers(identifier, THING_PAGE_REPRESENTATION, item.tstamp, item.authority_id)
     )
 
 
@@ -250,6 +290,23 @@ async def thing_list_metadata(
     return meta
 
 
+def _encode_thing_list_cursor(after_primary_key: int, status: int, authority: Optional[str]) -> str:
+    cursor = json.dumps({"after": after_primary_key, "status": status, "authority": authority})
+    return base64.urlsafe_b64encode(cursor.encode("utf-8")).decode("ascii")
+
+
+def _decode_thing_list_cursor(cursor: str, status: int, authority: Optional[str]) -> int:
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        after_primary_key = int(decoded["after"])
+    except (ValueError, TypeError, KeyError, binascii.Error):
+        raise fastapi.HTTPException(status_code=400, detail="Invalid cursor")
+    # Cursors are only valid for the filter they were issued for
+    if decoded.get("status") != status or decoded.get("authority") != authority:
+        raise fastapi.HTTPException(status_code=400, detail="Cursor does not match the status and authority parameters")
+    return after_primary_key
+
+
 @app.get(f"/{THING_URL_PATH}/", response_model=ThingPage, summary="Query lists of things", tags=["things"])
 def thing_list(
     request: fastapi.Request,
@@ -257,10 +314,19 @@ def thing_list(
     limit: int = fastapi.Query(1000, lt=10000, gt=0),
     status: int = 200,
     authority: str = fastapi.Query(None),
+    cursor: Optional[str] = fastapi.Query(
+        None, description="next_cursor from the previous page.  Faster than offset for deep pages."
+    ),
+    exact_count: bool = fastapi.Query(
+        False, description="Count total_records exactly rather than from the periodically refreshed counts"
+    ),
     session: Session = Depends(get_session),
 ):
+    after_primary_key = None
+    if cursor is not None:
+        after_primary_key = _decode_thing_list_cursor(cursor, status, authority)
     total_records, npages, things = sqlmodel_database.read_things_summary(
-        session, offset, limit, status, authority
+        session, offset, limit, status, authority, after_primary_key, exact_count
     )
     properties = {
         "authority": authority or "None"
@@ -271,12 +337,17 @@ def thing_list(
         "offset": offset,
         "status": status,
         "authority": authority,
+        "cursor": cursor,
     }
+    next_cursor = None
+    if len(things) == limit:
+        next_cursor = _encode_thing_list_cursor(things[-1].primary_key, status, authority)
     return {
         "params": params,
         "last_page": npages,
         "total_records": total_records,
         "data": things,
+        "next_cursor": next_cursor,
     }
 
 
@@ -304,6 +375,8 @@ async def _get_solr_select(request: fastapi.Request):
     logging.warning(params)
     analytics.attach_analytics_state_to_request(AnalyticsEvent.THING_SOLR_SELECT, request, properties)
 
+    if isb_solr_query.is_cacheable_select(params):
+        return await run_in_threadpool(isb_solr_query.cached_solr_query, params)
     # response object is generated in the called method. This is necessary
     # for the streaming response as otherwise the iterator is consumed
     # before returning here, hence defeating the purpose of the streaming
@@ -347,6 +420,28 @@ async def get_solr_select(request: fastapi.Request):
     return await _get_solr_select(request)
 
 
+@app.get(f"/{THING_URL_PATH}/cursor_stream", response_model=typing.Any, tags=["solr"],
+         summary="Stream all the things matching a query as newline delimited JSON, resumable at any depth")
+def get_solr_cursor_stream(
+    request: fastapi.Request,
+    cursor: str = fastapi.Query("*", description="nextCursorMark from the last line of a previous response"),
+    rows: int = fastapi.Query(1000, gt=0, le=10000, description="Number of records to fetch from solr at a time"),
+    max_rows: Optional[int] = fastapi.Query(None, gt=0, description="Stop after this many records"),
+):
+    """Streams the records matching q, fq, and fl in id order, one JSON document per line.
+
+    The final line is {"nextCursorMark": ..., "done": ...}.  If done is false, pass nextCursorMark as the cursor
+    parameter to continue where the response left off.
+    """
+    params, properties = isb_solr_query.get_solr_params_from_request(
+        request, {"q": "*:*", "fl": "id"}, ["q", "fq", "fl"]
+    )
+    analytics.attach_analytics_state_to_request(AnalyticsEvent.THING_SOLR_STREAM, request, properties)
+    return fastapi.responses.StreamingResponse(
+        isb_solr_query.solr_cursor_ndjson(params, cursor, rows, max_rows), media_type=MEDIA_NDJSON
+    )
+
+
 @app.post(f"/{THING_URL_PATH}/reliquery", response_model=ReliqueryResponse, tags=["solr"])
 def get_reliquery(request: fastapi.Request, params: ReliqueryParams) -> ReliqueryResponse:
     timestamp_str = datetime.datetime.now().strftime(SOLR_TIME_FORMAT)
@@ -475,13 +570,17 @@ def get_h3_grid(
         exclude_poles: bool = exclude_poles_q,
         bb: typing.Optional[str] = bb_q,
         q: str = None,
-) -> geojson.FeatureCollection:
+        session: Session = Depends(get_session),
+) -> FastJSONResponse:
     solr_query_params = h3_utilities.get_h3_solr_query_from_bb(bb, resolution, q)
     record_counts = h3_utilities.get_record_counts(
-        query=solr_query_params.q, resolution=solr_query_params.resolution, exclude_poles=exclude_poles
+        query=solr_query_params.q,
+        resolution=solr_query_params.resolution,
+        exclude_poles=exclude_poles,
+        session=session,
     )
-    return h3_utilities.h3s_to_feature_collection(
-        set(record_counts.keys()), cell_props=record_counts
+    return FastJSONResponse(
+        content=h3_utilities.h3s_to_feature_collection(set(record_counts.keys()), cell_props=record_counts)
     )
 
 
@@ -505,7 +604,30 @@ async def get_things_for_sitemap(
     #         content.append(thing)
     #     else:
     #         logging.error(f"No thing with identifier {identifier}")
-    return content
+    return FastJSONResponse(content=content)
+
+
+@app.post("/things/stream", response_model=typing.Any, tags=["things"])
+def stream_things_for_sitemap(
+    params: ThingsStreamParams,
+    session: Session = Depends(get_session),
+):
+    """Streams the things with the requested identifiers as newline delimited JSON, one thing per line.
+
+    Unlike POST /things this doesn't hold all the things in memory, so it's suitable for large identifier lists.
+    Args:
+        params: Class that contains the identifier list and optional list of thing fields to return, JSON-encoded in
+        the request body
+        session: The database session to use to fetch things
+    """
+    if params.fields is not None:
+        unknown_fields = set(params.fields) - set(sqlmodel_database.THING_STREAM_FIELDS)
+        if len(unknown_fields) > 0:
+            raise fastapi.HTTPException(status_code=400, detail=f"Unknown thing fields: {sorted(unknown_fields)}")
+    rows = sqlmodel_database.iterate_things_with_ids(session, params.identifiers, params.fields)
+    return fastapi.responses.StreamingResponse(
+        (ndjson_line(row) for row in rows), media_type=MEDIA_NDJSON
+    )
 
 
 def all_profiles_json_response(request_url: str):
@@ -513,7 +635,7 @@ def all_profiles_json_response(request_url: str):
     if query_string_index != -1:
         request_url = request_url[0:query_string_index]
     headers = profiles.get_all_profiles_response_headers(request_url)
-    return fastapi.responses.JSONResponse(
+    return FastJSONResponse(
         content={}, media_type=MEDIA_JSON, headers=headers
     )
 
@@ -524,7 +646,7 @@ def solr_thing_response(identifier: str):
     # and appropriate error condition
     status, doc = isb_solr_query.solr_get_record(identifier)
     if status == 200:
-        return fastapi.responses.JSONResponse(
+        return FastJSONResponse(
             content=doc, media_type="application/json"
         )
     raise fastapi.HTTPException(
@@ -538,6 +660,7 @@ def solr_thing_response(identifier: str):
 async def get_thing(
     request: fastapi.Request,
     identifier: str,
+    response: fastapi.Response,
     format: typing.Optional[isb_enums.ISBFormat] = None,
     _profile: Optional[str] = None,
     session: Session = Depends(get_session),
@@ -557,33 +680,93 @@ async def get_thing(
     if request_profile is None:
         # didn't find in qsa, check headers
         request_profile = profiles.get_profile_from_http(request)
-
+    representation, request_profile = _thing_representation(format, request_profile)
+    not_modified = _thing_not_modified_response(request, identifier, representation, session, request_profile)
+    if not_modified is not None:
+        return not_modified
     # Retrieve record from the database
     item = sqlmodel_database.get_thing_with_id(session, identifier)
     if item is None:
         raise fastapi.HTTPException(
             status_code=404, detail=f"Thing not found: {identifier}"
         )
+    headers = _thing_validator_headers(identifier, representation, item.tstamp, item.authority_id, request_profile)
     if format == isb_enums.ISBFormat.FULL:
+        response.headers.update(headers)
         return item
-    if (request_profile is not None and request_profile == profiles.ISAMPLES_PROFILE) or \
-            format == isb_enums.ISBFormat.CORE:
-        if request_profile is None:
-            request_profile = profiles.ISAMPLES_PROFILE
+    if representation == isb_enums.ISBFormat.CORE.value:
         content = await thing_resolved_content(identifier, item, session)
     else:
-        # If no profile explicitly requested, use the default profile here (currently original source)
-        if request_profile is None:
-            request_profile = profiles.DEFAULT_PROFILE
         content = item.resolved_content
-    headers = {}
     if request_profile is not None:
         headers.update(profiles.content_profile_headers(request_profile))
-    return fastapi.responses.JSONResponse(
+    return FastJSONResponse(
         content=content, media_type=MEDIA_JSON, headers=headers
     )
 
 
+def _thing_representation(
+    format: typing.Optional[isb_enums.ISBFormat], request_profile: Optional[profiles.Profile]
+) -> typing.Tuple[str, Optional[profiles.Profile]]:
+    """Returns the representation of the thing to return, and the profile it conforms to"""
+    if format == isb_enums.ISBFormat.FULL:
+        return isb_enums.ISBFormat.FULL.value, request_profile
+    if (request_profile is not None and request_profile == profiles.ISAMPLES_PROFILE) or \
+            format == isb_enums.ISBFormat.CORE:
+        return isb_enums.ISBFormat.CORE.value, request_profile or profiles.ISAMPLES_PROFILE
+    # If no profile explicitly requested, use the default profile here (currently original source)
+    return isb_enums.ISBFormat.ORIGINAL.value, request_profile or profiles.DEFAULT_PROFILE
+
+
+def _thing_etag(
+    identifier: str,
+    representation: str,
+    tstamp: datetime.datetime,
+    authority_id: Optional[str],
+    profile: Optional[profiles.Profile] = None,
+) -> str:
+    # Core representations also change when the transformer does.  The profile is part of the response headers, so
+    # representations conforming to different profiles don't share a validator.
+    return conditional_requests.strong_etag(
+        identifier,
+        representation,
+        profile.uri if profile is not None else None,
+        tstamp.isoformat(),
+        core_content.transformer_version(authority_id),
+    )
+
+
+def _thing_validator_headers(
+    identifier: str,
+    representation: str,
+    tstamp: datetime.datetime,
+    authority_id: Optional[str],
+    profile: Optional[profiles.Profile] = None,
+) -> dict[str, str]:
+    etag = _thing_etag(identifier, representation, tstamp, authority_id, profile)
+    return conditional_requests.validator_headers(etag, tstamp)
+
+
+def _thing_not_modified_response(
+    request: fastapi.Request,
+    identifier: str,
+    representation: str,
+    session: Session,
+    profile: Optional[profiles.Profile] = None,
+) -> Optional[fastapi.responses.Response]:
+    """Returns a 304 response if the client's copy of the thing is current, checked without loading its content"""
+    if not conditional_requests.has_validators(request):
+        return None
+    tstamp_and_authority = sqlmodel_database.get_thing_tstamp_and_authority(session, identifier)
+    if tstamp_and_authority is None:
+        return None
+    tstamp, authority_id = tstamp_and_authority
+    etag = _thing_etag(identifier, representation, tstamp, authority_id, profile)
+    if conditional_requests.is_not_modified(request, etag, tstamp):
+        return conditional_requests.not_modified_response(etag, tstamp)
+    return None
+
+
 @app.get("/resolve/{identifier:path}", response_model=typing.Any, tags=["things"])
 async def resolve_thing(
     request: fastapi.Request,
@@ -604,29 +787,12 @@ async def resolve_thing(
 
 
 async def thing_resolved_content(identifier: str, item: Thing, session: Session) -> dict:
-    authority_id = item.authority_id
-    if item.is_transformed():
-        # It's already been transformed
-        content = item.resolved_content
-    else:
-        if authority_id == "SESAR":
-            content = SESARTransformer(item.resolved_content).transform(False)
-        elif authority_id == "GEOME":
-            content = (
-                isamples_metadata.GEOMETransformer.geome_transformer_for_identifier(
-                    identifier, item.resolved_content, session, TAXONOMY_NAME_TO_KINGDOM_MAP
-                ).transform(False)
-            )
-        elif authority_id == "OPENCONTEXT":
-            content = OpenContextTransformer(item.resolved_content).transform(False)
-        elif authority_id == "SMITHSONIAN":
-            content = SmithsonianTransformer(item.resolved_content).transform(False)
-        else:
-            raise fastapi.HTTPException(
-                status_code=400,
-                detail=f"Core format not available for authority_id: {authority_id}",
-            )
-    return content
+    await run_in_threadpool(VOCABULARIES.ensure)
+    taxonomy_map = await run_in_threadpool(TAXONOMY_NAME_TO_KINGDOM_MAP.ensure)
+    try:
+        return core_content.core_content(identifier, item, session, taxonomy_map)
+    except core_content.CoreContentUnavailable as e:
+        raise fastapi.HTTPException(status_code=400, detail=str(e))
 
 
 @app.get(f"/{STAC_ITEM_URL_PATH}/{{identifier:path}}", response_model=typing.Any, tags=["stac"])
@@ -642,14 +808,26 @@ async def get_stac_item(
     # stac wants things to have filenames, so let these requests work, too.
     if identifier.endswith(".json"):
         identifier = identifier.removesuffix(".json")
+    if conditional_requests.has_validators(request):
+        # Only fetch the index time to see whether the client's copy is current
+        index_updated_time = isb_solr_query.solr_last_mod_date_for_ids([identifier]).get(identifier)
+        if index_updated_time is not None:
+            etag, last_modified = _stac_item_validators(identifier, index_updated_time)
+            if conditional_requests.is_not_modified(request, etag, last_modified):
+                return conditional_requests.not_modified_response(etag, last_modified)
     status, doc = isb_solr_query.solr_get_record(identifier)
     if status == 200:
         stac_item = isb_lib.stac.stac_item_from_solr_dict(
             doc, "http://isamples.org/stac/", "http://isamples.org/thing/"
         )
         if stac_item is not None:
-            return fastapi.responses.JSONResponse(
-                content=stac_item, media_type=MEDIA_GEO_JSON
+            headers = {}
+            if "indexUpdatedTime" in doc:
+                headers = conditional_requests.validator_headers(
+                    *_stac_item_validators(identifier, doc["indexUpdatedTime"])
+                )
+            return FastJSONResponse(
+                content=stac_item, media_type=MEDIA_GEO_JSON, headers=headers
             )
         else:
             # We don't have location data to make a stac item, return a 404
@@ -661,6 +839,13 @@ async def get_stac_item(
     )
 
 
+def _stac_item_validators(identifier: str, index_updated_time: str) -> typing.Tuple[str, datetime.datetime]:
+    return (
+        conditional_requests.strong_etag(identifier, "stac", index_updated_time),
+        datetime.datetime.fromisoformat(index_updated_time),
+    )
+
+
 @app.get(f"/{STAC_COLLECTION_URL_PATH}/{{filename:path}}", response_model=typing.Any, tags=["stac"])
 def get_stac_collection(
     request: fastapi.Request,
@@ -676,7 +861,7 @@ def get_stac_collection(
 
     solr_docs, has_next = isb_solr_query.solr_records_for_stac_collection(authority, offset, limit)
     stac_collection = isb_lib.stac.stac_collection_from_solr_dicts(solr_docs, has_next, offset, limit, authority)
-    return fastapi.responses.JSONResponse(
+    return FastJSONResponse(
         content=stac_collection, media_type=MEDIA_JSON
     )
 
@@ -727,7 +912,7 @@ async def get_things_geojson_heatmap(
     results = isb_solr_query.solr_geojson_heatmap(
         query, bounds, fq=fq, grid_level=None, show_bounds=False, show_solr_bounds=False
     )
-    return fastapi.responses.JSONResponse(content=results, media_type=MEDIA_GEO_JSON)
+    return FastJSONResponse(content=results, media_type=MEDIA_GEO_JSON)
 
 
 @app.get(
@@ -774,7 +959,7 @@ async def get_things_leaflet_heatmap(
         isb_solr_query.MAX_LON: max_lon,
     }
     results = isb_solr_query.solr_leaflet_heatmap(query, bounds, fq=fq, grid_level=None)
-    return fastapi.responses.JSONResponse(content=results, media_type=MEDIA_JSON)
+    return FastJSONResponse(content=results, media_type=MEDIA_JSON)
 
 
 @app.get(
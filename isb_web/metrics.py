@@ -1,12 +1,13 @@
 import logging
+import threading
 import time
 from typing import Optional
 
-from fastapi import APIRouter, Depends
-from sqlmodel import Session
+from fastapi import APIRouter
 from starlette.responses import PlainTextResponse
 
-from isb_web.isb_solr_query import solr_counts_by_authority
+from isb_web import analytics, config, request_metrics
+from isb_web.isb_solr_query import select_cache_counts, solr_counts_by_authority
 from isb_web.sqlmodel_database import SQLModelDAO, things_by_authority_count_dict
 
 router = APIRouter(prefix="/metrics")
@@ -15,16 +16,17 @@ logging.basicConfig(level=logging.DEBUG)
 _L = logging.getLogger("metrics")
 
 
-def get_session():
-    with dao.get_session() as session:
-        yield session
-
-
 class PrometheusMetrics:
     db_counts: dict[str, int]
     db_scrape_duration_seconds: float
     solr_counts: dict[str, int]
     solr_scrape_duration_seconds: float
+    # Hit, miss, and coalesced request counts of the /thing/select cache
+    select_cache_counts: Optional[dict[str, int]] = None
+    # How long the last background refresh of the counts took, how long ago it finished, and how many failed
+    refresh_duration_seconds: Optional[float] = None
+    staleness_seconds: Optional[float] = None
+    refresh_failures: Optional[int] = None
 
     @staticmethod
     def _add_metrics_lines(metrics_lines: list[str], counts: dict[str, int], metric_noun: str, duration: float):
@@ -42,33 +44,135 @@ class PrometheusMetrics:
         metrics_lines.append(f"# TYPE {duration_field_name} gauge")
         metrics_lines.append(f"{duration_field_name} {duration}")
 
+    @staticmethod
+    def _add_gauge_lines(metrics_lines: list[str], field_name: str, description: str, value):
+        metrics_lines.append(f"# HELP {field_name} {description}")
+        metrics_lines.append(f"# TYPE {field_name} gauge")
+        metrics_lines.append(f"{field_name} {value}")
+
     def metrics_string(self) -> str:
         metrics_lines: list[str] = []
         """Returns the metrics in the prometheus format"""
         self._add_metrics_lines(metrics_lines, self.db_counts, "thing", self.db_scrape_duration_seconds)
         metrics_lines.append("\n")
         self._add_metrics_lines(metrics_lines, self.solr_counts, "solr", self.solr_scrape_duration_seconds)
+        if self.refresh_duration_seconds is not None:
+            metrics_lines.append("\n")
+            self._add_gauge_lines(
+                metrics_lines,
+                "isamples_metrics_refresh_duration_seconds",
+                "How long the last refresh of the thing and solr counts took.",
+                self.refresh_duration_seconds,
+            )
+            self._add_gauge_lines(
+                metrics_lines,
+                "isamples_metrics_staleness_seconds",
+                "How long ago the thing and solr counts were refreshed.",
+                self.staleness_seconds,
+            )
+            metrics_lines.append("# HELP isamples_metrics_refresh_failures_total Number of failed count refreshes.")
+            metrics_lines.append("# TYPE isamples_metrics_refresh_failures_total counter")
+            metrics_lines.append(f"isamples_metrics_refresh_failures_total {self.refresh_failures}")
+        if self.select_cache_counts is not None:
+            metrics_lines.append("\n")
+            for key, value in self.select_cache_counts.items():
+                counter_field_name = f"isamples_solr_select_cache_{key}_total"
+                metrics_lines.append(f"# HELP {counter_field_name} Number of /thing/select requests that were cache {key}.")
+                metrics_lines.append(f"# TYPE {counter_field_name} counter")
+                metrics_lines.append(f"{counter_field_name} {value}")
         return "\n".join(metrics_lines)
 
 
-def _root(session: Session):
-    db_start_time = time.time()
-    metrics = PrometheusMetrics()
-    metrics.db_counts = things_by_authority_count_dict(session)
-    db_end_time = time.time()
-    metrics.db_scrape_duration_seconds = db_end_time - db_start_time
-    metrics.solr_counts = solr_counts_by_authority()
-    metrics.solr_scrape_duration_seconds = time.time() - db_end_time
-    return PlainTextResponse(metrics.metrics_string())
+class MetricsRefresher:
+    """
+    Recomputes the thing and solr counts every metrics_refresh_interval_seconds on a daemon thread, so that a scrape
+    only reads the last values instead of querying postgres and solr.  Until the first refresh succeeds the counts are
+    empty, and the staleness gauge counts from when the refresher was created.
+    """
+
+    def __init__(self, interval_seconds: float):
+        self.interval_seconds = interval_seconds
+        self.db_counts: Optional[dict[str, int]] = None
+        self.db_scrape_duration_seconds = 0.0
+        self.solr_counts: Optional[dict[str, int]] = None
+        self.solr_scrape_duration_seconds = 0.0
+        self.refresh_duration_seconds = 0.0
+        self.refresh_failures = 0
+        self.last_refresh_time: Optional[float] = None
+        self._created_time = time.time()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def refresh(self):
+        with self._lock:
+            db_start_time = time.time()
+            with dao.get_session() as session:
+                db_counts = things_by_authority_count_dict(session)
+            db_end_time = time.time()
+            solr_counts = solr_counts_by_authority()
+            end_time = time.time()
+            self.db_counts = db_counts
+            self.db_scrape_duration_seconds = db_end_time - db_start_time
+            self.solr_counts = solr_counts
+            self.solr_scrape_duration_seconds = end_time - db_end_time
+            self.refresh_duration_seconds = end_time - db_start_time
+            self.last_refresh_time = end_time
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                self.refresh_failures += 1
+                _L.exception("Failed to refresh metrics, serving the previous values")
+            self._stopped.wait(self.interval_seconds)
+
+    def start(self):
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="metrics_refresher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread = None
+
+    def current_metrics(self) -> PrometheusMetrics:
+        """The last refreshed values.  Never queries postgres or solr, so scrapes keep working while they're down."""
+        metrics = PrometheusMetrics()
+        metrics.db_counts = self.db_counts or {}
+        metrics.db_scrape_duration_seconds = self.db_scrape_duration_seconds
+        metrics.solr_counts = self.solr_counts or {}
+        metrics.solr_scrape_duration_seconds = self.solr_scrape_duration_seconds
+        metrics.refresh_duration_seconds = self.refresh_duration_seconds
+        metrics.staleness_seconds = time.time() - (self.last_refresh_time or self._created_time)
+        metrics.refresh_failures = self.refresh_failures
+        metrics.select_cache_counts = select_cache_counts()
+        return metrics
+
+
+refresher = MetricsRefresher(config.Settings().metrics_refresh_interval_seconds)
+
+
+def _root():
+    metrics_lines = [refresher.current_metrics().metrics_string(), "\n"]
+    metrics_lines.extend(request_metrics.metrics_lines())
+    for key, value in analytics.ANALYTICS_COUNTS.items():
+        counter_field_name = f"isamples_analytics_events_{key}_total"
+        metrics_lines.append(f"# HELP {counter_field_name} Number of analytics events {key}.")
+        metrics_lines.append(f"# TYPE {counter_field_name} counter")
+        metrics_lines.append(f"{counter_field_name} {value}")
+    return PlainTextResponse("\n".join(metrics_lines))
 
 
 # Note that prometheus seemed unhappy with /metrics/ vs. /metrics.  Include both since they should both work.
 @router.get("", summary="Internal iSamples Metrics for Prometheus exporter", tags=["metrics"])
-def root(session: Session = Depends(get_session)):
-    return _root(session)
+def root():
+    return _root()
 
 
 # Note that prometheus seemed unhappy with /metrics/ vs. /metrics.  Include both since they should both work.
 @router.get("/", summary="Internal iSamples Metrics for Prometheus exporter", tags=["metrics"])
-def root_with_slash(session: Session = Depends(get_session)):
-    return _root(session)
+def root_with_slash():
+    return _root()
@@ -0,0 +1,176 @@
+"""
+Request latency, response size, and upstream (solr and database) call duration metrics, exported in the prometheus
+text format by /metrics.
+
+MetricsMiddleware is a pure ASGI middleware rather than a BaseHTTPMiddleware, so it doesn't buffer streaming responses
+and adds no extra task per request.  Requests are labeled with the route template (e.g. /thing/{identifier:path})
+rather than the raw path to keep the number of series bounded.
+"""
+import threading
+import time
+import urllib.parse
+from typing import Optional
+
+import requests
+import sqlalchemy.event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+SIZE_BUCKETS = [100.0, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8]
+UNMATCHED_ROUTE = "unmatched"
+_QUERY_START_KEY = "isb_query_start"
+
+
+class Histogram:
+    """A prometheus histogram with labels.  Thread-safe, since observations come from both the event loop and the
+    threadpool that sync endpoints run in."""
+
+    def __init__(self, name: str, description: str, label_names: list[str], buckets: list[float]):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = buckets
+        # label values -> (cumulative bucket counts, sum, count)
+        self._series: dict[tuple, tuple[list[int], float, int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        with self._lock:
+            bucket_counts, total, count = self._series.get(label_values, ([0] * len(self.buckets), 0.0, 0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    bucket_counts[index] += 1
+            self._series[label_values] = (bucket_counts, total + value, count + 1)
+
+    def _labels(self, label_values: tuple, extra: str = "") -> str:
+        labels = [f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, label_values)]
+        if extra:
+            labels.append(extra)
+        return "{" + ",".join(labels) + "}"
+
+    def lines(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = dict(self._series)
+        for label_values, (bucket_counts, total, count) in sorted(series.items()):
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                bucket_labels = self._labels(label_values, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {bucket_count}")
+            inf_labels = self._labels(label_values, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf_labels} {count}")
+            lines.append(f"{self.name}_sum{self._labels(label_values)} {total}")
+            lines.append(f"{self.name}_count{self._labels(label_values)} {count}")
+        return lines
+
+
+def _escape(label_value: str) -> str:
+    return str(label_value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+REQUEST_DURATION = Histogram(
+    "isamples_http_request_duration_seconds",
+    "Time from receiving a request to sending the last byte of the response.",
+    ["method", "route", "status"],
+    LATENCY_BUCKETS,
+)
+RESPONSE_SIZE = Histogram(
+    "isamples_http_response_size_bytes",
+    "Size of the response body.",
+    ["method", "route"],
+    SIZE_BUCKETS,
+)
+UPSTREAM_DURATION = Histogram(
+    "isamples_upstream_call_duration_seconds",
+    "Duration of solr requests (until the response headers arrive) and database statements.",
+    ["backend", "operation"],
+    LATENCY_BUCKETS,
+)
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+
+
+def _add_in_flight(delta: int):
+    global _in_flight
+    with _in_flight_lock:
+        _in_flight += delta
+
+
+def route_template(scope: dict) -> str:
+    # The router records the matched route in the scope.  Mounted apps prefix their routes with the mount's root_path.
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    if path is None:
+        return UNMATCHED_ROUTE
+    return scope.get("root_path", "") + path
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+        response_size = 0
+
+        async def send_wrapper(message):
+            nonlocal status, response_size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                response_size += len(message.get("body", b""))
+            await send(message)
+
+        _add_in_flight(1)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _add_in_flight(-1)
+            route = route_template(scope)
+            REQUEST_DURATION.observe(time.perf_counter() - start, scope["method"], route, str(status))
+            RESPONSE_SIZE.observe(response_size, scope["method"], route)
+
+
+def observe_solr_response(response: requests.Response, *args, **kwargs):
+    """requests response hook recording the time until the solr response headers arrived"""
+    operation = urllib.parse.urlparse(response.url).path.rstrip("/").rsplit("/", 1)[-1]
+    UPSTREAM_DURATION.observe(response.elapsed.total_seconds(), "solr", operation)
+
+
+def instrumented_session() -> requests.Session:
+    session = requests.session()
+    session.hooks["response"].append(observe_solr_response)
+    return session
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info[_QUERY_START_KEY] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.pop(_QUERY_START_KEY, None)
+    if start is None:
+        return
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "UNKNOWN"
+    UPSTREAM_DURATION.observe(time.perf_counter() - start, "db", operation)
+
+
+def instrument_engine(engine: Optional[Engine]):
+    """Records the duration of every statement executed by the engine"""
+    if engine is not None and not sqlalchemy.event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        sqlalchemy.event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        sqlalchemy.event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def metrics_lines() -> list[str]:
+    lines = [
+        "# HELP isamples_http_requests_in_flight Number of requests currently being handled.",
+        "# TYPE isamples_http_requests_in_flight gauge",
+        f"isamples_http_requests_in_flight {_in_flight}",
+    ]
+    for histogram in [REQUEST_DURATION, RESPONSE_SIZE, UPSTREAM_DURATION]:
+        lines.extend(histogram.lines())
+    return lines
@@ -34,6 +34,8 @@ class ThingPage(SQLModel):
     last_page: int
     params: dict
     data: typing.List[ThingListEntry]
+    # Opaque token to pass as the cursor parameter to fetch the following page, None on the last page
+    next_cursor: typing.Optional[str] = None
 
 
 class ThingType(pydantic.BaseModel):
@@ -10,22 +10,40 @@ from typing import Optional, List
 
 from isb_lib.identifiers.noidy.n2tminter import N2TMinter
 from isb_lib.models.export_job import ExportJob
+from isb_lib.models.h3_count import H3Count
+from isb_lib.models.thing_core_content import ThingCoreContent
 from isb_lib.models.namespace import Namespace
-from sqlalchemy import Index, update, func
+from sqlalchemy import Index, update, func, delete
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.exc import ProgrammingError
 from sqlmodel import SQLModel, create_engine, Session, select
 from sqlmodel.sql.expression import SelectOfScalar
 
 import isb_lib
+from isb_lib.utilities import caches
 from isb_lib.models.person import Person
 from isb_lib.models.taxonomy_name import TaxonomyName
 from isb_lib.models.thing import Thing, ThingIdentifier, Point
+from isb_web import config
 from isb_web.schemas import ThingPage
 
 
 DRAFT_RESOLVED_URL = "DRAFT"
 DRAFT_AUTHORITY_ID = "DRAFT"
 DRAFT_RESOLVED_STATUS = -1
+# Expression index over Thing.identifiers, see SQLModelDAO.create_thing_identifiers_index
+THING_IDENTIFIERS_INDEX_NAME = "thing_identifiers_gin_idx"
+_THING_IDENTIFIERS_INDEX_DEFINITION = "ON thing USING GIN ((identifiers::jsonb) jsonb_path_ops)"
+# Built along with the thing table, so that new databases have it from the start.  Existing databases get it from
+# scripts/migrations/index_thing_identifiers.py, which builds it without blocking writes.
+THING_IDENTIFIERS_INDEX_DDL = sqlalchemy.DDL(
+    f"CREATE INDEX IF NOT EXISTS {THING_IDENTIFIERS_INDEX_NAME} {_THING_IDENTIFIERS_INDEX_DEFINITION}"
+).execute_if(dialect="postgresql")
+# The error recorded on cancelled export jobs
+EXPORT_JOB_CANCELLED = "Cancelled"
+
+
+sqlalchemy.event.listen(Thing.__table__, "after_create", THING_IDENTIFIERS_INDEX_DDL)  # type: ignore
 
 
 class DatabaseBulkUpdater:
@@ -154,6 +172,43 @@ class SQLModelDAO:
     def get_session(self) -> Session:
         return Session(self.engine)
 
+    def create_thing_identifiers_index(self):
+        """Creates the GIN index used to look up things by any of their identifiers, if it doesn't exist.
+
+        The index is built concurrently so that it doesn't block writes, which means it can't run in a transaction.
+        """
+        if self.engine.dialect.name != "postgresql":
+            return
+        with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.execute(
+                sqlalchemy.text(
+                    f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {THING_IDENTIFIERS_INDEX_NAME} "
+                    f"{_THING_IDENTIFIERS_INDEX_DEFINITION}"
+                )
+            )
+
+
+# (database engine, status, authority) -> count of things.  There are only a handful of status and authority
+# combinations, so this doesn't need to be large.
+_thing_count_cache = caches.TTLCache(100, config.Settings().thing_count_cache_ttl_seconds)
+
+
+def _thing_summary_count(session: Session, status: int, authority: Optional[str], exact_count: bool) -> int:
+    """The number of things with the status and authority.  Unless exact_count is True the count is reused for
+    thing_count_cache_ttl_seconds, since it scans every matching thing."""
+    cache_key = (session.get_bind(), status, authority)
+    if not exact_count:
+        count = _thing_count_cache.get(cache_key)
+        if count is not None:
+            return count
+    count_statement = session.query(Thing)
+    if authority is not None:
+        count_statement = count_statement.filter(Thing.authority_id == authority)
+    count_statement = count_statement.filter(Thing.resolved_status == status)
+    count = count_statement.count()
+    _thing_count_cache.put(cache_key, count)
+    return count
+
 
 def read_things_summary(
     session: Session,
@@ -161,13 +216,16 @@ def read_things_summary(
     limit: int = 100,
     status: int = 200,
     authority: Optional[str] = None,
+    after_primary_key: Optional[int] = None,
+    exact_count: bool = True,
 ) -> tuple[int, int, List[ThingPage]]:
-    # Fetch summary records of Things (but not the full content), suitable for paging in an API
-    count_statement = session.query(Thing)
-    if authority is not None:
-        count_statement = count_statement.filter(Thing.authority_id == authority)
-    count_statement = count_statement.filter(Thing.resolved_status == status)
-    overall_count = count_statement.count()
+    """Fetch summary records of Things (but not the full content), suitable for paging in an API
+
+    Pages are ordered by primary key.  Pass the primary key of the last record of the previous page as
+    after_primary_key rather than an offset to page without the cost of skipping over the preceding records.  If
+    exact_count is False the total may be up to thing_count_cache_ttl_seconds old.
+    """
+    overall_count = _thing_summary_count(session, status, authority, exact_count)
     if limit > 0:
         overall_pages = overall_count / limit
     else:
@@ -184,6 +242,9 @@ def read_things_summary(
     if authority is not None:
         things_statement = things_statement.filter(Thing.authority_id == authority)
     things_statement = things_statement.filter(Thing.resolved_status == status)
+    if after_primary_key is not None:
+        things_statement = things_statement.filter(Thing.primary_key > after_primary_key)
+    things_statement = things_statement.order_by(Thing.primary_key.asc())
     if offset > 0:
         things_statement = things_statement.offset(offset)
     if limit > 0:
@@ -192,6 +253,17 @@ def read_things_summary(
     return overall_count, overall_pages, things_results.all()
 
 
+def _thing_identifiers_contain(session: Session, identifier: str):
+    """Clause matching the things that have identifier in their identifiers list.
+
+    On postgresql this is a JSONB containment query served by the THING_IDENTIFIERS_INDEX_NAME expression index, on
+    other databases it falls back to matching the JSON encoded identifier in the text column.
+    """
+    if session.get_bind().dialect.name == "postgresql":
+        return sqlalchemy.cast(Thing.identifiers, JSONB).contains([identifier])
+    return Thing.identifiers.like(f"%{json.dumps(identifier)}%")
+
+
 def get_thing_with_id(session: Session, identifier: str) -> Optional[Thing]:
     statement = (
         select(Thing).filter(Thing.id == identifier).order_by(Thing.primary_key.asc())
@@ -199,13 +271,29 @@ def get_thing_with_id(session: Session, identifier: str) -> Optional[Thing]:
     result = session.exec(statement).first()
     if result is None:
         # Fall back to querying the Identifiers table
-        identifiers_statement = select(Thing).where(
-            Thing.identifiers.like(f"%{identifier}%")
-        )
+        identifiers_statement = select(Thing).where(_thing_identifiers_contain(session, identifier))
         result = session.exec(identifiers_statement).first()
     return result
 
 
+def get_thing_tstamp_and_authority(
+    session: Session, identifier: str
+) -> Optional[typing.Tuple[datetime.datetime, Optional[str]]]:
+    """Looks up the thing like get_thing_with_id, but only loads the columns needed to validate a cached copy"""
+    statement = (
+        select(Thing.tstamp, Thing.authority_id).filter(Thing.id == identifier).order_by(Thing.primary_key.asc())
+    )
+    result = session.exec(statement).first()
+    if result is None:
+        identifiers_statement = select(Thing.tstamp, Thing.authority_id).where(
+            _thing_identifiers_contain(session, identifier)
+        )
+        result = session.exec(identifiers_statement).first()
+    if result is None:
+        return None
+    return result[0], result[1]
+
+
 def random_things_with_authority(session: Session, authority: str, count: int) -> list[Thing]:
     statement = select(Thing).where(Thing.authority_id == authority).limit(count).order_by(func.random())
     return session.exec(statement).all()
@@ -217,6 +305,43 @@ def get_things_with_ids(session: Session, identifiers: list[str]) -> list[Thing]
     return things
 
 
+THING_STREAM_FIELDS = [
+    "primary_key",
+    "id",
+    "tstamp",
+    "tcreated",
+    "item_type",
+    "authority_id",
+    "resolved_url",
+    "resolved_status",
+    "tresolved",
+    "resolve_elapsed",
+    "resolved_content",
+    "resolved_media_type",
+    "identifiers",
+    "h3",
+]
+
+
+def iterate_things_with_ids(
+    session: Session, identifiers: list[str], fields: Optional[list[str]] = None, chunk_size: int = 1000
+) -> typing.Iterator[dict]:
+    """Yields a dictionary of the requested fields for each thing with one of the identifiers.
+
+    Identifiers are queried chunk_size at a time, and the rows are read from a server-side cursor, so only a chunk of
+    things is ever held in memory.
+    """
+    if fields is None:
+        fields = THING_STREAM_FIELDS
+    columns = [getattr(Thing, field) for field in fields]
+    for chunk_start in range(0, len(identifiers), chunk_size):
+        chunk = identifiers[chunk_start:chunk_start + chunk_size]
+        # Use the SQLAlchemy select so that single field projections still come back as rows rather than scalars
+        statement = sqlalchemy.select(*columns).where(Thing.id.in_(chunk)).execution_options(yield_per=chunk_size)
+        for row in session.exec(statement):
+            yield dict(zip(fields, row))
+
+
 def get_thing_identifiers_for_thing(session: Session, thing_id: int) -> list[str]:
     statement = select(Thing.identifiers).where(Thing.primary_key == thing_id)
     session_exec = session.exec(statement)
@@ -466,9 +591,11 @@ def all_thing_identifier_objects(
     return thing_identifiers
 
 
-def things_with_null_identifiers(session: Session) -> list[Thing]:
+def things_with_null_identifiers(session: Session, limit: Optional[int] = None) -> list[Thing]:
     # Note that SQLAlchemy needs things to be written this way but it triggers flake8 so manually override
     things_select = select(Thing).filter(Thing.identifiers == None)  # noqa: E711
+    if limit is not None:
+        things_select = things_select.limit(limit)
     things = session.exec(things_select).all()
     return things
 
@@ -628,3 +755,205 @@ def export_job_with_uuid(session: Session, uuid: str) -> Optional[ExportJob]:
     export_job_select = select(ExportJob).where(ExportJob.uuid == uuid)
     result = session.exec(export_job_select)
     return result.first()
+
+
+def reusable_export_job_with_fingerprint(
+    session: Session, fingerprint: str, created_after: datetime.datetime, completed_after: datetime.datetime
+) -> Optional[ExportJob]:
+    """The most recent export job with the fingerprint that's either still running and was created after created_after,
+    or completed without an error after completed_after"""
+    export_job_select = (
+        select(ExportJob)
+        .where(ExportJob.fingerprint == fingerprint)
+        .where(ExportJob.error == None)  # noqa: E711
+        .where(ExportJob.tcancelled == None)  # noqa: E711
+        .where(
+            sqlalchemy.or_(
+                sqlalchemy.and_(ExportJob.tcompleted == None, ExportJob.tcreated > created_after),  # type: ignore # noqa: E711
+                ExportJob.tcompleted > completed_after,  # type: ignore
+            )
+        )
+        .order_by(ExportJob.tcreated.desc())  # type: ignore
+    )
+    return session.exec(export_job_select).first()
+
+
+def claim_next_export_job(
+    session: Session, worker_id: str, orphaned_before: datetime.datetime, max_attempts: int
+) -> Optional[ExportJob]:
+    """
+    Claims the oldest queued export job for the worker, or a started job whose heartbeat is older than orphaned_before.
+    Orphaned jobs that have already been claimed max_attempts times are failed instead of claimed.
+
+    Rows locked by another worker's claim are skipped rather than waited on, so concurrent workers never claim the same
+    job.
+    """
+    while True:
+        export_job_select = (
+            select(ExportJob)
+            .where(ExportJob.tcompleted == None)  # noqa: E711
+            .where(ExportJob.tcancelled == None)  # noqa: E711
+            .where(
+                sqlalchemy.or_(
+                    ExportJob.tstarted == None,  # type: ignore # noqa: E711
+                    ExportJob.heartbeat == None,  # type: ignore # noqa: E711
+                    ExportJob.heartbeat < orphaned_before,  # type: ignore
+                )
+            )
+            .order_by(ExportJob.tcreated)  # type: ignore
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+        export_job = session.exec(export_job_select).first()
+        if export_job is None:
+            session.commit()
+            return None
+        now = igsn_lib.time.dtnow()
+        if export_job.attempts >= max_attempts:
+            logging.error(f"Export job {export_job.uuid} was abandoned by its worker {export_job.attempts} times")
+            export_job.tcompleted = now
+            export_job.error = f"Export abandoned after {export_job.attempts} attempts"
+            session.add(export_job)
+            session.commit()
+            continue
+        export_job.tstarted = now
+        export_job.heartbeat = now
+        export_job.worker_id = worker_id
+        export_job.attempts += 1
+        session.add(export_job)
+        session.commit()
+        return export_job
+
+
+def heartbeat_export_job(session: Session, uuid: str, worker_id: str, rows_written: Optional[int] = None,
+                         bytes_written: Optional[int] = None) -> bool:
+    """Records that the worker is still running the job, and how far along it is.  Returns False if the worker should
+    stop: the job was cancelled, completed, or claimed by another worker after this one was presumed dead."""
+    values: dict = {"heartbeat": igsn_lib.time.dtnow()}
+    if rows_written is not None:
+        values["rows_written"] = rows_written
+    if bytes_written is not None:
+        values["bytes_written"] = bytes_written
+    heartbeat_update = (
+        update(ExportJob)
+        .where(ExportJob.uuid == uuid)
+        .where(ExportJob.worker_id == worker_id)
+        .where(ExportJob.tcompleted == None)  # type: ignore # noqa: E711
+        .where(ExportJob.tcancelled == None)  # type: ignore # noqa: E711
+        .values(**values)
+    )
+    result = session.execute(heartbeat_update)
+    session.commit()
+    return result.rowcount == 1
+
+
+def finish_export_job(session: Session, uuid: str, worker_id: Optional[str], values: dict) -> bool:
+    """Completes the job with the values, as long as the worker still owns it.  Returns False, leaving the job alone, if
+    it had already completed or was claimed by another worker after this one was presumed dead."""
+    finish_update = (
+        update(ExportJob)
+        .where(ExportJob.uuid == uuid)
+        .where(ExportJob.worker_id == worker_id)
+        .where(ExportJob.tcompleted == None)  # type: ignore # noqa: E711
+        .values(tcompleted=igsn_lib.time.dtnow(), **values)
+    )
+    result = session.execute(finish_update)
+    session.commit()
+    return result.rowcount == 1
+
+
+def cancel_export_job(session: Session, uuid: str) -> bool:
+    """Requests cancelling the job.  A queued job is completed as cancelled right away, a running one by its worker
+    the next time it heartbeats.  Returns False if the job had already completed."""
+    now = igsn_lib.time.dtnow()
+    cancel_update = (
+        update(ExportJob)
+        .where(ExportJob.uuid == uuid)
+        .where(ExportJob.tcompleted == None)  # type: ignore # noqa: E711
+        .values(tcancelled=now)
+    )
+    cancelled = session.execute(cancel_update).rowcount == 1
+    if cancelled:
+        queued_update = (
+            update(ExportJob)
+            .where(ExportJob.uuid == uuid)
+            .where(ExportJob.tstarted == None)  # type: ignore # noqa: E711
+            .values(tcompleted=now, error=EXPORT_JOB_CANCELLED)
+        )
+        session.execute(queued_update)
+    session.commit()
+    return cancelled
+
+
+def export_jobs_with_files_completed_before(session: Session, completed_before: datetime.datetime) -> List[ExportJob]:
+    """Export jobs other than sitemaps that completed before completed_before and still have an exported file"""
+    export_job_select = (
+        select(ExportJob)
+        .where(ExportJob.file_path != None)  # noqa: E711
+        .where(ExportJob.is_sitemap == False)  # noqa: E712
+        .where(ExportJob.tcompleted < completed_before)  # type: ignore
+    )
+    return list(session.exec(export_job_select).all())
+
+
+def h3_counts_for_query(session: Session, query: str, resolution: int) -> dict[str, int]:
+    """Returns the materialized h3 cell to record count dictionary for the query at the resolution"""
+    h3_count_select = select(H3Count.h3, H3Count.count).where(H3Count.query == query).where(
+        H3Count.resolution == resolution
+    )
+    rows = session.execute(h3_count_select).fetchall()
+    counts = {}
+    for row in rows:
+        counts[row[0]] = row[1]
+    return counts
+
+
+def materialized_h3_count_queries(session: Session) -> list[str]:
+    """Returns the queries that have materialized h3 counts"""
+    return session.exec(select(H3Count.query).distinct()).all()
+
+
+def save_h3_counts(session: Session, query: str, resolution: int, counts: dict[str, int]):
+    """Replaces the materialized h3 counts for the query at the resolution"""
+    tstamp = datetime.datetime.now()
+    session.execute(delete(H3Count).where(H3Count.query == query).where(H3Count.resolution == resolution))
+    mappings = [
+        {"query": query, "resolution": resolution, "h3": h3, "count": count, "tstamp": tstamp}
+        for h3, count in counts.items()
+    ]
+    if len(mappings) > 0:
+        session.bulk_insert_mappings(mapper=H3Count, mappings=mappings, return_defaults=False)
+    session.commit()
+
+
+def get_thing_core_content(
+    session: Session, identifier: str, thing_tstamp: datetime.datetime, transformer_version: int
+) -> Optional[dict]:
+    """Returns the cached core content for the identifier if it was transformed from the current version of the thing"""
+    statement = select(ThingCoreContent).where(ThingCoreContent.id == identifier)
+    core_content = session.exec(statement).first()
+    if (
+        core_content is None
+        or core_content.thing_tstamp != thing_tstamp
+        or core_content.transformer_version != transformer_version
+    ):
+        return None
+    return core_content.content
+
+
+def save_thing_core_content(
+    session: Session, identifier: str, thing_tstamp: datetime.datetime, transformer_version: int, content: dict
+):
+    statement = select(ThingCoreContent).where(ThingCoreContent.id == identifier)
+    core_content = session.exec(statement).first()
+    if core_content is None:
+        core_content = ThingCoreContent(id=identifier)
+    core_content.thing_tstamp = thing_tstamp
+    core_content.transformer_version = transformer_version
+    core_content.content = content
+    session.add(core_content)
+    try:
+        session.commit()
+    except sqlalchemy.exc.IntegrityError:
+        # Another request cached the same identifier first, which is fine
+        session.rollback()
@@ -0,0 +1,79 @@
+"""
+Deferred application startup.  Expensive state (vocabularies, the taxonomy map) is registered as WarmupTasks that a
+background warm-up runs in parallel after the app starts accepting traffic.  Code paths that need the state call
+ensure(), which waits for the warm-up's run if it's in progress or runs the task itself if it hasn't started.
+"""
+import concurrent.futures
+import logging
+import threading
+import time
+from typing import Any, Callable, Optional
+
+_L = logging.getLogger("startup")
+
+
+class WarmupTask:
+    """A named piece of startup work that runs exactly once, on first use or during the background warm-up"""
+
+    def __init__(self, name: str, fn: Callable[[], Any]):
+        self.name = name
+        self._fn = fn
+        self._lock = threading.Lock()
+        self._result: Any = None
+        self.ready = False
+        self.duration_seconds: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def ensure(self) -> Any:
+        """Returns the result of the task, running it first if it hasn't completed.  A failed task is retried on the
+        next call."""
+        if self.ready:
+            return self._result
+        with self._lock:
+            if not self.ready:
+                start = time.monotonic()
+                try:
+                    self._result = self._fn()
+                except Exception as e:
+                    self.error = str(e)
+                    raise
+                self.duration_seconds = time.monotonic() - start
+                self.error = None
+                self.ready = True
+                _L.info("Warmed up %s in %.2fs", self.name, self.duration_seconds)
+        return self._result
+
+    def status(self) -> dict:
+        return {"ready": self.ready, "duration_seconds": self.duration_seconds, "error": self.error}
+
+
+_tasks: dict[str, WarmupTask] = {}
+
+
+def register(name: str, fn: Callable[[], Any]) -> WarmupTask:
+    task = WarmupTask(name, fn)
+    _tasks[name] = task
+    return task
+
+
+def _warm_up(task: WarmupTask):
+    try:
+        task.ensure()
+    except Exception:
+        _L.exception("Failed to warm up %s, it will be retried on first use", task.name)
+
+
+def warm_up_in_background():
+    """Runs all the registered tasks in parallel without waiting for them to finish"""
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(_tasks)), thread_name_prefix="warmup")
+    for task in _tasks.values():
+        executor.submit(_warm_up, task)
+    executor.shutdown(wait=False)
+
+
+def is_ready() -> bool:
+    return all(task.ready for task in _tasks.values())
+
+
+def readiness() -> dict:
+    return {"ready": is_ready(), "tasks": {name: task.status() for name, task in _tasks.items()}}
@@ -0,0 +1,94 @@
+import functools
+import logging
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException
+from starlette.responses import Response
+from starlette.status import HTTP_404_NOT_FOUND
+
+from isb_lib.utilities import h3_utilities
+from isb_lib.utilities.vector_tile import MEDIA_MVT, VectorTileLayer, encode_tile, is_valid_tile, tile_bounds
+from isb_web import config, isb_solr_query
+from isb_web.sqlmodel_database import SQLModelDAO
+
+router = APIRouter(prefix="/tiles")
+dao: Optional[SQLModelDAO] = None
+_L = logging.getLogger("tiles")
+
+H3_LAYER_NAME = "h3"
+POINTS_LAYER_NAME = "samples"
+POINT_FIELDS = [
+    "id",
+    "source",
+    isb_solr_query.LONGITUDE_FIELD,
+    isb_solr_query.LATITUDE_FIELD,
+]
+# Fraction of the tile size the h3 query is expanded by on each side, so that cells straddling the tile edge are
+# counted the same way in neighboring tiles
+_H3_TILE_BUFFER = 0.125
+
+
+def h3_resolution_for_zoom(z: int) -> int:
+    """Picks an h3 resolution that puts roughly a dozen cells across a tile"""
+    return max(0, min(15, round(z * 0.6)))
+
+
+def _buffered_bounds(z: int, x: int, y: int) -> tuple[float, float, float, float]:
+    min_lon, min_lat, max_lon, max_lat = tile_bounds(z, x, y)
+    dx = (max_lon - min_lon) * _H3_TILE_BUFFER
+    dy = (max_lat - min_lat) * _H3_TILE_BUFFER
+    return max(-180.0, min_lon - dx), max(-90.0, min_lat - dy), min(180.0, max_lon + dx), min(90.0, max_lat + dy)
+
+
+def _h3_layer(z: int, x: int, y: int, q: str) -> VectorTileLayer:
+    layer = VectorTileLayer(H3_LAYER_NAME, z, x, y)
+    resolution = h3_resolution_for_zoom(z)
+    with dao.get_session() as session:  # type: ignore
+        counts = h3_utilities.record_counts_in_bounding_box(q, resolution, _buffered_bounds(z, x, y), session)
+    for cell, count in counts.items():
+        if cell in h3_utilities.POLES:
+            continue
+        geometries, _ = h3_utilities.cell_geometry(cell)
+        for geometry in geometries:
+            layer.add_polygon(geometry["coordinates"], {"h3": cell, "n": count})
+    return layer
+
+
+def _points_layer(z: int, x: int, y: int, q: str) -> VectorTileLayer:
+    layer = VectorTileLayer(POINTS_LAYER_NAME, z, x, y)
+    docs = isb_solr_query.solr_points_in_bounding_box(
+        q, tile_bounds(z, x, y), POINT_FIELDS, config.Settings().tile_max_points
+    )
+    for doc in docs:
+        layer.add_point(
+            doc[isb_solr_query.LONGITUDE_FIELD],
+            doc[isb_solr_query.LATITUDE_FIELD],
+            {"id": doc["id"], "source": doc.get("source")},
+        )
+    return layer
+
+
+@functools.lru_cache(maxsize=config.Settings().tile_cache_size)
+def _encoded_tile(index_version: str, z: int, x: int, y: int, q: str) -> bytes:
+    # index_version isn't used directly, it's part of the cache key so that tiles are rebuilt after the index changes
+    if z >= config.Settings().tile_points_min_zoom:
+        layer = _points_layer(z, x, y, q)
+    else:
+        layer = _h3_layer(z, x, y, q)
+    _L.debug("Encoded %d features for tile %d/%d/%d", len(layer), z, x, y)
+    return encode_tile([layer])
+
+
+@router.get("/{z}/{x}/{y}.mvt", tags=["heatmaps"], response_class=Response)
+def get_tile(z: int, x: int, y: int, q: Optional[str] = None) -> Response:
+    """Returns a Mapbox Vector Tile of sample records matching q.
+
+    Below the tile_points_min_zoom setting the tile has an "h3" layer of cell polygons with the record count "n", and
+    at or above it a "samples" layer of points with the record "id" and "source".
+    """
+    if not is_valid_tile(z, x, y):
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail=f"No tile {z}/{x}/{y}")
+    content = _encoded_tile(
+        isb_solr_query.current_index_version(), z, x, y, h3_utilities.canonical_h3_count_query(q)
+    )
+    return Response(content=content, media_type=MEDIA_MVT)
@@ -0,0 +1,71 @@
+import logging
+import time
+
+import click
+import fastapi.encoders
+import fastapi.responses
+import h3
+
+import isb_lib.core
+from isb_lib.utilities import h3_utilities
+from isb_web.json_responses import FastJSONResponse
+
+
+def _h3_feature_collection(num_features: int, resolution: int):
+    cells = set()
+    for base_cell in h3.get_res0_cells():
+        for cell in h3.cell_to_children(base_cell, resolution):
+            cells.add(cell)
+            if len(cells) == num_features:
+                break
+        if len(cells) == num_features:
+            break
+    counts = {cell: float(index) for index, cell in enumerate(cells)}
+    return h3_utilities.h3s_to_feature_collection(cells, cell_props=counts)
+
+
+def _time_render(description: str, render, repeat: int) -> float:
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        num_bytes = len(render())
+        durations.append(time.perf_counter() - start)
+    best = min(durations)
+    logging.info(f"{description}: best of {repeat} {best:.3f}s for {num_bytes} bytes")
+    return best
+
+
+@click.command()
+@click.option(
+    "-n", "--num_features", default=100000, help="Number of h3 cell features in the collection", show_default=True
+)
+@click.option(
+    "-r", "--resolution", default=5, help="h3 resolution of the cells", show_default=True
+)
+@click.option(
+    "--repeat", default=3, help="Number of times to render each way", show_default=True
+)
+@click.option(
+    "-v", "--verbosity", default="INFO", help="Specify logging level", show_default=True
+)
+def main(num_features, resolution, repeat, verbosity):
+    isb_lib.core.initialize_logging(verbosity)
+    feature_collection = _h3_feature_collection(num_features, resolution)
+    logging.info(f"Built a collection of {len(feature_collection['features'])} features")
+    json_response = fastapi.responses.JSONResponse(content={})
+    before = _time_render(
+        "jsonable_encoder + JSONResponse",
+        lambda: json_response.render(fastapi.encoders.jsonable_encoder(feature_collection)),
+        repeat,
+    )
+    fast_json_response = FastJSONResponse(content={})
+    after = _time_render("FastJSONResponse", lambda: fast_json_response.render(feature_collection), repeat)
+    logging.info(f"FastJSONResponse is {before / after:.1f}x faster")
+
+
+"""
+Compares the time to serialize a large h3 GeoJSON feature collection, like the /h3_counts/ endpoint returns, with
+FastAPI's default jsonable_encoder + JSONResponse path and with FastJSONResponse.
+"""
+if __name__ == "__main__":
+    main()
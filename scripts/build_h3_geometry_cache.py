@@ -0,0 +1,44 @@
+import logging
+
+import click
+
+import isb_lib.core
+from isb_lib.utilities.h3_utilities import H3GeometryTable, MAX_PRECOMPUTED_RESOLUTION
+
+
+@click.command()
+@click.option(
+    "-f", "--file", default="h3_geometry_cache.sqlite", help="The path to the sqlite file to write the geometries to"
+)
+@click.option(
+    "-r",
+    "--max_resolution",
+    default=4,
+    help=f"The maximum h3 resolution to precompute, at most {MAX_PRECOMPUTED_RESOLUTION}.  Note that resolution 5 "
+         f"has ~2 million cells and resolution 6 has ~14 million cells.",
+    show_default=True,
+)
+@click.option(
+    "-b", "--batch_size", default=100000, help="The batch size to use when writing to the sqlite file"
+)
+@click.option(
+    "-v",
+    "--verbosity",
+    default="INFO",
+    help="Specify logging level",
+    show_default=True,
+)
+def main(file, max_resolution, batch_size, verbosity):
+    isb_lib.core.initialize_logging(verbosity)
+    if max_resolution > MAX_PRECOMPUTED_RESOLUTION:
+        raise click.BadParameter(f"max_resolution must be at most {MAX_PRECOMPUTED_RESOLUTION}")
+    num_written = H3GeometryTable.build(file, max_resolution, batch_size)
+    logging.info(f"Wrote {num_written} h3 cell geometries to {file}")
+
+
+"""
+Precomputes the antimeridian-split GeoJSON geometry and area of every h3 cell up to the specified resolution, for use
+by the /h3_counts/ endpoint.  Point the h3_geometry_cache_path setting at the output file to enable it.
+"""
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import signal
+
+import click
+import click_config_file
+
+import isb_lib.core
+import isb_web.export
+from isb_web import config
+from isb_web.export_worker import ExportWorker
+from isb_web.sqlmodel_database import SQLModelDAO
+
+
+@click.command()
+@click.option(
+    "-d", "--db_url", default=None, help="SQLAlchemy database URL for storage, defaults to the web app's"
+)
+@click.option(
+    "-c",
+    "--concurrency",
+    default=config.Settings().export_worker_concurrency,
+    help="Number of export jobs to run at a time",
+    show_default=True,
+)
+@click.option(
+    "-v", "--verbosity", default="INFO", help="Specify logging level", show_default=True
+)
+@click_config_file.configuration_option(config_file_name="isb.cfg")
+@click.pass_context
+def main(ctx, db_url, concurrency, verbosity):
+    if db_url is None:
+        db_url = config.Settings().database_url
+    isb_lib.core.things_main(ctx, db_url, config.Settings().solr_url, verbosity)
+    dao = SQLModelDAO(db_url)
+    # The jobs open their sessions through the export module
+    isb_web.export.dao = dao
+    worker = ExportWorker.from_settings(dao, concurrency)
+    # Finish the running jobs on SIGTERM rather than leaving them to be retried
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        # Jobs interrupted here are retried by another worker once their heartbeat times out
+        pass
+
+
+"""
+Runs the queued export jobs created by /export/create, see isb_web.export_worker.
+"""
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import logging
+
+import click
+import click_config_file
+
+import isb_lib.core
+from isb_lib.utilities import h3_utilities
+from isb_web import config
+from isb_web.isb_solr_query import solr_facet_counts
+from isb_web.sqlmodel_database import SQLModelDAO
+
+
+@click.command()
+@click.option(
+    "-d", "--db_url", default=None, help="SQLAlchemy database URL for storage"
+)
+@click.option(
+    "-s", "--solr_url", default=None, help="Solr index URL"
+)
+@click.option(
+    "-a",
+    "--authority",
+    default=None,
+    help="Only refresh the global counts and the counts for this authority.  Defaults to all authorities.",
+)
+@click.option(
+    "-c",
+    "--include_categories",
+    is_flag=True,
+    help="Also materialize counts split by material and context category",
+)
+@click.option(
+    "-r",
+    "--max_resolution",
+    default=config.Settings().h3_count_max_materialized_resolution,
+    help="The maximum h3 resolution to materialize counts for",
+    show_default=True,
+)
+@click.option(
+    "-v", "--verbosity", default="INFO", help="Specify logging level", show_default=True
+)
+@click_config_file.configuration_option(config_file_name="isb.cfg")
+@click.pass_context
+def main(ctx, db_url, solr_url, authority, include_categories, max_resolution, verbosity):
+    isb_lib.core.things_main(ctx, db_url, solr_url, verbosity)
+    if authority is not None:
+        queries = h3_utilities.h3_count_queries_for_authority(authority)
+    else:
+        queries = h3_utilities.h3_count_queries_for_authority()
+        for source in solr_facet_counts("source", solr_url=solr_url).keys():
+            queries.append(f"source:{source}")
+    if include_categories:
+        queries.extend(h3_utilities.h3_count_queries_for_categories(solr_url))
+    session = SQLModelDAO(db_url).get_session()
+    try:
+        num_refreshed = h3_utilities.materialize_h3_counts(session, queries, max_resolution, solr_url)
+        logging.info(f"Refreshed {num_refreshed} materialized h3 count sets for queries {queries}")
+    finally:
+        session.close()
+
+
+"""
+Materializes the per-resolution h3 record counts served by the /h3_counts/ endpoint for the global view and for each
+source (and optionally each material and context category).  The solr import refreshes the affected counts
+automatically, so this only needs to be run to populate the counts initially or after changing the resolution.
+"""
+if __name__ == "__main__":
+    main()
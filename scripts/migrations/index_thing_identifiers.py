@@ -0,0 +1,57 @@
+import logging
+
+import click
+
+import isb_lib.core
+from isb_web.sqlmodel_database import SQLModelDAO, things_with_null_identifiers, insert_identifiers, \
+    THING_IDENTIFIERS_INDEX_NAME
+
+
+@click.command()
+@click.option(
+    "-d", "--db_url", default=None, help="SQLAlchemy database URL for storage"
+)
+@click.option(
+    "-b", "--batch_size", default=10000, help="Number of things to backfill identifiers for in each transaction"
+)
+@click.option(
+    "-v",
+    "--verbosity",
+    default="INFO",
+    help="Specify logging level",
+    show_default=True,
+)
+@click.pass_context
+def main(ctx, db_url, batch_size, verbosity):
+    isb_lib.core.things_main(ctx, db_url, None, verbosity)
+    dao = SQLModelDAO(ctx.obj["db_url"])
+    session = dao.get_session()
+    try:
+        backfill_thing_identifiers(session, batch_size)
+    finally:
+        session.close()
+    logging.info(f"Creating index {THING_IDENTIFIERS_INDEX_NAME}, this may take a while on a large thing table")
+    dao.create_thing_identifiers_index()
+    logging.info("Done.")
+
+
+def backfill_thing_identifiers(session, batch_size: int):
+    """Populate the identifiers of any things that were saved without them, so they're included in the index"""
+    total_processed = 0
+    things = things_with_null_identifiers(session, batch_size)
+    while len(things) > 0:
+        for thing in things:
+            insert_identifiers(thing)
+            session.add(thing)
+        session.commit()
+        total_processed += len(things)
+        logging.info(f"Backfilled identifiers for {total_processed} things")
+        things = things_with_null_identifiers(session, batch_size)
+
+
+"""
+Backfills Thing.identifiers where missing and creates the GIN expression index used by get_thing_with_id to look up
+things by any of their identifiers, replacing the sequential scan of the old LIKE '%identifier%' query.
+"""
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import logging
+
+import click
+import click_config_file
+
+import isb_lib.core
+from isb_lib import core_content
+from isb_web import config
+from isb_web.sqlmodel_database import SQLModelDAO, taxonomy_name_to_kingdom_map
+
+
+@click.command()
+@click.option(
+    "-d", "--db_url", default=None, help="SQLAlchemy database URL for storage"
+)
+@click.option(
+    "-a", "--authority", required=True, help="The authority whose things should have their core content cached"
+)
+@click.option(
+    "-v", "--verbosity", default="INFO", help="Specify logging level", show_default=True
+)
+@click_config_file.configuration_option(config_file_name="isb.cfg")
+@click.pass_context
+def main(ctx, db_url, authority, verbosity):
+    isb_lib.core.things_main(ctx, db_url, None, verbosity)
+    session = SQLModelDAO(db_url).get_session()
+    isb_lib.core.initialize_vocabularies(session)
+    taxon_map = taxonomy_name_to_kingdom_map(session) if config.Settings().taxon_cache_enabled else {}
+    num_things = 0
+    num_failed = 0
+    try:
+        for thing in isb_lib.core.ThingRecordIterator(session, authority_id=authority).yieldRecordsByPage():
+            try:
+                core_content.core_content(thing.id, thing, session, taxon_map)
+            except Exception as e:
+                logging.error("Unable to transform thing %s: %s", thing.id, e)
+                num_failed += 1
+            num_things += 1
+            if num_things % 10000 == 0:
+                logging.info("Cached core content for %d things", num_things)
+    finally:
+        session.close()
+    logging.info("Cached core content for %d things, %d failed", num_things - num_failed, num_failed)
+
+
+"""
+Populates the cached core representation of things served by /thing/{id}?format=core, so that requests don't need to
+run the transformers or call the model server.  Things that are already cached at their current tstamp and
+transformer version are skipped, so this is cheap to rerun after each import.
+"""
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,13 @@
+import asyncio
+import contextlib
+
 import pytest
 import fastapi
 import starlette.datastructures
 import json
 
 from fastapi import FastAPI
+from fastapi.testclient import TestClient
 
 from isb_web import analytics
 from isb_web.analytics import AnalyticsEvent
@@ -64,3 +68,41 @@ def test_analytics_request_data_custom_properties(request_fixture: fastapi.Reque
     assert props_string is not None
     props_dict = json.loads(props_string)
     assert props_dict["foo"] == "bar"
+
+
+def test_analytics_middleware_drops_when_full():
+    middleware = analytics.AnalyticsMiddleware(FastAPI(), queue_size=1)
+
+    async def enqueue_events():
+        dropped_before = analytics.ANALYTICS_COUNTS["dropped"]
+        # The sender task doesn't get to run until this coroutine yields, so only the first event fits in the queue
+        for _ in range(3):
+            middleware._enqueue({}, {"name": "test"})
+        dropped = analytics.ANALYTICS_COUNTS["dropped"] - dropped_before
+        middleware._sender.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await middleware._sender
+        return dropped
+
+    # Run on a private loop, asyncio.run() would clear the current event loop that other tests rely on
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(enqueue_events()) == 2
+    finally:
+        loop.close()
+
+
+def test_analytics_middleware_enqueues_attached_events():
+    app = FastAPI()
+
+    @app.get("/test")
+    def test_endpoint(request: fastapi.Request):
+        analytics.attach_analytics_state_to_request(AnalyticsEvent.THING_LIST, request)
+        return {}
+
+    middleware = analytics.AnalyticsMiddleware(app)
+    enqueued = []
+    middleware._enqueue = lambda headers, data: enqueued.append(data)  # type: ignore
+    client = TestClient(middleware)
+    assert client.get("/test").status_code == 200
+    assert enqueued[0]["name"] == AnalyticsEvent.THING_LIST.value
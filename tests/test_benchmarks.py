@@ -0,0 +1,186 @@
+"""
+Throughput benchmarks for the transformers and solr document building, run with pytest-benchmark.  The sample records
+in test_data are replicated to ISB_BENCHMARK_RECORDS (default 100k) records, so these are skipped unless
+ISB_RUN_BENCHMARKS is set:
+
+    ISB_RUN_BENCHMARKS=1 pytest test_benchmarks.py
+
+Each benchmark records records/sec and peak memory in its extra_info, and fails if throughput drops more than
+ISB_BENCHMARK_TOLERANCE below the baseline in ISB_BENCHMARK_BASELINE_PATH.  Baselines are machine specific, so none is
+committed and a benchmark without one is skipped.  Record them with ISB_BENCHMARK_UPDATE_BASELINE=1 on the machine the
+comparisons will run on.  The python-benchmarks workflow does that for pull requests, recording the baseline from the
+base branch and comparing the pull request against it on the same runner.
+"""
+import csv
+import datetime
+import glob
+import itertools
+import json
+import os
+import tracemalloc
+import typing
+from unittest.mock import patch
+
+import pytest
+
+from isamples_metadata.GEOMETransformer import GEOMETransformer
+from isamples_metadata.OpenContextTransformer import OpenContextTransformer
+from isamples_metadata.SESARTransformer import SESARTransformer
+from isamples_metadata.SmithsonianTransformer import SmithsonianTransformer
+from isamples_metadata.taxonomy.metadata_model_client import ModelServerClient, PredictionResult
+from isb_lib.core import _coreRecordAsSolrDoc
+
+pytestmark = pytest.mark.skipif(
+    os.environ.get("ISB_RUN_BENCHMARKS") is None, reason="Set ISB_RUN_BENCHMARKS to run the benchmarks"
+)
+
+NUM_RECORDS = int(os.environ.get("ISB_BENCHMARK_RECORDS", 100000))
+TOLERANCE = float(os.environ.get("ISB_BENCHMARK_TOLERANCE", 0.2))
+UPDATE_BASELINE = os.environ.get("ISB_BENCHMARK_UPDATE_BASELINE") is not None
+BASELINE_PATH = os.environ.get("ISB_BENCHMARK_BASELINE_PATH", "./test_data/benchmarks/baseline.json")
+# tracemalloc slows everything down considerably, so peak memory is measured on a separate pass over a sample
+MEMORY_SAMPLE_SIZE = 1000
+# Stands in for the taxonomy table that GEOME kingdom lookups would otherwise query
+TAXONOMY_NAME_TO_KINGDOM_MAP = {
+    "Animalia": "Animalia",
+    "Chordata": "Animalia",
+    "Arthropoda": "Animalia",
+    "Mollusca": "Animalia",
+    "Plantae": "Plantae",
+    "Fungi": "Fungi",
+}
+
+
+def _json_records(pattern: str) -> list[dict]:
+    records = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path) as source_file:
+            records.append(json.load(source_file))
+    return records
+
+
+def _smithsonian_records() -> list[dict]:
+    with open("./test_data/Smithsonian/DwC raw/DwC_occurrence_10.csv", newline="") as csv_file:
+        csv_reader = csv.reader(csv_file, delimiter="\t")
+        column_headers = next(csv_reader)
+        return [
+            {key: value for key, value in zip(column_headers, values) if len(key) > 0} for values in csv_reader
+        ]
+
+
+def _replicate(records: list, num_records: int = NUM_RECORDS) -> list:
+    return list(itertools.islice(itertools.cycle(records), num_records))
+
+
+def _sesar_transform(record: dict):
+    return SESARTransformer(record).transform()
+
+
+def _geome_transform(record: dict):
+    last_updated = datetime.datetime(year=1978, month=11, day=22, hour=12, minute=34)
+    return GEOMETransformer(record, last_updated, None, TAXONOMY_NAME_TO_KINGDOM_MAP).transform()
+
+
+def _open_context_transform(record: dict):
+    return OpenContextTransformer(record).transform()
+
+
+def _smithsonian_transform(record: dict):
+    return SmithsonianTransformer(record).transform()
+
+
+@pytest.fixture(autouse=True)
+def model_server():
+    fake_prediction = [PredictionResult("Any anthropogenic material", 1.0)]
+    with patch.object(ModelServerClient, "make_sesar_material_request", return_value=fake_prediction), \
+            patch.object(ModelServerClient, "make_opencontext_material_request", return_value=fake_prediction), \
+            patch.object(ModelServerClient, "make_opencontext_sample_request", return_value=fake_prediction), \
+            patch.object(ModelServerClient, "make_smithsonian_sampled_feature_request", return_value="Atmosphere"):
+        yield
+
+
+def _load_baseline() -> dict:
+    if not os.path.exists(BASELINE_PATH):
+        return {}
+    with open(BASELINE_PATH) as baseline_file:
+        return json.load(baseline_file)
+
+
+def _save_baseline_entry(name: str, entry: dict):
+    baseline = _load_baseline()
+    baseline[name] = entry
+    os.makedirs(os.path.dirname(BASELINE_PATH), exist_ok=True)
+    with open(BASELINE_PATH, "w") as baseline_file:
+        json.dump(baseline, baseline_file, indent=4, sort_keys=True)
+
+
+def _peak_memory_bytes(fn: typing.Callable, records: list) -> int:
+    tracemalloc.start()
+    try:
+        for record in records[:MEMORY_SAMPLE_SIZE]:
+            fn(record)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _run_benchmark(benchmark, name: str, fn: typing.Callable, records: list):
+    def run_all():
+        for record in records:
+            fn(record)
+
+    benchmark.pedantic(run_all, rounds=1, iterations=1, warmup_rounds=0)
+    records_per_second = len(records) / benchmark.stats.stats.min
+    peak_memory_bytes = _peak_memory_bytes(fn, records)
+    benchmark.extra_info["records"] = len(records)
+    benchmark.extra_info["records_per_second"] = records_per_second
+    benchmark.extra_info["peak_memory_bytes"] = peak_memory_bytes
+    if UPDATE_BASELINE:
+        _save_baseline_entry(
+            name, {"records_per_second": records_per_second, "peak_memory_bytes": peak_memory_bytes}
+        )
+        return
+    baseline = _load_baseline().get(name)
+    if baseline is None:
+        pytest.skip(
+            f"No baseline for {name} in {BASELINE_PATH}, so it can't be checked for a regression.  Baselines are machine "
+            "specific and none is committed; record one on this machine with ISB_BENCHMARK_UPDATE_BASELINE=1"
+        )
+    minimum = baseline["records_per_second"] * (1 - TOLERANCE)
+    assert records_per_second >= minimum, (
+        f"{name} throughput {records_per_second:.0f} records/s regressed past {minimum:.0f} records/s "
+        f"(baseline {baseline['records_per_second']:.0f} records/s, tolerance {TOLERANCE:.0%})"
+    )
+
+
+@pytest.mark.benchmark(group="transformers")
+def test_sesar_transformer_throughput(benchmark):
+    records = _replicate(_json_records("./test_data/SESAR/raw/*.json"))
+    _run_benchmark(benchmark, "SESARTransformer", _sesar_transform, records)
+
+
+@pytest.mark.benchmark(group="transformers")
+def test_geome_transformer_throughput(benchmark):
+    records = _replicate(_json_records("./test_data/GEOME/raw/*.json"))
+    _run_benchmark(benchmark, "GEOMETransformer", _geome_transform, records)
+
+
+@pytest.mark.benchmark(group="transformers")
+def test_open_context_transformer_throughput(benchmark):
+    records = _replicate(_json_records("./test_data/OpenContext/raw/*.json"))
+    _run_benchmark(benchmark, "OpenContextTransformer", _open_context_transform, records)
+
+
+@pytest.mark.benchmark(group="transformers")
+def test_smithsonian_transformer_throughput(benchmark):
+    records = _replicate(_smithsonian_records())
+    _run_benchmark(benchmark, "SmithsonianTransformer", _smithsonian_transform, records)
+
+
+@pytest.mark.benchmark(group="solr")
+def test_core_record_as_solr_doc_throughput(benchmark):
+    core_records = [_sesar_transform(record) for record in _json_records("./test_data/SESAR/raw/*.json")]
+    core_records.extend(_geome_transform(record) for record in _json_records("./test_data/GEOME/raw/*.json"))
+    core_records.extend(_open_context_transform(record) for record in _json_records("./test_data/OpenContext/raw/*.json"))
+    core_records.extend(_smithsonian_transform(record) for record in _smithsonian_records())
+    _run_benchmark(benchmark, "_coreRecordAsSolrDoc", _coreRecordAsSolrDoc, _replicate(core_records))
@@ -0,0 +1,72 @@
+import threading
+import time
+
+from isb_lib.utilities.caches import LRUCache, SingleFlight, TTLCache
+
+
+def test_lru_cache_get_put():
+    cache = LRUCache(2)
+    assert cache.get("a") is None
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+    assert len(cache) == 1
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    # touch a so that b is the least recently used
+    cache.get("a")
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+
+def test_lru_cache_clear():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_ttl_cache_expires():
+    cache = TTLCache(2, 0.05)
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+    time.sleep(0.1)
+    assert cache.get("a") is None
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    single_flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    invocations = []
+
+    def slow_call():
+        invocations.append(1)
+        started.set()
+        release.wait()
+        return "result"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(single_flight.do("key", slow_call)))
+    leader.start()
+    started.wait()
+    followers = [threading.Thread(target=lambda: results.append(single_flight.do("key", slow_call))) for _ in range(3)]
+    for follower in followers:
+        follower.start()
+    while single_flight.coalesced < 3:
+        time.sleep(0.01)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join()
+    assert results == ["result"] * 4
+    assert len(invocations) == 1
+    # Once the call completes the next one does the work again
+    assert single_flight.do("key", lambda: "new result") == "new result"
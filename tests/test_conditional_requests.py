@@ -0,0 +1,91 @@
+import datetime
+
+import fastapi
+import pytest
+
+from isb_web import conditional_requests
+
+LAST_MODIFIED = datetime.datetime(2023, 5, 1, 12, 30, 15, 123456)
+
+
+def _request(headers: dict) -> fastapi.Request:
+    raw_headers = [(key.lower().encode("latin-1"), value.encode("latin-1")) for key, value in headers.items()]
+    return fastapi.Request({"type": "http", "method": "GET", "headers": raw_headers})
+
+
+def test_strong_etag():
+    etag = conditional_requests.strong_etag("IGSN:123456", "core", 1)
+    assert etag.startswith('"') and etag.endswith('"')
+    assert etag == conditional_requests.strong_etag("IGSN:123456", "core", 1)
+    assert etag != conditional_requests.strong_etag("IGSN:123456", "original", 1)
+
+
+def test_no_validators():
+    request = _request({})
+    assert not conditional_requests.has_validators(request)
+    assert not conditional_requests.is_not_modified(request, '"abc"', LAST_MODIFIED)
+
+
+def test_if_none_match():
+    assert conditional_requests.is_not_modified(_request({"If-None-Match": '"abc"'}), '"abc"', LAST_MODIFIED)
+    assert conditional_requests.is_not_modified(_request({"If-None-Match": 'W/"abc", "def"'}), '"abc"', None)
+    assert conditional_requests.is_not_modified(_request({"If-None-Match": "*"}), '"abc"', None)
+    assert not conditional_requests.is_not_modified(_request({"If-None-Match": '"def"'}), '"abc"', LAST_MODIFIED)
+
+
+def test_if_none_match_takes_precedence():
+    headers = {"If-None-Match": '"def"', "If-Modified-Since": conditional_requests.http_date(LAST_MODIFIED)}
+    assert not conditional_requests.is_not_modified(_request(headers), '"abc"', LAST_MODIFIED)
+
+
+def test_if_modified_since():
+    http_date = conditional_requests.http_date(LAST_MODIFIED)
+    assert http_date == "Mon, 01 May 2023 12:30:15 GMT"
+    assert conditional_requests.is_not_modified(_request({"If-Modified-Since": http_date}), '"abc"', LAST_MODIFIED)
+    newer = LAST_MODIFIED + datetime.timedelta(seconds=1)
+    assert not conditional_requests.is_not_modified(_request({"If-Modified-Since": http_date}), '"abc"', newer)
+    assert not conditional_requests.is_not_modified(_request({"If-Modified-Since": "garbage"}), '"abc"', newer)
+
+
+def test_not_modified_response():
+    response = conditional_requests.not_modified_response('"abc"', LAST_MODIFIED)
+    assert response.status_code == 304
+    assert response.headers["ETag"] == '"abc"'
+    assert response.headers["Last-Modified"] == "Mon, 01 May 2023 12:30:15 GMT"
+
+
+def test_byte_range():
+    assert conditional_requests.byte_range("bytes=0-99", 1000) == (0, 99)
+    assert conditional_requests.byte_range("bytes=500-", 1000) == (500, 999)
+    assert conditional_requests.byte_range("bytes=-100", 1000) == (900, 999)
+    assert conditional_requests.byte_range("bytes=-2000", 1000) == (0, 999)
+    # the last position is clamped to the end of the representation
+    assert conditional_requests.byte_range("bytes=900-5000", 1000) == (900, 999)
+
+
+def test_byte_range_ignored():
+    assert conditional_requests.byte_range("items=0-99", 1000) is None
+    assert conditional_requests.byte_range("bytes=0-99, 200-299", 1000) is None
+    assert conditional_requests.byte_range("bytes=99-0", 1000) is None
+    assert conditional_requests.byte_range("bytes=abc", 1000) is None
+    assert conditional_requests.byte_range("bytes=-", 1000) is None
+
+
+def test_byte_range_not_satisfiable():
+    with pytest.raises(conditional_requests.RangeNotSatisfiableException):
+        conditional_requests.byte_range("bytes=1000-", 1000)
+    with pytest.raises(conditional_requests.RangeNotSatisfiableException):
+        conditional_requests.byte_range("bytes=-0", 1000)
+
+
+def test_if_range_matches():
+    assert conditional_requests.if_range_matches(_request({}), '"abc"', LAST_MODIFIED)
+    assert conditional_requests.if_range_matches(_request({"If-Range": '"abc"'}), '"abc"', LAST_MODIFIED)
+    assert not conditional_requests.if_range_matches(_request({"If-Range": '"def"'}), '"abc"', LAST_MODIFIED)
+    # the strong comparison never matches weak entity tags
+    assert not conditional_requests.if_range_matches(_request({"If-Range": 'W/"abc"'}), 'W/"abc"', LAST_MODIFIED)
+    http_date = conditional_requests.http_date(LAST_MODIFIED)
+    assert conditional_requests.if_range_matches(_request({"If-Range": http_date}), '"abc"', LAST_MODIFIED)
+    newer = LAST_MODIFIED + datetime.timedelta(seconds=1)
+    assert not conditional_requests.if_range_matches(_request({"If-Range": http_date}), '"abc"', newer)
+    assert not conditional_requests.if_range_matches(_request({"If-Range": "garbage"}), '"abc"', LAST_MODIFIED)
@@ -1,4 +1,10 @@
 import datetime
+import gzip
+import itertools
+import json
+import os
+import threading
+import time
 from unittest.mock import patch, MagicMock
 
 import pytest
@@ -6,7 +12,9 @@ from starlette.middleware import Middleware
 from starlette.testclient import TestClient
 
 from isb_lib.models.export_job import ExportJob
+from isb_lib.utilities.solr_result_transformer import TargetExportFormat, ExportCompression
 import isb_web.export
+from isb_web import sqlmodel_database
 from isb_web.auth import AuthenticateMiddleware
 from isb_web.main import app
 
@@ -29,15 +37,82 @@ def setup():
     export_app.middleware_stack = export_app.build_middleware_stack()
 
 
-@patch("isb_web.export.search_solr_and_export_results")
 @patch("isb_web.sqlmodel_database.save_or_update_export_job")
-def test_export_create(mock_solr_query: MagicMock, mock_database: MagicMock, client: TestClient):
+@patch("isb_web.sqlmodel_database.reusable_export_job_with_fingerprint", return_value=None)
+def test_export_create(mock_reusable: MagicMock, mock_database: MagicMock, client: TestClient):
     response = client.get("/export/create")
-    assert mock_solr_query.called
+    # queued for an export worker
     assert mock_database.called
     assert response.status_code == 201
 
 
+def test_export_fingerprint():
+    params = {"q": "*:*", "fq": "source:SESAR", "fl": "id,source", "sort": "id asc"}
+    fingerprint = isb_web.export.export_fingerprint(TargetExportFormat.CSV, params, None)
+    reordered_params = {"sort": "id asc", "fl": "id, source", "fq": ["source:SESAR"], "q": "*:*"}
+    assert isb_web.export.export_fingerprint(TargetExportFormat.CSV, reordered_params, None) == fingerprint
+    assert isb_web.export.export_fingerprint(
+        TargetExportFormat.CSV, {"q": "*:*", "fq": ["a:1", "b:2"]}, None
+    ) == isb_web.export.export_fingerprint(TargetExportFormat.CSV, {"q": "*:*", "fq": ["b:2", "a:1"]}, None)
+    assert isb_web.export.export_fingerprint(TargetExportFormat.JSONL, params, None) != fingerprint
+    assert isb_web.export.export_fingerprint(TargetExportFormat.CSV, params, ExportCompression.GZIP) != fingerprint
+    assert isb_web.export.export_fingerprint(TargetExportFormat.CSV, dict(params, fl="source,id"), None) != fingerprint
+
+
+@patch("isb_web.sqlmodel_database.save_or_update_export_job")
+@patch("isb_web.sqlmodel_database.reusable_export_job_with_fingerprint")
+def test_export_create_reuses_running_job(mock_reusable: MagicMock, mock_save: MagicMock, client: TestClient):
+    job = ExportJob()
+    job.uuid = "123456"
+    job.tstarted = datetime.datetime.now()
+    mock_reusable.return_value = job
+    response = client.get("/export/create")
+    assert response.status_code == 200
+    assert response.json() == {"status": "started", "uuid": "123456", "reused": True}
+    assert not mock_save.called
+
+
+@patch("isb_web.isb_solr_query.current_index_version", return_value="2")
+@patch("isb_web.sqlmodel_database.save_or_update_export_job")
+@patch("isb_web.sqlmodel_database.reusable_export_job_with_fingerprint")
+def test_export_create_reuses_completed_job(mock_reusable: MagicMock, mock_save: MagicMock,
+                                            mock_index_version: MagicMock, client: TestClient, tmp_path):
+    file_path = tmp_path / "export.jsonl"
+    file_path.write_text("{}\n")
+    job = ExportJob()
+    job.uuid = "123456"
+    job.tcompleted = datetime.datetime.now()
+    job.file_path = str(file_path)
+    job.solr_index_version = "2"
+    mock_reusable.return_value = job
+    response = client.get("/export/create")
+    assert response.status_code == 200
+    assert response.json()["uuid"] == "123456"
+    assert not mock_save.called
+    # The index changed since the export, so it's redone
+    job.solr_index_version = "1"
+    response = client.get("/export/create")
+    assert response.status_code == 201
+    assert mock_save.called
+
+
+@patch("isb_web.sqlmodel_database.save_or_update_export_job")
+@patch("isb_web.sqlmodel_database.export_jobs_with_files_completed_before")
+def test_remove_expired_export_files(mock_expired: MagicMock, mock_save: MagicMock, tmp_path):
+    file_path = tmp_path / "export.csv"
+    file_path.write_text("id\n")
+    job = ExportJob()
+    job.file_path = str(file_path)
+    already_removed_job = ExportJob()
+    already_removed_job.file_path = str(tmp_path / "missing.csv")
+    mock_expired.return_value = [job, already_removed_job]
+    assert isb_web.export.remove_expired_export_files(MagicMock()) == 1
+    assert not file_path.exists()
+    assert job.file_path is None
+    assert already_removed_job.file_path is None
+    assert mock_save.call_count == 2
+
+
 def test_export_create_sort_unsupported(client: TestClient):
     response = client.get("/export/create?sort=foobar")
     assert response.status_code == 415
@@ -64,3 +139,383 @@ def test_export_statu_not_found(mock_database: MagicMock, client: TestClient):
     mock_database.return_value = None
     response = client.get("/export/status?uuid=123456")
     assert response.status_code == 404
+
+
+@patch("isb_web.sqlmodel_database.export_job_with_uuid")
+def test_export_status_cancelled(mock_database: MagicMock, client: TestClient):
+    job = ExportJob()
+    job.tstarted = datetime.datetime.now()
+    job.tcancelled = datetime.datetime.now()
+    mock_database.return_value = job
+    response = client.get("/export/status?uuid=123456")
+    assert response.status_code == 202
+    assert response.json()["status"] == "cancelling"
+    job.tcompleted = datetime.datetime.now()
+    job.error = sqlmodel_database.EXPORT_JOB_CANCELLED
+    response = client.get("/export/status?uuid=123456")
+    assert response.status_code == 200
+    assert response.json()["status"] == "cancelled"
+
+
+@patch("isb_web.sqlmodel_database.cancel_export_job", return_value=True)
+@patch("isb_web.sqlmodel_database.export_job_with_uuid")
+def test_export_cancel(mock_database: MagicMock, mock_cancel: MagicMock, client: TestClient):
+    job = ExportJob()
+    job.creator_id = "0000-0000-0000-0000"
+    mock_database.return_value = job
+    with patch("isb_web.auth.orcid_id_from_session_or_scope", return_value="1111-1111-1111-1111"):
+        response = client.post("/export/cancel?uuid=123456")
+        assert response.status_code == 403
+        assert not mock_cancel.called
+    with patch("isb_web.auth.orcid_id_from_session_or_scope", return_value="0000-0000-0000-0000"):
+        response = client.post("/export/cancel?uuid=123456")
+        assert response.status_code == 202
+        assert mock_cancel.called
+        mock_cancel.return_value = False
+        response = client.post("/export/cancel?uuid=123456")
+        assert response.status_code == 409
+
+
+@patch("isb_web.sqlmodel_database.cancel_export_job", return_value=True)
+@patch("isb_web.sqlmodel_database.export_job_with_uuid")
+def test_export_cancel_sitemap(mock_database: MagicMock, mock_cancel: MagicMock, client: TestClient):
+    job = ExportJob()
+    job.creator_id = "0000-0000-0000-0000"
+    job.is_sitemap = True
+    mock_database.return_value = job
+    with patch("isb_web.auth.orcid_id_from_session_or_scope", return_value="0000-0000-0000-0000"):
+        response = client.post("/export/cancel?uuid=123456")
+        assert response.status_code == 409
+        assert not mock_cancel.called
+
+
+def test_tracked():
+    cancelled = threading.Event()
+    progress = isb_web.export.ExportProgress()
+    docs = isb_web.export._tracked(iter([{"id": "1"}, {"id": "2"}]), cancelled, progress)
+    assert next(docs) == {"id": "1"}
+    assert progress.rows_written == 1
+    cancelled.set()
+    with pytest.raises(isb_web.export.ExportCancelledException):
+        next(docs)
+    assert progress.rows_written == 1
+
+
+def _run_cancelled_export(tmp_path, owned: bool) -> MagicMock:
+    export_job = ExportJob()
+    export_job.uuid = "123456"
+    export_job.worker_id = "worker1"
+    export_job.export_format = TargetExportFormat.JSONL.value
+    export_job.solr_query_params = [["q", "*:*"]]
+    export_job.is_sitemap = False
+    dest_path_no_extension = str(tmp_path / "123456")
+    with open(f"{dest_path_no_extension}.jsonl", "w") as partial_file:
+        partial_file.write("{}\n")
+    with patch("isb_web.export.dao"), \
+            patch("isb_web.sqlmodel_database.export_job_with_uuid", return_value=export_job), \
+            patch("isb_web.sqlmodel_database.save_or_update_export_job"), \
+            patch("isb_web.sqlmodel_database.finish_export_job", return_value=owned) as mock_finish, \
+            patch("isb_web.export._solr_index_version_or_none", return_value=None), \
+            patch("isb_web.export._solr_num_found_or_none", return_value=None), \
+            patch("isb_web.export._export_output_path", return_value=dest_path_no_extension), \
+            patch("isb_web.export._export_partition", side_effect=isb_web.export.ExportCancelledException()):
+        isb_web.export.search_solr_and_export_results("123456", threading.Event(), worker_id="worker1")
+    return mock_finish
+
+
+def test_export_cancelled(tmp_path):
+    mock_finish = _run_cancelled_export(tmp_path, owned=True)
+    assert mock_finish.call_args.args[2] == "worker1"
+    assert mock_finish.call_args.args[3] == {"error": sqlmodel_database.EXPORT_JOB_CANCELLED}
+    assert not (tmp_path / "123456.jsonl").exists()
+
+
+def test_export_stopped_after_reclaim(tmp_path):
+    # Another worker claimed the job after this one's heartbeat went stale, so its files belong to that worker now
+    mock_finish = _run_cancelled_export(tmp_path, owned=False)
+    assert mock_finish.called
+    assert (tmp_path / "123456.jsonl").exists()
+
+
+def test_export_progress_bytes_written(tmp_path):
+    progress = isb_web.export.ExportProgress()
+    assert progress.bytes_written() == 0
+    progress.dest_path_no_extension = str(tmp_path / "export")
+    (tmp_path / "export-part0.csv").write_text("id\n1\n")
+    (tmp_path / "export-part1.csv").write_text("2\n")
+    (tmp_path / "other.csv").write_text("3\n")
+    assert progress.bytes_written() == 7
+    # sitemaps are written to a directory
+    progress.dest_path_no_extension = str(tmp_path)
+    assert progress.bytes_written() == 9
+    # that's shared with the earlier sitemaps, which aren't counted
+    earlier_sitemap = tmp_path / "sitemap-0.jsonl"
+    earlier_sitemap.write_text("{}\n")
+    os.utime(earlier_sitemap, (progress._started - 60, progress._started - 60))
+    assert progress.bytes_written() == 9
+
+
+def _started_export_job(rows_written: int) -> ExportJob:
+    job = ExportJob()
+    job.tstarted = datetime.datetime(2024, 1, 1, 12, 0, 0)
+    job.heartbeat = datetime.datetime(2024, 1, 1, 12, 0, 10)
+    job.expected_rows = 1000
+    job.rows_written = rows_written
+    job.bytes_written = rows_written * 100
+    return job
+
+
+def test_export_progress():
+    progress = isb_web.export._export_progress(_started_export_job(250))
+    assert progress == {
+        "expected_rows": 1000,
+        "rows_written": 250,
+        "bytes_written": 25000,
+        "rows_per_second": 25.0,
+        "eta_seconds": 30.0,
+    }
+    # nothing written yet, so no rate to estimate from
+    progress = isb_web.export._export_progress(_started_export_job(0))
+    assert progress["rows_per_second"] is None
+    assert progress["eta_seconds"] is None
+
+
+@patch("isb_web.sqlmodel_database.export_job_with_uuid")
+def test_export_status_progress(mock_database: MagicMock, client: TestClient):
+    mock_database.return_value = _started_export_job(250)
+    response = client.get("/export/status?uuid=123456")
+    assert response.status_code == 202
+    assert response.json()["progress"]["eta_seconds"] == 30.0
+
+
+@patch("isb_web.sqlmodel_database.export_job_with_uuid")
+def test_export_status_wait(mock_database: MagicMock, client: TestClient, monkeypatch):
+    job = _started_export_job(250)
+    progressed_job = _started_export_job(500)
+    progressed_job.heartbeat = datetime.datetime(2024, 1, 1, 12, 0, 20)
+    # the first lookup, then one per check
+    mock_database.side_effect = [job, job, progressed_job, progressed_job]
+    session = MagicMock()
+    session.__enter__.return_value = session
+    dao = MagicMock()
+    dao.get_session.return_value = session
+    monkeypatch.setenv("EXPORT_STATUS_CHECK_INTERVAL_SECONDS", "0")
+    with patch.object(isb_web.export, "dao", dao):
+        response = client.get("/export/status?uuid=123456&wait=10")
+    # returns as soon as the progress changes
+    assert mock_database.call_count == 3
+    assert response.status_code == 202
+    assert response.json()["progress"]["rows_written"] == 500
+    # each check gets its own session rather than holding one open for the whole wait
+    assert dao.get_session.call_count == 3
+
+
+@patch("isb_web.sqlmodel_database.export_job_with_uuid")
+def test_export_status_events(mock_database: MagicMock, client: TestClient, monkeypatch):
+    job = _started_export_job(250)
+    completed_job = _started_export_job(1000)
+    completed_job.tcompleted = datetime.datetime(2024, 1, 1, 12, 1, 0)
+    # looked up when the request arrives, which is the first event, then once per check
+    mock_database.side_effect = [job, completed_job]
+    session = MagicMock()
+    session.__enter__.return_value = session
+    dao = MagicMock()
+    dao.get_session.return_value = session
+    monkeypatch.setenv("EXPORT_STATUS_CHECK_INTERVAL_SECONDS", "0")
+    with patch.object(isb_web.export, "dao", dao):
+        response = client.get("/export/status/events?uuid=123456")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    # sent as they happen rather than buffered by the compressor
+    assert "content-encoding" not in response.headers
+    events = [json.loads(line[len("data: "):]) for line in response.text.splitlines() if line.startswith("data: ")]
+    assert [event["status"] for event in events] == ["started", "completed"]
+    assert events[-1]["progress"]["rows_written"] == 1000
+    # each check gets its own session rather than holding one open for the whole stream
+    assert dao.get_session.call_count == 2
+
+
+def test_partition_params():
+    params = {"q": "*:*", "fq": "source:SESAR", "fl": "id"}
+    assert isb_web.export._partition_params(params, 0, 1) == params
+    partition_params = isb_web.export._partition_params(params, 2, 4)
+    assert partition_params["fq"] == ["source:SESAR", "{!hash workers=4 worker=2}"]
+    assert partition_params["partitionKeys"] == "id"
+    assert params["fq"] == "source:SESAR"
+
+
+def test_num_partitions():
+    params = {"q": "*:*", "fl": "id,source"}
+    rows_per_partition = isb_web.config.Settings().export_rows_per_partition
+    assert isb_web.export._num_partitions(10, params, TargetExportFormat.JSONL) == 1
+    assert isb_web.export._num_partitions(rows_per_partition * 2 + 1, params, TargetExportFormat.JSONL) == 3
+    assert isb_web.export._num_partitions(rows_per_partition * 100, params, TargetExportFormat.JSONL) == isb_web.config.Settings().export_max_partitions
+    # The size couldn't be estimated
+    assert isb_web.export._num_partitions(None, params, TargetExportFormat.JSONL) == 1
+    # CSV partitions need the columns spelled out
+    assert isb_web.export._num_partitions(rows_per_partition * 2, {"q": "*:*", "fl": "id,*_ss"}, TargetExportFormat.CSV) == 1
+
+
+def test_export_partitioned(tmp_path):
+    def fake_export_partition(params, export_format, dest_path_no_extension, fields=None, compression=None,
+                              csv_header=True, cancelled=None, progress=None, stopped=None):
+        assert fields == ["id", "source"]
+        worker = params["fq"][-1]
+        with open(f"{dest_path_no_extension}.csv", "w") as part_file:
+            if csv_header:
+                part_file.write("id,source\n")
+            part_file.write(f"{worker},SESAR\n")
+        return [f"{dest_path_no_extension}.csv"], 1
+
+    params = {"q": "*:*", "fl": "id,source"}
+    with patch("isb_web.export._export_partition", side_effect=fake_export_partition):
+        dest_path, num_rows = isb_web.export._export_partitioned(params, TargetExportFormat.CSV, str(tmp_path / "export"), 2)
+    assert num_rows == 2
+    with open(dest_path) as dest_file:
+        assert dest_file.read() == "id,source\n{!hash workers=2 worker=0},SESAR\n{!hash workers=2 worker=1},SESAR\n"
+    assert [path.name for path in tmp_path.iterdir()] == ["export.csv"]
+
+
+def test_export_partitioned_compressed(tmp_path):
+    def fake_export_partition(params, export_format, dest_path_no_extension, fields=None, compression=None,
+                              csv_header=True, cancelled=None, progress=None, stopped=None):
+        dest_path = f"{dest_path_no_extension}.csv.gz"
+        with gzip.open(dest_path, "wt") as part_file:
+            if csv_header:
+                part_file.write("id,source\n")
+            part_file.write(f"{params['fq'][-1]},SESAR\n")
+        return [dest_path], 1
+
+    params = {"q": "*:*", "fl": "id,source"}
+    with patch("isb_web.export._export_partition", side_effect=fake_export_partition):
+        dest_path, num_rows = isb_web.export._export_partitioned(
+            params, TargetExportFormat.CSV, str(tmp_path / "export"), 2, ExportCompression.GZIP
+        )
+    assert dest_path == str(tmp_path / "export.csv.gz")
+    with gzip.open(dest_path, "rt") as dest_file:
+        assert dest_file.read() == "id,source\n{!hash workers=2 worker=0},SESAR\n{!hash workers=2 worker=1},SESAR\n"
+
+
+def test_export_partitioned_failed(tmp_path):
+    def fake_export_partition(params, export_format, dest_path_no_extension, fields=None, compression=None,
+                              csv_header=True, cancelled=None, progress=None, stopped=None):
+        if params["fq"][-1] == "{!hash workers=3 worker=0}":
+            raise ValueError("solr went away")
+        # the other partitions run until they're stopped
+        with open(f"{dest_path_no_extension}.csv", "w") as part_file:
+            part_file.write("id,source\n")
+            docs = isb_web.export._tracked(itertools.repeat({"id": "1"}), cancelled, progress, stopped)
+            for _ in docs:
+                time.sleep(0.001)
+        return [f"{dest_path_no_extension}.csv"], 1
+
+    params = {"q": "*:*", "fl": "id,source"}
+    with patch("isb_web.export._export_partition", side_effect=fake_export_partition):
+        with pytest.raises(ValueError):
+            isb_web.export._export_partitioned(params, TargetExportFormat.CSV, str(tmp_path / "export"), 3)
+    # the partitions have all stopped, and their files are gone
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_export_create_columnar_compression_unsupported(client: TestClient):
+    response = client.get("/export/create?export_format=PARQUET&compression=gzip")
+    assert response.status_code == 400
+
+
+def test_accepts_encoding():
+    assert isb_web.export._accepts_encoding("gzip, deflate, br", "gzip")
+    assert isb_web.export._accepts_encoding("br;q=1.0, zstd;q=0.5", "zstd")
+    assert isb_web.export._accepts_encoding("*", "zstd")
+    assert not isb_web.export._accepts_encoding("gzip;q=0, *", "gzip")
+    assert not isb_web.export._accepts_encoding("deflate, br", "gzip")
+    assert not isb_web.export._accepts_encoding(None, "gzip")
+
+
+@patch("isb_web.sqlmodel_database.export_job_with_uuid")
+def test_export_download_compressed(mock_database: MagicMock, client: TestClient, tmp_path):
+    contents = b"id,source\r\nark:/123,SESAR\r\n"
+    file_path = tmp_path / "export.csv.gz"
+    with gzip.open(file_path, "wb") as compressed_file:
+        compressed_file.write(contents)
+    job = ExportJob()
+    job.file_path = str(file_path)
+    mock_database.return_value = job
+    response = client.get("/export/download?uuid=123456", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["content-type"].startswith("text/csv")
+    assert 'filename="export.csv"' in response.headers["content-disposition"]
+    # the client transparently decodes the body
+    assert response.content == contents
+    response = client.get("/export/download?uuid=123456", headers={"Accept-Encoding": "identity"})
+    assert response.status_code == 200
+    assert "content-encoding" not in response.headers
+    assert response.content == contents
+    assert response.headers["accept-ranges"] == "none"
+
+
+def _export_job_with_file(mock_database: MagicMock, file_path, contents: bytes):
+    file_path.write_bytes(contents)
+    job = ExportJob()
+    job.file_path = str(file_path)
+    mock_database.return_value = job
+
+
+@patch("isb_web.sqlmodel_database.export_job_with_uuid")
+def test_export_download_range(mock_database: MagicMock, client: TestClient, tmp_path):
+    contents = b"".join(f'{{"id": "ark:/{i}"}}\n'.encode() for i in range(1000))
+    _export_job_with_file(mock_database, tmp_path / "export.jsonl", contents)
+    response = client.get("/export/download?uuid=123456", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["accept-ranges"] == "bytes"
+    # the file is served as is, so that byte positions refer to it
+    assert "content-encoding" not in response.headers
+    assert response.content == contents
+    etag = response.headers["etag"]
+    response = client.get("/export/download?uuid=123456", headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes 100-199/{len(contents)}"
+    assert response.headers["content-length"] == "100"
+    assert response.headers["etag"] == etag
+    assert response.content == contents[100:200]
+    response = client.get("/export/download?uuid=123456", headers={"Range": "bytes=-10", "If-Range": etag})
+    assert response.status_code == 206
+    assert response.content == contents[-10:]
+    # a range of a different version of the file is answered with all of it
+    response = client.get("/export/download?uuid=123456", headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert response.status_code == 200
+    assert response.content == contents
+    response = client.get("/export/download?uuid=123456", headers={"Range": f"bytes={len(contents)}-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(contents)}"
+    response = client.get("/export/download?uuid=123456", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+
+@patch("isb_web.sqlmodel_database.export_job_with_uuid")
+def test_export_download_compressed_range(mock_database: MagicMock, client: TestClient, tmp_path):
+    compressed_contents = gzip.compress(b"id,source\r\n" + b"ark:/123,SESAR\r\n" * 100)
+    _export_job_with_file(mock_database, tmp_path / "export.csv.gz", compressed_contents)
+    # ranges are of the compressed file
+    response = client.get(
+        "/export/download?uuid=123456", headers={"Accept-Encoding": "gzip", "Range": "bytes=0-9"}
+    )
+    assert response.status_code == 206
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["content-range"] == f"bytes 0-9/{len(compressed_contents)}"
+    assert response.headers["content-length"] == "10"
+    gzip_etag = response.headers["etag"]
+    # the decompressed stream can't be ranged
+    response = client.get(
+        "/export/download?uuid=123456", headers={"Accept-Encoding": "identity", "Range": "bytes=0-9"}
+    )
+    assert response.status_code == 200
+    assert response.headers["accept-ranges"] == "none"
+    assert response.headers.get("etag") != gzip_etag
+
+
+@patch("isb_web.sqlmodel_database.export_job_with_uuid")
+def test_export_download_empty(mock_database: MagicMock, client: TestClient, tmp_path):
+    _export_job_with_file(mock_database, tmp_path / "export.csv", b"")
+    response = client.get("/export/download?uuid=123456")
+    assert response.status_code == 204
@@ -0,0 +1,87 @@
+import concurrent.futures
+import threading
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+from isb_lib.models.export_job import ExportJob
+from isb_web.export import ExportProgress
+from isb_web.export_worker import ExportWorker
+
+
+def _export_job(job_uuid: str) -> ExportJob:
+    export_job = ExportJob()
+    export_job.uuid = job_uuid
+    export_job.attempts = 1
+    return export_job
+
+
+@pytest.fixture(name="executor")
+def executor_fixture():
+    executor = concurrent.futures.ThreadPoolExecutor(2)
+    yield executor
+    executor.shutdown(wait=True)
+
+
+@pytest.fixture(name="finish_jobs")
+def finish_jobs_fixture():
+    # The fake jobs run until this is set, or until they're cancelled
+    finish_jobs = threading.Event()
+    yield finish_jobs
+    finish_jobs.set()
+
+
+def _fake_export(finish_jobs: threading.Event):
+    def fake_export(export_job_id: str, cancelled: threading.Event, progress: ExportProgress, worker_id: str):
+        progress.add_row()
+        while not finish_jobs.is_set() and not cancelled.is_set():
+            finish_jobs.wait(0.01)
+    return fake_export
+
+
+@patch("isb_web.sqlmodel_database.heartbeat_export_job", return_value=True)
+@patch("isb_web.sqlmodel_database.claim_next_export_job")
+def test_poll_claims_up_to_concurrency(mock_claim: MagicMock, mock_heartbeat: MagicMock, executor, finish_jobs):
+    mock_claim.side_effect = [_export_job("1"), _export_job("2"), _export_job("3"), None]
+    worker = ExportWorker(MagicMock(), 2, 1, 60, 3, "worker1")
+    with patch("isb_web.export.search_solr_and_export_results", side_effect=_fake_export(finish_jobs)) as mock_export:
+        worker.poll(MagicMock(), executor)
+        assert sorted(worker._running.keys()) == ["1", "2"]
+        assert mock_claim.call_count == 2
+        assert mock_claim.call_args.args[1] == "worker1"
+        # the jobs are only completed while this worker still owns them
+        assert mock_export.call_args.args[3] == "worker1"
+        # Full, so nothing more is claimed
+        worker.poll(MagicMock(), executor)
+        assert mock_claim.call_count == 2
+        assert mock_heartbeat.call_count == 2
+        # the jobs' progress is recorded with their heartbeat
+        assert mock_heartbeat.call_args.args[3] == 1
+        finish_jobs.set()
+        for future, _, _ in list(worker._running.values()):
+            future.result()
+        # The finished jobs are forgotten, and a new one claimed in their place
+        worker.poll(MagicMock(), executor)
+        assert list(worker._running.keys()) == ["3"]
+
+
+@patch("isb_web.sqlmodel_database.heartbeat_export_job", return_value=False)
+@patch("isb_web.sqlmodel_database.claim_next_export_job")
+def test_poll_cancels_jobs_failing_heartbeat(mock_claim: MagicMock, mock_heartbeat: MagicMock, executor, finish_jobs):
+    mock_claim.side_effect = [_export_job("1"), None, None]
+    worker = ExportWorker(MagicMock(), 2, 1, 60, 3, "worker1")
+    with patch("isb_web.export.search_solr_and_export_results", side_effect=_fake_export(finish_jobs)):
+        worker.poll(MagicMock(), executor)
+        future, cancelled, _ = worker._running["1"]
+        assert not cancelled.is_set()
+        worker.poll(MagicMock(), executor)
+        assert cancelled.is_set()
+        future.result(timeout=5)
+
+
+@patch("isb_web.sqlmodel_database.heartbeat_export_job", return_value=True)
+@patch("isb_web.sqlmodel_database.claim_next_export_job")
+def test_poll_without_claiming(mock_claim: MagicMock, mock_heartbeat: MagicMock, executor):
+    worker = ExportWorker(MagicMock(), 2, 1, 60, 3)
+    worker.poll(MagicMock(), executor, claim=False)
+    assert not mock_claim.called
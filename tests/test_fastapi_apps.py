@@ -10,6 +10,8 @@ from sqlmodel.pool import StaticPool
 
 
 from isb_lib.models import thing
+from isb_lib.utilities.vector_tile import MEDIA_MVT, VectorTileLayer
+from isb_web import tiles
 from isb_web.main import get_session, app, manage_app
 
 
@@ -213,6 +215,39 @@ def test_get_thing_core_format(client: TestClient, session: Session):
     assert data.get("label") is not None
 
 
+def test_get_thing_not_modified(client: TestClient, session: Session):
+    response = client.get(f"/thing/{TEST_IGSN}")
+    etag = response.headers["ETag"]
+    assert response.headers.get("Last-Modified") is not None
+    not_modified_response = client.get(f"/thing/{TEST_IGSN}", headers={"If-None-Match": etag})
+    assert not_modified_response.status_code == 304
+    assert not_modified_response.headers["ETag"] == etag
+    assert len(not_modified_response.content) == 0
+
+
+def test_get_thing_etag_differs_by_format(client: TestClient, session: Session):
+    etag = client.get(f"/thing/{TEST_IGSN}").headers["ETag"]
+    core_etag = client.get(f"/thing/{TEST_IGSN}?format=core").headers["ETag"]
+    assert etag != core_etag
+    response = client.get(f"/thing/{TEST_IGSN}?format=core", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+
+
+def test_get_thing_etag_differs_by_profile(client: TestClient, session: Session):
+    etag = client.get(f"/thing/{TEST_IGSN}?format=full").headers["ETag"]
+    source_etag = client.get(f"/thing/{TEST_IGSN}?format=full&_profile=source").headers["ETag"]
+    assert etag != source_etag
+    response = client.get(f"/thing/{TEST_IGSN}?format=full&_profile=source", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+
+
+def test_get_thing_page_not_modified(client: TestClient, session: Session):
+    response = client.get(f"/thingpage/{TEST_IGSN}")
+    last_modified = response.headers["Last-Modified"]
+    not_modified_response = client.get(f"/thingpage/{TEST_IGSN}", headers={"If-Modified-Since": last_modified})
+    assert not_modified_response.status_code == 304
+
+
 def test_get_thing_list_metadata(client: TestClient, session: Session):
     response = client.get("/thing")
     data = response.json()
@@ -235,6 +270,48 @@ def test_get_things_for_sitemap(client: TestClient, session: Session):
     assert response_data[0]["id"] == TEST_IGSN
 
 
+def test_thing_list_cursor(client: TestClient, session: Session):
+    second_thing = _test_model()
+    second_thing.id = "IGSN:654321"
+    session.add(second_thing)
+    session.commit()
+    response = client.get("/thing/", params={"limit": 1})
+    data = response.json()
+    assert len(data["data"]) == 1
+    assert data["next_cursor"] is not None
+    next_response = client.get("/thing/", params={"limit": 1, "cursor": data["next_cursor"]})
+    assert next_response.status_code == 200
+    assert next_response.json()["data"][0]["id"] != data["data"][0]["id"]
+    mismatched_response = client.get("/thing/", params={"limit": 1, "cursor": data["next_cursor"], "status": 404})
+    assert mismatched_response.status_code == 400
+    invalid_response = client.get("/thing/", params={"limit": 1, "cursor": "not a cursor"})
+    assert invalid_response.status_code == 400
+
+
+def test_stream_things_for_sitemap(client: TestClient, session: Session):
+    response = client.request("POST", "/things/stream", json={"identifiers": [TEST_IGSN, "6666666"]})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = response.text.splitlines()
+    assert len(lines) == 1
+    row = json.loads(lines[0])
+    assert row["id"] == TEST_IGSN
+    assert row["resolved_content"] is not None
+
+
+def test_stream_things_for_sitemap_fields(client: TestClient, session: Session):
+    response = client.request(
+        "POST", "/things/stream", json={"identifiers": [TEST_IGSN], "fields": ["id", "tstamp"]}
+    )
+    row = json.loads(response.text.splitlines()[0])
+    assert set(row.keys()) == {"id", "tstamp"}
+
+
+def test_stream_things_for_sitemap_unknown_field(client: TestClient, session: Session):
+    response = client.request("POST", "/things/stream", json={"identifiers": [TEST_IGSN], "fields": ["foo"]})
+    assert response.status_code == 400
+
+
 def test_manage_logout(manage_client: TestClient, session: Session):
     headers = {
         "authorization": "Bearer 123456"
@@ -303,3 +380,30 @@ def test_solr_select_post_with_slash(mock_solr_query: MagicMock, client: TestCli
 def test_solr_stream(mock_solr_query: MagicMock, client: TestClient, session: Session):
     response = client.get("/thing/stream")
     _assert_on_solr_response(mock_solr_query, response)
+
+
+def _tile_layer(z: int, x: int, y: int, q: str) -> VectorTileLayer:
+    layer = VectorTileLayer(tiles.POINTS_LAYER_NAME, z, x, y)
+    layer.add_point(-122.26, 37.87, {"id": "ark:/123", "source": "SESAR"})
+    return layer
+
+
+@patch("isb_web.tiles._points_layer", side_effect=_tile_layer)
+@patch("isb_web.isb_solr_query.current_index_version", return_value="1")
+def test_get_tile(mock_index_version: MagicMock, mock_points_layer: MagicMock, client: TestClient):
+    tiles._encoded_tile.cache_clear()
+    response = client.get("/tiles/10/163/395.mvt")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == MEDIA_MVT
+    assert b"ark:/123" in response.content
+    # The tile is cached until the solr index changes
+    client.get("/tiles/10/163/395.mvt")
+    assert mock_points_layer.call_count == 1
+    mock_index_version.return_value = "2"
+    client.get("/tiles/10/163/395.mvt")
+    assert mock_points_layer.call_count == 2
+
+
+def test_get_tile_out_of_range(client: TestClient):
+    response = client.get("/tiles/2/4/0.mvt")
+    assert response.status_code == 404
@@ -0,0 +1,64 @@
+import os
+import uuid
+
+import h3
+
+from isb_lib.utilities import h3_utilities
+from isb_lib.utilities.h3_utilities import H3GeometryTable
+
+# Resolution 0 cell that straddles the antimeridian and is split into two features
+ANTIMERIDIAN_CELL = "8003fffffffffff"
+TEST_CELL = "831c02fffffffff"
+
+
+def test_h3_to_features_split_on_antimeridian():
+    features = h3_utilities.h3_to_features(ANTIMERIDIAN_CELL, {"n": 5})
+    assert len(features) == 2
+    for feature in features:
+        assert feature["properties"]["h3"] == ANTIMERIDIAN_CELL
+        assert feature["properties"]["n"] == 5
+        assert feature["properties"]["km2"] > 0
+
+
+def test_cell_geometry_is_memoized():
+    h3_utilities.cell_geometry.cache_clear()
+    first = h3_utilities.cell_geometry(TEST_CELL)
+    second = h3_utilities.cell_geometry(TEST_CELL)
+    assert first is second
+    assert h3_utilities.cell_geometry.cache_info().hits == 1
+
+
+def test_cached_features_match_computed():
+    geometries, km2 = h3_utilities._compute_cell_geometry(TEST_CELL)
+    features = h3_utilities.h3_to_features(TEST_CELL)
+    assert [feature["geometry"]["coordinates"] for feature in features] == [
+        [[list(coordinate) for coordinate in ring] for ring in geometry["coordinates"]] for geometry in geometries
+    ]
+    assert features[0]["properties"]["km2"] == km2
+
+
+def test_h3_geometry_table():
+    path = f"/tmp/h3_geometry_{uuid.uuid4()}.sqlite"
+    try:
+        num_written = H3GeometryTable.build(path, max_resolution=0)
+        assert num_written == len(h3.get_res0_cells())
+        table = H3GeometryTable(path)
+        geometries, km2 = table.cell_geometry(ANTIMERIDIAN_CELL)
+        assert len(geometries) == 2
+        assert km2 == h3.cell_area(ANTIMERIDIAN_CELL, unit="km^2")
+        assert table.cell_geometry(TEST_CELL) is None
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def test_h3s_to_feature_collection():
+    feature_collection = h3_utilities.h3s_to_feature_collection({TEST_CELL}, {TEST_CELL: {"n": 1}})
+    assert len(feature_collection["features"]) == 1
+    assert feature_collection["features"][0]["properties"]["n"] == 1
+
+
+def test_canonical_h3_count_query():
+    assert h3_utilities.canonical_h3_count_query(None) == "*:*"
+    assert h3_utilities.canonical_h3_count_query("  ") == "*:*"
+    assert h3_utilities.canonical_h3_count_query(" source:SESAR   AND  foo ") == "source:SESAR AND foo"
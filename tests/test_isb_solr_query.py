@@ -1,7 +1,95 @@
-from isb_web.isb_solr_query import _solr_heatmap_geom_params_str, MIN_LAT, MAX_LAT, MIN_LON, MAX_LON
+import json
+from unittest.mock import patch, MagicMock
+
+import fastapi
+import requests
+
+from isb_web.isb_solr_query import _solr_heatmap_geom_params_str, MIN_LAT, MAX_LAT, MIN_LON, MAX_LON, \
+    canonical_select_params, is_cacheable_select, solr_cursor_ndjson, cached_solr_query
 
 
 def test_solr_heat_geom_params_str():
     bb = {MIN_LAT: -90.0, MAX_LAT: 90.0, MIN_LON: -180.0, MAX_LON: 180.0}
     params_str = _solr_heatmap_geom_params_str(bb)
     assert "[-180.0 -90.0 TO 180.0 90.0]" == params_str
+
+
+def test_canonical_select_params():
+    params = [["q", "*:*"], ["fq", "source:SESAR"], ["fq", "hasMaterialCategory:Rock"], ["rows", 0]]
+    reordered = [["rows", 0], ["fq", "hasMaterialCategory:Rock"], ["q", "*:*"], ["fq", "source:SESAR"]]
+    assert canonical_select_params(params) == canonical_select_params(reordered)
+    assert canonical_select_params(params) != canonical_select_params(params[:-1])
+
+
+def test_is_cacheable_select():
+    assert is_cacheable_select([["q", "*:*"], ["rows", "0"], ["facet", "true"]])
+    assert is_cacheable_select([["q", "*:*"]])
+    assert not is_cacheable_select([["q", "*:*"], ["cursorMark", "*"]])
+    assert not is_cacheable_select([["q", "*:*"], ["rows", "100000"]])
+
+
+@patch("isb_web.isb_solr_query.solr_query")
+@patch("isb_web.isb_solr_query.current_index_version", return_value="1")
+def test_cached_solr_query(mock_index_version: MagicMock, mock_solr_query: MagicMock):
+    mock_solr_query.return_value = fastapi.responses.Response(content=b'{"response": {}}', media_type="application/json")
+    params = [["q", "test_cached_solr_query"], ["rows", "0"]]
+    response = cached_solr_query(params)
+    assert response.body == b'{"response": {}}'
+    assert mock_solr_query.call_args.kwargs["buffered"]
+    # Reused until the index changes
+    cached_solr_query(params)
+    assert mock_solr_query.call_count == 1
+    mock_index_version.return_value = "2"
+    cached_solr_query(params)
+    assert mock_solr_query.call_count == 2
+
+
+@patch("isb_web.isb_solr_query.solr_query")
+@patch("isb_web.isb_solr_query.current_index_version", side_effect=requests.ConnectionError())
+def test_cached_solr_query_without_index_version(mock_index_version: MagicMock, mock_solr_query: MagicMock):
+    params = [["q", "test_cached_solr_query_without_index_version"], ["rows", "0"]]
+    assert cached_solr_query(params) == mock_solr_query.return_value
+    # The query is sent as is, uncached
+    mock_solr_query.assert_called_once_with(params)
+
+
+class _CursorResponse:
+    def __init__(self, response_dict: dict):
+        self.response_dict = response_dict
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.response_dict
+
+
+class _CursorSession:
+    """Serves ids 0-4 in pages, the way solr does for a cursorMark query"""
+
+    def __init__(self):
+        self.requests: list[dict] = []
+
+    def get(self, url, headers, params):
+        params_dict = dict(params)
+        self.requests.append(params_dict)
+        start = 0 if params_dict["cursorMark"] == "*" else int(params_dict["cursorMark"])
+        docs = [{"id": str(i)} for i in range(start, min(5, start + params_dict["rows"]))]
+        next_cursor_mark = str(start + len(docs)) if len(docs) > 0 else params_dict["cursorMark"]
+        return _CursorResponse({"response": {"docs": docs}, "nextCursorMark": next_cursor_mark})
+
+
+def test_solr_cursor_ndjson():
+    rsession = _CursorSession()
+    lines = [json.loads(line) for line in solr_cursor_ndjson([["q", "*:*"], ["start", 10]], rows=2, rsession=rsession)]
+    assert [line["id"] for line in lines[:-1]] == ["0", "1", "2", "3", "4"]
+    assert lines[-1] == {"nextCursorMark": "5", "done": True}
+    assert all(request["sort"] == "id asc" and "start" not in request for request in rsession.requests)
+
+
+def test_solr_cursor_ndjson_max_rows():
+    lines = [json.loads(line) for line in solr_cursor_ndjson([["q", "*:*"]], rows=2, max_rows=3, rsession=_CursorSession())]
+    assert [line["id"] for line in lines[:-1]] == ["0", "1", "2"]
+    assert lines[-1] == {"nextCursorMark": "3", "done": False}
+    resumed = [json.loads(line) for line in solr_cursor_ndjson([["q", "*:*"]], "3", rows=2, rsession=_CursorSession())]
+    assert [line["id"] for line in resumed[:-1]] == ["3", "4"]
@@ -0,0 +1,25 @@
+import datetime
+import json
+
+import geojson
+
+from isb_web.json_responses import FastJSONResponse, ndjson_line
+
+
+def test_fast_json_response_matches_json():
+    content = geojson.FeatureCollection(
+        [geojson.Feature(geometry=geojson.Point((1.0, 2.0)), properties={"n": 3, "name": "café"})]
+    )
+    response = FastJSONResponse(content=content)
+    assert json.loads(response.body) == json.loads(json.dumps(content))
+
+
+def test_fast_json_response_datetime():
+    response = FastJSONResponse(content={"tstamp": datetime.datetime(2023, 1, 2, 3, 4, 5)})
+    assert json.loads(response.body) == {"tstamp": "2023-01-02T03:04:05"}
+
+
+def test_ndjson_line():
+    line = ndjson_line({"id": "ark:/1234"})
+    assert line.endswith(b"\n")
+    assert json.loads(line) == {"id": "ark:/1234"}
@@ -1,4 +1,9 @@
-from isb_web.metrics import PrometheusMetrics
+import time
+from unittest.mock import patch, MagicMock
+
+import requests
+
+from isb_web.metrics import MetricsRefresher, PrometheusMetrics
 
 
 def test_prometheus_metrics():
@@ -9,3 +14,85 @@ def test_prometheus_metrics():
     metrics.db_scrape_duration_seconds = 10.0
     metrics_string = metrics.metrics_string()
     assert len(metrics_string) > 0
+
+
+def test_prometheus_metrics_select_cache():
+    metrics = PrometheusMetrics()
+    metrics.solr_counts = {}
+    metrics.solr_scrape_duration_seconds = 5.0
+    metrics.db_counts = {}
+    metrics.db_scrape_duration_seconds = 10.0
+    metrics.select_cache_counts = {"hits": 3, "misses": 1, "coalesced": 2}
+    metrics_string = metrics.metrics_string()
+    assert "isamples_solr_select_cache_hits_total 3" in metrics_string
+    assert "isamples_solr_select_cache_coalesced_total 2" in metrics_string
+
+
+def test_prometheus_metrics_refresh():
+    metrics = PrometheusMetrics()
+    metrics.solr_counts = {"GEOME": 1}
+    metrics.solr_scrape_duration_seconds = 5.0
+    metrics.db_counts = {"GEOME": 2}
+    metrics.db_scrape_duration_seconds = 10.0
+    metrics.refresh_duration_seconds = 15.0
+    metrics.staleness_seconds = 30.0
+    metrics.refresh_failures = 1
+    metrics_string = metrics.metrics_string()
+    assert "isamples_metrics_refresh_duration_seconds 15.0" in metrics_string
+    assert "isamples_metrics_staleness_seconds 30.0" in metrics_string
+    assert "isamples_metrics_refresh_failures_total 1" in metrics_string
+
+
+@patch("isb_web.metrics.select_cache_counts", return_value={})
+@patch("isb_web.metrics.solr_counts_by_authority", return_value={"GEOME": 3})
+@patch("isb_web.metrics.things_by_authority_count_dict", return_value={"GEOME": 4})
+@patch("isb_web.metrics.dao")
+def test_metrics_refresher_refresh(mock_dao: MagicMock, mock_db_counts: MagicMock, mock_solr_counts: MagicMock,
+                                   mock_select_cache_counts: MagicMock):
+    refresher = MetricsRefresher(60)
+    refresher.refresh()
+    metrics = refresher.current_metrics()
+    assert metrics.db_counts == {"GEOME": 4}
+    assert metrics.solr_counts == {"GEOME": 3}
+    assert metrics.refresh_failures == 0
+    assert metrics.staleness_seconds is not None and metrics.staleness_seconds < 60
+    # Scrapes only read the refreshed values
+    refresher.current_metrics()
+    assert mock_solr_counts.call_count == 1
+
+
+@patch("isb_web.metrics.select_cache_counts", return_value={})
+@patch("isb_web.metrics.solr_counts_by_authority")
+@patch("isb_web.metrics.things_by_authority_count_dict")
+@patch("isb_web.metrics.dao")
+def test_metrics_refresher_before_first_refresh(mock_dao: MagicMock, mock_db_counts: MagicMock,
+                                                mock_solr_counts: MagicMock, mock_select_cache_counts: MagicMock):
+    refresher = MetricsRefresher(60)
+    refresher._created_time -= 30
+    metrics = refresher.current_metrics()
+    assert not mock_db_counts.called
+    assert not mock_solr_counts.called
+    assert metrics.db_counts == {}
+    assert metrics.solr_counts == {}
+    assert metrics.staleness_seconds is not None and metrics.staleness_seconds >= 30
+    assert "isamples_metrics_staleness_seconds" in metrics.metrics_string()
+
+
+@patch("isb_web.metrics.select_cache_counts", return_value={})
+@patch("isb_web.metrics.solr_counts_by_authority", side_effect=requests.ConnectionError())
+@patch("isb_web.metrics.things_by_authority_count_dict", return_value={"GEOME": 4})
+@patch("isb_web.metrics.dao")
+def test_metrics_refresher_counts_failures(mock_dao: MagicMock, mock_db_counts: MagicMock,
+                                           mock_solr_counts: MagicMock, mock_select_cache_counts: MagicMock):
+    refresher = MetricsRefresher(0.01)
+    refresher.start()
+    try:
+        deadline = time.time() + 5
+        while refresher.refresh_failures < 2 and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        refresher.stop()
+    metrics = refresher.current_metrics()
+    assert metrics.refresh_failures is not None and metrics.refresh_failures >= 2
+    # Nothing is served from a partially completed refresh
+    assert metrics.db_counts == {}
@@ -0,0 +1,51 @@
+import fastapi
+import sqlalchemy
+from fastapi.testclient import TestClient
+
+from isb_web import request_metrics
+from isb_web.request_metrics import Histogram, MetricsMiddleware
+
+
+def test_histogram_lines():
+    histogram = Histogram("test_duration_seconds", "A test histogram.", ["route"], [0.1, 1.0])
+    histogram.observe(0.05, "/a")
+    histogram.observe(0.5, "/a")
+    lines = histogram.lines()
+    assert 'test_duration_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'test_duration_seconds_bucket{route="/a",le="1.0"} 2' in lines
+    assert 'test_duration_seconds_bucket{route="/a",le="+Inf"} 2' in lines
+    assert 'test_duration_seconds_count{route="/a"} 2' in lines
+
+
+def test_metrics_middleware_labels_route_template():
+    app = fastapi.FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/thing/{identifier}")
+    def get_thing(identifier: str):
+        return {"id": identifier}
+
+    client = TestClient(app)
+    assert client.get("/thing/1234").status_code == 200
+    assert client.get("/not_a_route").status_code == 404
+    lines = request_metrics.metrics_lines()
+    assert any(line.startswith(
+        'isamples_http_request_duration_seconds_count{method="GET",route="/thing/{identifier}",status="200"}'
+    ) for line in lines)
+    assert any(line.startswith(
+        'isamples_http_request_duration_seconds_count{method="GET",route="unmatched",status="404"}'
+    ) for line in lines)
+    assert "isamples_http_requests_in_flight 0" in lines
+
+
+def test_instrument_engine():
+    engine = sqlalchemy.create_engine("sqlite://")
+    request_metrics.instrument_engine(engine)
+    # Instrumenting twice doesn't double count
+    request_metrics.instrument_engine(engine)
+    with engine.connect() as connection:
+        connection.execute(sqlalchemy.text("select 1"))
+    lines = request_metrics.metrics_lines()
+    assert any(line.startswith(
+        'isamples_upstream_call_duration_seconds_count{backend="db",operation="SELECT"}'
+    ) for line in lines)
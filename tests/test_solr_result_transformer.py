@@ -1,15 +1,22 @@
+import gzip
 import json
 import os.path
 import shutil
+import typing
 import uuid
 
 import petl
+import pyarrow
+import pyarrow.ipc
+import pyarrow.parquet
 import pytest
 from jsonschema.validators import validate
 from petl import Table
 
 from isamples_metadata.metadata_constants import METADATA_SAMPLE_IDENTIFIER
-from isb_lib.utilities.solr_result_transformer import SolrResultTransformer, TargetExportFormat
+from isb_lib.utilities import solr_result_transformer
+from isb_lib.utilities.solr_result_transformer import SolrResultTransformer, StreamingSolrResultTransformer, \
+    TargetExportFormat, ColumnarExportTransformer, ExportTransformException, ExportCompression
 
 SOLR_items = [
     "./test_data/solr_results/test_solr_results.json",
@@ -86,3 +93,161 @@ def test_solr_result_transformer_jsonl_multiple_files(solr_file_path: str, isamp
     solr_result_transformer = SolrResultTransformer(table, TargetExportFormat.JSONL, dest_path_no_extension, False, True, 2)
     dest_paths = solr_result_transformer.transform()
     _validate_dest_paths(dest_paths, isamples_schema_json)
+
+
+def _solr_result_docs(solr_file_path: str) -> typing.Iterator[dict]:
+    with open(solr_file_path, "r") as file:
+        solr_result_dict: dict = json.load(file)
+    # A generator, like the docs parsed off of a solr /export response, so it can only be iterated once
+    return (doc for doc in solr_result_dict["result-set"]["docs"])
+
+
+@pytest.mark.parametrize("solr_file_path", SOLR_items)
+def test_streaming_solr_result_transformer_csv(solr_file_path: str, tmp_path):
+    table_dest_path = SolrResultTransformer(_solr_result_table(solr_file_path), TargetExportFormat.CSV, str(tmp_path / "table"), False).transform()[0]
+    streaming_transformer = StreamingSolrResultTransformer(_solr_result_docs(solr_file_path), TargetExportFormat.CSV, str(tmp_path / "streaming"))
+    dest_path = streaming_transformer.transform()[0]
+    assert streaming_transformer.num_rows == 10
+    with open(table_dest_path) as table_file, open(dest_path) as streaming_file:
+        assert streaming_file.read() == table_file.read()
+
+
+@pytest.mark.parametrize("solr_file_path", SOLR_items)
+def test_streaming_solr_result_transformer_jsonl(solr_file_path: str, isamples_schema_json: dict, tmp_path):
+    table_dest_path = SolrResultTransformer(_solr_result_table(solr_file_path), TargetExportFormat.JSONL, str(tmp_path / "table"), False).transform()[0]
+    streaming_transformer = StreamingSolrResultTransformer(_solr_result_docs(solr_file_path), TargetExportFormat.JSONL, str(tmp_path / "streaming"))
+    dest_paths = streaming_transformer.transform()
+    assert streaming_transformer.num_rows == 10
+    _validate_dest_paths(dest_paths, isamples_schema_json)
+    with open(table_dest_path) as table_file, open(dest_paths[0]) as streaming_file:
+        assert streaming_file.read() == table_file.read()
+
+
+@pytest.mark.parametrize("solr_file_path", SOLR_items)
+def test_streaming_solr_result_transformer_jsonl_multiple_files(solr_file_path: str, isamples_schema_json: dict, tmp_path):
+    streaming_transformer = StreamingSolrResultTransformer(_solr_result_docs(solr_file_path), TargetExportFormat.JSONL, str(tmp_path), True, 3)
+    dest_paths = streaming_transformer.transform()
+    assert streaming_transformer.num_rows == 10
+    assert [os.path.basename(dest_path) for dest_path in dest_paths] == [f"sitemap-{index}.jsonl" for index in range(4)]
+    line_counts = []
+    for dest_path in dest_paths:
+        with open(dest_path) as dest_file:
+            line_counts.append(len(dest_file.readlines()))
+    assert line_counts == [3, 3, 3, 1]
+    _validate_dest_paths(dest_paths, isamples_schema_json)
+
+
+def test_streaming_solr_result_transformer_no_docs(tmp_path):
+    streaming_transformer = StreamingSolrResultTransformer(iter([]), TargetExportFormat.JSONL, str(tmp_path / "empty"))
+    dest_paths = streaming_transformer.transform()
+    assert streaming_transformer.num_rows == 0
+    assert os.path.getsize(dest_paths[0]) == 0
+
+
+def _decompress(path: str, compression: ExportCompression) -> bytes:
+    with pyarrow.CompressedInputStream(path, compression.value) as compressed_file:
+        return compressed_file.read()
+
+
+@pytest.mark.parametrize("export_format", [TargetExportFormat.CSV, TargetExportFormat.JSONL])
+@pytest.mark.parametrize("compression", [ExportCompression.GZIP, ExportCompression.ZSTD])
+def test_streaming_solr_result_transformer_compressed(export_format: TargetExportFormat, compression: ExportCompression, tmp_path):
+    solr_file_path = SOLR_items[0]
+    uncompressed_path = StreamingSolrResultTransformer(_solr_result_docs(solr_file_path), export_format, str(tmp_path / "plain")).transform()[0]
+    streaming_transformer = StreamingSolrResultTransformer(_solr_result_docs(solr_file_path), export_format, str(tmp_path / "compressed"), compression=compression)
+    dest_path = streaming_transformer.transform()[0]
+    extension = os.path.splitext(uncompressed_path)[1]
+    assert dest_path == str(tmp_path / f"compressed{extension}.{compression.extension}")
+    assert ExportCompression.for_path(dest_path) == compression
+    with open(uncompressed_path, "rb") as uncompressed_file:
+        assert _decompress(dest_path, compression) == uncompressed_file.read()
+    if compression == ExportCompression.GZIP:
+        with gzip.open(dest_path, "rt") as gzip_file:
+            assert len(gzip_file.readlines()) == streaming_transformer.num_rows + (1 if export_format == TargetExportFormat.CSV else 0)
+
+
+def test_streaming_solr_result_transformer_csv_no_header(tmp_path):
+    solr_file_path = SOLR_items[0]
+    with_header_path = StreamingSolrResultTransformer(_solr_result_docs(solr_file_path), TargetExportFormat.CSV, str(tmp_path / "header")).transform()[0]
+    no_header_path = StreamingSolrResultTransformer(_solr_result_docs(solr_file_path), TargetExportFormat.CSV, str(tmp_path / "no_header"), csv_header=False).transform()[0]
+    with open(with_header_path) as with_header_file, open(no_header_path) as no_header_file:
+        assert no_header_file.readlines() == with_header_file.readlines()[1:]
+
+
+def test_export_compression():
+    assert ExportCompression("GZIP") == ExportCompression.GZIP
+    assert ExportCompression("Zstd") == ExportCompression.ZSTD
+    assert ExportCompression.for_path("/tmp/export.csv.gz") == ExportCompression.GZIP
+    assert ExportCompression.for_path("/tmp/export.jsonl.zst") == ExportCompression.ZSTD
+    assert ExportCompression.for_path("/tmp/export.csv") is None
+
+
+COLUMNAR_FIELDS = ["id", "source", "hasMaterialCategory", "hasMaterialCategoryConfidence",
+                   "producedBy_samplingSite_location_latitude", "sourceUpdatedTime", "curation_responsibility"]
+
+
+@pytest.mark.parametrize("solr_file_path", SOLR_items)
+def test_streaming_solr_result_transformer_parquet(solr_file_path: str, tmp_path, monkeypatch):
+    monkeypatch.setattr(solr_result_transformer, "COLUMNAR_BATCH_SIZE", 4)
+    streaming_transformer = StreamingSolrResultTransformer(_solr_result_docs(solr_file_path), TargetExportFormat.PARQUET, str(tmp_path / "export"), fields=COLUMNAR_FIELDS)
+    dest_path = streaming_transformer.transform()[0]
+    assert dest_path.endswith(".parquet")
+    assert streaming_transformer.num_rows == 10
+    parquet_file = pyarrow.parquet.ParquetFile(dest_path)
+    assert parquet_file.num_row_groups == 3
+    assert parquet_file.schema_arrow.names == [METADATA_SAMPLE_IDENTIFIER, "source_collection", "has_material_category", "hasMaterialCategoryConfidence", "latitude", "sourceUpdatedTime", "curation_responsibility"]
+    row_group = parquet_file.metadata.row_group(0)
+    encodings = {row_group.column(index).path_in_schema: row_group.column(index).encodings for index in range(row_group.num_columns)}
+    assert "RLE_DICTIONARY" in encodings["source_collection"]
+    assert "RLE_DICTIONARY" in encodings["has_material_category.list.element"]
+    assert "RLE_DICTIONARY" not in encodings[METADATA_SAMPLE_IDENTIFIER]
+    assert row_group.column(0).compression == "ZSTD"
+    table = parquet_file.read()
+    docs = list(_solr_result_docs(solr_file_path))
+    assert table.column(METADATA_SAMPLE_IDENTIFIER).to_pylist() == [doc["id"] for doc in docs]
+    assert table.column("has_material_category").to_pylist()[0] == docs[0]["hasMaterialCategory"]
+    assert table.column("latitude").to_pylist()[0] == docs[0]["producedBy_samplingSite_location_latitude"]
+    assert table.column("sourceUpdatedTime").to_pylist()[0].isoformat() == "2009-09-24T00:00:00+00:00"
+
+
+@pytest.mark.parametrize("solr_file_path", SOLR_items)
+def test_streaming_solr_result_transformer_arrow(solr_file_path: str, tmp_path):
+    streaming_transformer = StreamingSolrResultTransformer(_solr_result_docs(solr_file_path), TargetExportFormat.ARROW, str(tmp_path / "export"), fields=COLUMNAR_FIELDS)
+    dest_path = streaming_transformer.transform()[0]
+    assert dest_path.endswith(".arrow")
+    with pyarrow.ipc.open_file(dest_path) as reader:
+        table = reader.read_all()
+    assert table.num_rows == 10
+    assert table.schema.field("hasMaterialCategoryConfidence").type == pyarrow.list_(pyarrow.float64())
+
+
+def test_streaming_solr_result_transformer_columnar_requires_fields(tmp_path):
+    streaming_transformer = StreamingSolrResultTransformer(iter([]), TargetExportFormat.PARQUET, str(tmp_path / "export"))
+    with pytest.raises(ExportTransformException):
+        streaming_transformer.transform()
+
+
+@pytest.mark.parametrize("export_format", [TargetExportFormat.PARQUET, TargetExportFormat.ARROW])
+def test_columnar_concatenate(export_format: TargetExportFormat, tmp_path):
+    docs = list(_solr_result_docs(SOLR_items[0]))
+    part_paths = []
+    for index, part_docs in enumerate([docs[:6], docs[6:]]):
+        transformer = StreamingSolrResultTransformer(iter(part_docs), export_format, str(tmp_path / f"part{index}"), fields=COLUMNAR_FIELDS)
+        part_paths.append(transformer.transform()[0])
+    dest_path = str(tmp_path / "export")
+    ColumnarExportTransformer.concatenate(export_format, part_paths, dest_path)
+    if export_format == TargetExportFormat.PARQUET:
+        table = pyarrow.parquet.read_table(dest_path)
+        row_group = pyarrow.parquet.read_metadata(dest_path).row_group(0)
+        assert "RLE_DICTIONARY" in row_group.column(1).encodings
+    else:
+        with pyarrow.ipc.open_file(dest_path) as reader:
+            table = reader.read_all()
+    assert table.column(METADATA_SAMPLE_IDENTIFIER).to_pylist() == [doc["id"] for doc in docs]
+
+
+@pytest.mark.parametrize("solr_file_path", SOLR_items)
+def test_solr_result_transformer_parquet(solr_file_path: str, tmp_path):
+    table = _solr_result_table(solr_file_path)
+    dest_path = SolrResultTransformer(table, TargetExportFormat.PARQUET, str(tmp_path / "export"), False).transform()[0]
+    assert pyarrow.parquet.read_table(dest_path).num_rows == 10
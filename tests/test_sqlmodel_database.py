@@ -2,17 +2,20 @@ import datetime
 import random
 
 import pytest
+import sqlalchemy
 
 from isb_lib.models.export_job import ExportJob
 from isb_lib.models.namespace import Namespace
 from sqlalchemy.orm.attributes import flag_modified
-from sqlmodel import Session, SQLModel, create_engine
+from sqlmodel import Session, SQLModel, create_engine, select
 from sqlmodel.pool import StaticPool
 
 from isb_lib.core import ThingRecordIterator
 from isb_lib.models.taxonomy_name import TaxonomyName
 from isb_lib.models.thing import Thing, Point
+from isb_web import sqlmodel_database
 from isb_web.sqlmodel_database import (
+    THING_IDENTIFIERS_INDEX_NAME,
     get_thing_with_id,
     read_things_summary,
     last_time_thing_created,
@@ -25,7 +28,10 @@ from isb_web.sqlmodel_database import (
     h3_values_without_points, h3_to_height, all_thing_primary_keys, save_draft_thing_with_id, save_person_with_orcid_id,
     all_orcid_ids, mint_identifiers_in_namespace, save_or_update_namespace, save_taxonomy_name,
     taxonomy_name_to_kingdom_map, kingdom_for_taxonomy_name, get_thing_meta, things_by_authority_count_dict,
-    save_or_update_export_job, export_job_with_uuid,
+    save_or_update_export_job, export_job_with_uuid, finish_export_job, save_h3_counts, h3_counts_for_query,
+    materialized_h3_count_queries, get_thing_core_content, save_thing_core_content,
+    get_thing_tstamp_and_authority, iterate_things_with_ids, claim_next_export_job, heartbeat_export_job,
+    cancel_export_job,
 )
 from test_utils import _add_some_things
 
@@ -88,6 +94,31 @@ def test_read_things_with_things(session: Session):
     assert len(data) > 0
 
 
+def test_read_things_summary_keyset(session: Session):
+    _add_some_things(session, 5, "SESAR")
+    _, _, first_page = read_things_summary(session, 0, 2)
+    assert [thing.id for thing in first_page] == ["0", "1"]
+    _, _, second_page = read_things_summary(session, 0, 2, after_primary_key=first_page[-1].primary_key)
+    assert [thing.id for thing in second_page] == ["2", "3"]
+
+
+def test_read_things_summary_cached_count(session: Session):
+    _add_some_things(session, 3, "SESAR")
+    count, _, _ = read_things_summary(session, 0, 2, authority="SESAR", exact_count=False)
+    assert count == 3
+    mark_thing_not_found(session, "0", "http://foo.bar")
+    # The cached count is reused unless an exact count is requested
+    count, _, _ = read_things_summary(session, 0, 2, authority="SESAR", exact_count=False)
+    assert count == 3
+    count, _, _ = read_things_summary(session, 0, 2, authority="SESAR", exact_count=True)
+    assert count == 2
+    # Other filters are counted separately
+    count, _, _ = read_things_summary(session, 0, 2, status=404, authority="SESAR", exact_count=False)
+    assert count == 1
+    count, _, _ = read_things_summary(session, 0, 2, authority="OPENCONTEXT", exact_count=False)
+    assert count == 0
+
+
 last_time_thing_created_values = [("test", "test"), (None, "test")]
 
 
@@ -193,6 +224,8 @@ def test_thing_with_identifier(session: Session):
     thing_with_identifier = get_thing_with_id(session, test_id)
     assert thing_with_identifier is not None
     assert thing_id == thing_with_identifier.id
+    # Identifiers are matched exactly, not as substrings
+    assert get_thing_with_id(session, "ark:/1234") is None
 
 
 def _fetch_thing_identifiers(session: Session) -> set[str]:
@@ -578,3 +611,134 @@ def test_export_job_with_uuid(session: Session):
 def test_export_job_with_uuid_doesnt_exist(session: Session):
     shouldnt_exist = export_job_with_uuid(session, "foobar")
     assert shouldnt_exist is None
+
+
+def test_claim_next_export_job(session: Session):
+    first_export_job = _create_test_export_job(session)
+    second_export_job = _create_test_export_job(session)
+    orphaned_before = datetime.datetime.now() - datetime.timedelta(minutes=1)
+    claimed = claim_next_export_job(session, "worker1", orphaned_before, 3)
+    assert claimed.uuid == first_export_job.uuid
+    assert claimed.worker_id == "worker1"
+    assert claimed.tstarted is not None
+    assert claimed.attempts == 1
+    assert claim_next_export_job(session, "worker2", orphaned_before, 3).uuid == second_export_job.uuid
+    assert claim_next_export_job(session, "worker2", orphaned_before, 3) is None
+
+
+def test_claim_next_export_job_orphaned(session: Session):
+    export_job = _create_test_export_job(session)
+    now = datetime.datetime.now()
+    claim_next_export_job(session, "worker1", now - datetime.timedelta(minutes=1), 2)
+    # worker1's heartbeat is now stale
+    reclaimed = claim_next_export_job(session, "worker2", now + datetime.timedelta(minutes=1), 2)
+    assert reclaimed.uuid == export_job.uuid
+    assert reclaimed.worker_id == "worker2"
+    assert reclaimed.attempts == 2
+    assert not heartbeat_export_job(session, export_job.uuid, "worker1")
+    assert heartbeat_export_job(session, export_job.uuid, "worker2")
+    # out of attempts, so it's failed rather than claimed again
+    assert claim_next_export_job(session, "worker3", now + datetime.timedelta(minutes=1), 2) is None
+    session.refresh(export_job)
+    assert export_job.tcompleted is not None
+    assert export_job.error is not None
+
+
+def test_cancel_export_job(session: Session):
+    queued_export_job = _create_test_export_job(session)
+    assert cancel_export_job(session, queued_export_job.uuid)
+    session.refresh(queued_export_job)
+    assert queued_export_job.tcompleted is not None
+    assert queued_export_job.error == sqlmodel_database.EXPORT_JOB_CANCELLED
+    # already completed
+    assert not cancel_export_job(session, queued_export_job.uuid)
+
+    running_export_job = _create_test_export_job(session)
+    claim_next_export_job(session, "worker1", datetime.datetime.now(), 3)
+    assert heartbeat_export_job(session, running_export_job.uuid, "worker1")
+    assert cancel_export_job(session, running_export_job.uuid)
+    session.refresh(running_export_job)
+    # the worker completes it once its heartbeat fails
+    assert running_export_job.tcompleted is None
+    assert running_export_job.tcancelled is not None
+    assert not heartbeat_export_job(session, running_export_job.uuid, "worker1")
+    assert claim_next_export_job(session, "worker2", datetime.datetime.now() + datetime.timedelta(minutes=1), 3) is None
+
+
+def test_finish_export_job(session: Session):
+    export_job = _create_test_export_job(session)
+    now = datetime.datetime.now()
+    claim_next_export_job(session, "worker1", now - datetime.timedelta(minutes=1), 3)
+    claim_next_export_job(session, "worker2", now + datetime.timedelta(minutes=1), 3)
+    # worker1 lost the job to worker2, so it can't complete it
+    assert not finish_export_job(session, export_job.uuid, "worker1", {"error": sqlmodel_database.EXPORT_JOB_CANCELLED})
+    session.refresh(export_job)
+    assert export_job.tcompleted is None
+    assert export_job.error is None
+    assert finish_export_job(session, export_job.uuid, "worker2", {"file_path": "/tmp/foo.jsonl", "rows_written": 2})
+    session.refresh(export_job)
+    assert export_job.tcompleted is not None
+    assert export_job.file_path == "/tmp/foo.jsonl"
+    assert export_job.rows_written == 2
+    # already completed
+    assert not finish_export_job(session, export_job.uuid, "worker2", {"error": "Export Error"})
+
+
+def test_save_h3_counts(session: Session):
+    save_h3_counts(session, "*:*", 1, {"81033ffffffffff": 5, "81047ffffffffff": 2})
+    save_h3_counts(session, "source:SESAR", 1, {"81033ffffffffff": 1})
+    assert h3_counts_for_query(session, "*:*", 1) == {"81033ffffffffff": 5, "81047ffffffffff": 2}
+    assert h3_counts_for_query(session, "*:*", 2) == {}
+    assert sorted(materialized_h3_count_queries(session)) == ["*:*", "source:SESAR"]
+    # saving again should replace the previous counts rather than add to them
+    save_h3_counts(session, "*:*", 1, {"81033ffffffffff": 6})
+    assert h3_counts_for_query(session, "*:*", 1) == {"81033ffffffffff": 6}
+
+
+def test_save_thing_core_content(session: Session):
+    tstamp = datetime.datetime(2023, 1, 1)
+    assert get_thing_core_content(session, "123456", tstamp, 1) is None
+    save_thing_core_content(session, "123456", tstamp, 1, {"foo": "bar"})
+    assert get_thing_core_content(session, "123456", tstamp, 1) == {"foo": "bar"}
+    # a different thing tstamp or transformer version means the cached content is stale
+    assert get_thing_core_content(session, "123456", datetime.datetime(2023, 1, 2), 1) is None
+    assert get_thing_core_content(session, "123456", tstamp, 2) is None
+    save_thing_core_content(session, "123456", tstamp, 2, {"foo": "baz"})
+    assert get_thing_core_content(session, "123456", tstamp, 2) == {"foo": "baz"}
+
+
+def test_get_thing_tstamp_and_authority(session: Session):
+    assert get_thing_tstamp_and_authority(session, "123456") is None
+    tstamp = datetime.datetime(2023, 1, 1)
+    new_thing = Thing(
+        id="123456",
+        authority_id="test",
+        resolved_url="http://foo.bar",
+        resolved_status=200,
+        tstamp=tstamp,
+    )
+    session.add(new_thing)
+    session.commit()
+    assert get_thing_tstamp_and_authority(session, "123456") == (tstamp, "test")
+
+
+def test_iterate_things_with_ids(session: Session):
+    _add_some_things(session, 5, "SESAR")
+    identifiers = [thing.id for thing in session.exec(select(Thing)).all()]
+    rows = list(iterate_things_with_ids(session, identifiers + ["not_a_thing"], chunk_size=2))
+    assert len(rows) == 5
+    assert rows[0]["resolved_content"] is not None
+    projected_rows = list(iterate_things_with_ids(session, identifiers, ["id"], chunk_size=2))
+    assert sorted(row["id"] for row in projected_rows) == sorted(identifiers)
+    assert all(list(row.keys()) == ["id"] for row in projected_rows)
+
+
+def test_thing_identifiers_index_created_with_thing_table():
+    statements = []
+    engine = sqlalchemy.create_mock_engine(
+        "postgresql://", lambda sql, *multiparams, **params: statements.append(str(sql.compile(dialect=engine.dialect)))
+    )
+    SQLModel.metadata.create_all(engine, tables=[Thing.__table__], checkfirst=False)  # type: ignore
+    index_statements = [statement for statement in statements if THING_IDENTIFIERS_INDEX_NAME in statement]
+    assert len(index_statements) == 1
+    assert "USING GIN ((identifiers::jsonb) jsonb_path_ops)" in index_statements[0]
@@ -0,0 +1,70 @@
+import logging
+
+from isb_lib.utilities import stage_timer
+
+
+def test_time_accumulates():
+    timer = stage_timer.StageTimer("test")
+    timer.add("fetch", 1.5, 10)
+    timer.add("fetch", 0.5, 5)
+    with timer.time("post", 3):
+        pass
+    assert timer.stage_seconds["fetch"] == 2.0
+    assert timer.stage_records["fetch"] == 15
+    assert timer.stage_records["post"] == 3
+    assert list(timer.stage_seconds.keys()) == ["fetch", "post"]
+
+
+def test_timed_iter():
+    timer = stage_timer.StageTimer("test")
+    assert list(timer.timed_iter("fetch", iter([1, 2, 3]))) == [1, 2, 3]
+    assert timer.stage_records["fetch"] == 3
+    assert timer.stage_seconds["fetch"] >= 0
+
+
+def test_timed_without_active_timer():
+    with stage_timer.timed("transform", 1):
+        pass
+
+
+def test_timed_with_active_timer():
+    timer = stage_timer.StageTimer("test")
+    with stage_timer.activate(timer):
+        with stage_timer.timed("transform", 1):
+            pass
+    with stage_timer.timed("transform", 1):
+        pass
+    assert timer.stage_records["transform"] == 1
+
+
+def test_summary():
+    timer = stage_timer.StageTimer("solr_import")
+    timer.records = 100
+    timer.add("solr_post", 2.0, 100)
+    summary = timer.summary()
+    assert summary.startswith("solr_import: 100 records")
+    assert "solr_post 2.0s" in summary
+    assert "50/s" in summary
+
+
+def test_prometheus_text():
+    timer = stage_timer.StageTimer("solr_import", {"authority": "SESAR"})
+    timer.records = 7
+    timer.add("db_fetch", 1.0, 7)
+    text = timer.prometheus_text()
+    assert 'isamples_solr_import_stage_seconds_total{authority="SESAR",stage="db_fetch"} 1.0' in text
+    assert 'isamples_solr_import_stage_records_total{authority="SESAR",stage="db_fetch"} 7' in text
+    assert 'isamples_solr_import_records_total{authority="SESAR"} 7' in text
+
+
+def test_reporter_writes_text_file(tmp_path, caplog):
+    path = tmp_path / "solr_import.prom"
+    timer = stage_timer.StageTimer("solr_import")
+    reporter = stage_timer.StageReporter(timer, 3600, str(path))
+    with caplog.at_level(logging.INFO):
+        reporter.maybe_report()
+        assert not path.exists()
+        reporter.report()
+    assert "isamples_solr_import_records_total{} 0" in path.read_text()
+    assert not (tmp_path / "solr_import.prom.tmp").exists()
+    assert "solr_import: 0 records" in caplog.text
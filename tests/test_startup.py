@@ -0,0 +1,35 @@
+import pytest
+
+from isb_web.startup import WarmupTask
+
+
+def test_warmup_task_runs_once():
+    invocations = []
+
+    def load():
+        invocations.append(1)
+        return {"foo": "bar"}
+
+    task = WarmupTask("test", load)
+    assert not task.ready
+    assert task.ensure() == {"foo": "bar"}
+    assert task.ensure() == {"foo": "bar"}
+    assert len(invocations) == 1
+    assert task.status()["ready"]
+
+
+def test_warmup_task_retries_after_failure():
+    attempts = []
+
+    def load():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ValueError("not yet")
+        return "loaded"
+
+    task = WarmupTask("test", load)
+    with pytest.raises(ValueError):
+        task.ensure()
+    assert task.status() == {"ready": False, "duration_seconds": None, "error": "not yet"}
+    assert task.ensure() == "loaded"
+    assert task.status()["error"] is None
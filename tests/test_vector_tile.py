@@ -0,0 +1,58 @@
+import pytest
+
+from isb_lib.utilities.vector_tile import (
+    DEFAULT_EXTENT,
+    MAX_MERCATOR_LATITUDE,
+    VectorTileLayer,
+    encode_tile,
+    is_valid_tile,
+    tile_bounds,
+)
+
+
+def test_tile_bounds_world():
+    min_lon, min_lat, max_lon, max_lat = tile_bounds(0, 0, 0)
+    assert min_lon == -180.0
+    assert max_lon == 180.0
+    assert min_lat == pytest.approx(-MAX_MERCATOR_LATITUDE)
+    assert max_lat == pytest.approx(MAX_MERCATOR_LATITUDE)
+
+
+def test_tile_bounds_quadrant():
+    assert tile_bounds(1, 1, 0) == pytest.approx((0.0, 0.0, 180.0, MAX_MERCATOR_LATITUDE))
+
+
+def test_is_valid_tile():
+    assert is_valid_tile(0, 0, 0)
+    assert is_valid_tile(3, 7, 7)
+    assert not is_valid_tile(3, 8, 0)
+    assert not is_valid_tile(-1, 0, 0)
+
+
+def test_project_tile_corners():
+    z, x, y = 5, 10, 12
+    min_lon, min_lat, max_lon, max_lat = tile_bounds(z, x, y)
+    layer = VectorTileLayer("test", z, x, y)
+    assert layer.project(min_lon, max_lat) == (0, 0)
+    assert layer.project(max_lon, min_lat) == (DEFAULT_EXTENT, DEFAULT_EXTENT)
+
+
+def test_add_polygon_collapsed():
+    layer = VectorTileLayer("test", 0, 0, 0)
+    tiny = [[0.0, 0.0], [0.000001, 0.0], [0.0, 0.000001], [0.0, 0.0]]
+    assert not layer.add_polygon([tiny], {"h3": "tiny"})
+    assert len(layer) == 0
+    square = [[-10.0, -10.0], [10.0, -10.0], [10.0, 10.0], [-10.0, 10.0], [-10.0, -10.0]]
+    assert layer.add_polygon([square], {"h3": "square", "n": 3})
+    assert len(layer) == 1
+
+
+def test_encode_tile_skips_empty_layers():
+    empty = VectorTileLayer("empty", 0, 0, 0)
+    assert encode_tile([empty]) == b""
+    points = VectorTileLayer("samples", 0, 0, 0)
+    points.add_point(0.0, 0.0, {"id": "ark:/123", "source": "SESAR"})
+    encoded = encode_tile([empty, points])
+    assert b"samples" in encoded
+    assert b"empty" not in encoded
+    assert b"ark:/123" in encoded